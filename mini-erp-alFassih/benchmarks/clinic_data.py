@@ -0,0 +1,229 @@
+"""
+Fills an empty database with a synthetic clinic for benchmarking.
+
+Patients, therapists (each with a login), sessions and documents are
+generated from a fixed random seed, so the same arguments always build the
+same clinic, and inserted in bulk through Core statements. Past sessions are
+mostly Completed, with some Cancelled and No Show; sessions in the next
+--future-days are Scheduled. Afterwards the patient summary columns and the
+reporting rollups are rebuilt, as the app would have maintained them.
+
+Documents all point at a handful of sample files written to --uploads, so
+downloads work without writing hundreds of thousands of files.
+
+    python benchmarks/clinic_data.py [--database URL] [--patients 10000] [--therapists 20]
+                                     [--sessions 200000] [--documents 20000] [--seed 1]
+
+The defaults build in about a minute; e.g. --patients 100000 --therapists 50
+--sessions 5000000 --documents 500000 builds a large clinic. The users
+bench-admin@example.com and bench-staff@example.com get the password
+BENCH_PASSWORD; benchmarks/endpoints.py logs in with them.
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+BENCH_DIR = os.path.join(tempfile.gettempdir(), 'alfassih-bench')
+DEFAULT_DATABASE = 'sqlite:///' + os.path.join(BENCH_DIR, 'clinic.db')
+DEFAULT_UPLOADS = os.path.join(BENCH_DIR, 'uploads')
+ADMIN_EMAIL = 'bench-admin@example.com'
+STAFF_EMAIL = 'bench-staff@example.com'
+BENCH_PASSWORD = 'benchpass'
+SAMPLE_FILES = [f'bench-sample-{n}.pdf' for n in range(8)]
+SAMPLE_FILE_BYTES = 200 * 1024
+
+FIRST_NAMES = ['Adam', 'Yasmine', 'Omar', 'Lina', 'Youssef', 'Salma', 'Ilyas', 'Nour', 'Rayan', 'Aya', 'Hamza',
+               'Malak', 'Zakaria', 'Imane', 'Mehdi', 'Hiba', 'Anas', 'Sara', 'Amine', 'Rim', 'Karim', 'Inès',
+               'Bilal', 'Ghita', 'Tariq', 'Leïla', 'Ayoub', 'Kenza', 'Nabil', 'Chaïmae']
+LAST_NAMES = ['Alaoui', 'Benali', 'El Idrissi', 'Tazi', 'Bennani', 'Chraibi', 'El Fassi', 'Berrada', 'Lahlou',
+              'Benjelloun', 'Kettani', 'Sqalli', 'Amrani', 'Ouazzani', 'Naciri', 'Filali', 'Mansouri', 'Haddad',
+              'Rahmouni', 'Bouzidi', 'Cherkaoui', 'Zniber', 'Guessous', 'Lamrani', 'Sebti', 'El Khatib']
+SPECIALIZATIONS = ['Orthophonie', 'Psychomotricité', 'Bégaiement', 'Troubles du langage oral', 'Dyslexie']
+SESSION_TYPES = ['Bilan', 'Rééducation', 'Suivi', 'Guidance parentale', None]
+DOCUMENT_TYPES = ['Bilan', 'Plan Thérapeutique', 'Compte rendu', 'Ordonnance', None]
+PAST_STATUSES = ['Completed'] * 80 + ['Cancelled'] * 12 + ['No Show'] * 8
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _timestamp(rng, start, end):
+    return start + timedelta(seconds=rng.randrange(int((end - start).total_seconds())))
+
+def _slot(rng, start, days):
+    """A half-hour slot on a weekday between 08:00 and 17:30."""
+    day = start + timedelta(days=rng.randrange(days))
+    while day.weekday() >= 5:
+        day += timedelta(days=1)
+    return day.replace(hour=8 + rng.randrange(10), minute=rng.choice((0, 30)))
+
+def patient_rows(rng, count, history_start, now):
+    from mini_erp_alFassih.matching import patient_match_key
+    for _ in range(count):
+        first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        date_of_birth = date(2008, 1, 1) + timedelta(days=rng.randrange(16 * 365)) if rng.random() < 0.9 else None
+        created_at = _timestamp(rng, history_start, now)
+        yield {
+            'first_name': first_name,
+            'last_name': last_name,
+            'date_of_birth': date_of_birth,
+            'contact_info': f'06{rng.randrange(10 ** 8):08d}',
+            'anamnesis': 'Retard de langage signalé par l\'école.' if rng.random() < 0.3 else None,
+            'created_at': created_at,
+            'updated_at': created_at,
+            'match_key': patient_match_key(first_name, last_name, date_of_birth), # Bulk inserts skip the ORM hook
+        }
+
+def _patient_id(rng, patients):
+    return int(patients * rng.random() ** 1.5) + 1 # Skewed: some patients have long histories
+
+def session_rows(rng, count, patients, therapists, history_start, now, future_days):
+    history_days = (now - history_start).days
+    for _ in range(count):
+        upcoming = rng.random() < future_days / (history_days + future_days)
+        start = _slot(rng, now, future_days) if upcoming else _slot(rng, history_start, history_days)
+        yield {
+            'patient_id': _patient_id(rng, patients),
+            'therapist_id': rng.randrange(therapists) + 1,
+            'start_time': start,
+            'end_time': start + timedelta(minutes=rng.choice((30, 45, 60))),
+            'session_type': rng.choice(SESSION_TYPES),
+            'status': 'Scheduled' if start >= now else rng.choice(PAST_STATUSES),
+            'notes': 'Progrès sur les sons /ch/ et /j/.' if rng.random() < 0.2 else None,
+            'updated_at': min(start, now),
+        }
+
+def document_rows(rng, count, patients, history_start, now):
+    for n in range(count):
+        yield {
+            'patient_id': _patient_id(rng, patients),
+            'document_type': rng.choice(DOCUMENT_TYPES),
+            'title': f'Document {n + 1}',
+            'filename': rng.choice(SAMPLE_FILES),
+            'uploaded_at': _timestamp(rng, history_start, now),
+        }
+
+def _insert(connection, table, rows, batch_size, label, total):
+    started = time.perf_counter()
+    inserted = 0
+    for batch in _batches(rows, batch_size):
+        connection.execute(table.insert(), batch)
+        connection.commit()
+        inserted += len(batch)
+        print(f'\r  {label}: {inserted:,}/{total:,}', end='', flush=True)
+    print(f'\r  {label}: {inserted:,} in {time.perf_counter() - started:.1f}s')
+
+def write_sample_files(uploads):
+    os.makedirs(uploads, exist_ok=True)
+    rng = random.Random(0)
+    for name in SAMPLE_FILES:
+        with open(os.path.join(uploads, name), 'wb') as output:
+            output.write(b'%PDF-1.4\n' + rng.randbytes(SAMPLE_FILE_BYTES))
+
+def config_name(database):
+    return 'postgres' if database.startswith(('postgres://', 'postgresql')) else 'production'
+
+def use_database(database):
+    """Points the app config at database; call before mini_erp_alFassih is imported."""
+    os.environ['DATABASE_URL'] = database # Read when the config module is imported
+    os.environ.setdefault('LOG_FILE_PATH', os.path.join(BENCH_DIR, 'alfassih.log')) # Keep runs out of instance/
+    if database.startswith('sqlite:///'):
+        os.makedirs(os.path.dirname(os.path.abspath(database[len('sqlite:///'):])), exist_ok=True)
+
+def bench_app(uploads=None):
+    """The production app, adjusted for benchmarking over plain http on this machine.
+    Also the WSGI app the load test starts servers with (uploads then come from BENCH_UPLOADS)."""
+    from mini_erp_alFassih import create_app
+    app = create_app(config_name(os.environ.get('DATABASE_URL', '')))
+    app.config.update(
+        SESSION_COOKIE_SECURE=False, REMEMBER_COOKIE_SECURE=False, # Clients connect without TLS
+        SERVER_TIMING_HEADER=True, # Per-request query counts for the reports
+        UPLOAD_FOLDER=uploads or os.environ.get('BENCH_UPLOADS') or DEFAULT_UPLOADS,
+    )
+    return app
+
+def build(args):
+    from mini_erp_alFassih import db
+    from mini_erp_alFassih.models import User, Patient, Therapist, Session, Document
+    from mini_erp_alFassih.summaries import refresh_patient_summaries
+    from mini_erp_alFassih.rollups import refresh_rollups
+
+    app = bench_app(args.uploads)
+    rng = random.Random(args.seed)
+    now = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    history_start = now - timedelta(days=args.history_days)
+    with app.app_context():
+        db.create_all()
+        if db.session.scalar(db.select(db.func.count(Patient.id))):
+            sys.exit(f'{args.database} already contains patients; point --database at an empty database.')
+
+        template = User(email=ADMIN_EMAIL)
+        template.set_password(BENCH_PASSWORD) # Hashed once; every bench user shares it
+        users = [{'email': ADMIN_EMAIL, 'role': 'admin', 'first_name': 'Bench', 'last_name': 'Admin'},
+                 {'email': STAFF_EMAIL, 'role': 'staff', 'first_name': 'Bench', 'last_name': 'Staff'}]
+        users += [{'email': f'bench-therapist-{n}@example.com', 'role': 'therapist',
+                   'first_name': rng.choice(FIRST_NAMES), 'last_name': rng.choice(LAST_NAMES)}
+                  for n in range(1, args.therapists + 1)]
+        for user in users:
+            user.update(password_hash=template.password_hash, is_active=True)
+
+        print(f'Building a clinic in {args.database} (seed {args.seed})')
+        with db.engine.connect() as connection:
+            _insert(connection, User.__table__, users, args.batch, 'users', len(users))
+            therapist_users = connection.execute(db.select(User.id, User.first_name, User.last_name)
+                                                 .where(User.role == 'therapist').order_by(User.id)).all()
+            _insert(connection, Therapist.__table__,
+                    [{'user_id': user_id, 'first_name': first, 'last_name': last,
+                      'specialization': rng.choice(SPECIALIZATIONS)} for user_id, first, last in therapist_users],
+                    args.batch, 'therapists', args.therapists)
+            _insert(connection, Patient.__table__, patient_rows(rng, args.patients, history_start, now),
+                    args.batch, 'patients', args.patients)
+            _insert(connection, Session.__table__,
+                    session_rows(rng, args.sessions, args.patients, args.therapists, history_start, now, args.future_days),
+                    args.batch, 'sessions', args.sessions)
+            _insert(connection, Document.__table__, document_rows(rng, args.documents, args.patients, history_start, now),
+                    args.batch, 'documents', args.documents)
+
+            started = time.perf_counter()
+            refresh_patient_summaries(connection, now=now)
+            connection.commit()
+            print(f'  patient summaries: {time.perf_counter() - started:.1f}s')
+
+        started = time.perf_counter()
+        refresh_rollups(now=now, lag=0, rebuild=True)
+        db.session.commit()
+        print(f'  rollups: {time.perf_counter() - started:.1f}s')
+    write_sample_files(args.uploads)
+    print(f'  sample documents: {args.uploads}')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--database', default=DEFAULT_DATABASE, help='SQLAlchemy URL of an empty database.')
+    parser.add_argument('--uploads', default=DEFAULT_UPLOADS, help='Directory for the sample document files.')
+    parser.add_argument('--patients', type=int, default=10000)
+    parser.add_argument('--therapists', type=int, default=20)
+    parser.add_argument('--sessions', type=int, default=200000)
+    parser.add_argument('--documents', type=int, default=20000)
+    parser.add_argument('--history-days', type=int, default=3 * 365, help='Days of past activity.')
+    parser.add_argument('--future-days', type=int, default=60, help='Days ahead with scheduled sessions.')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed; the same seed builds the same clinic.')
+    parser.add_argument('--batch', type=int, default=10000, help='Rows per INSERT batch and commit.')
+    args = parser.parse_args()
+    use_database(args.database)
+    build(args)
+
+if __name__ == '__main__':
+    main()
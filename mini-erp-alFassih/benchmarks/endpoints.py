@@ -0,0 +1,205 @@
+"""
+Times the app's key pages against a clinic built by clinic_data.py.
+
+Each scenario is requested --repeat times through the Flask test client, after
+--warmup untimed requests, and reported with its p50/p99 latency, the mean
+number of SQL statements and the mean database time per request (taken from
+the Server-Timing header, see querystats.py). The app runs with the production
+config, so caches and instrumentation behave as they do when deployed.
+
+    python benchmarks/endpoints.py [--database URL] [--repeat 50] [--only list_patients view_patient]
+                                   [--save results.json] [--compare baseline.json]
+
+--save writes the results together with the git commit and the clinic's row
+counts; --compare prints the change against such a file, so a branch can be
+measured against the commit it started from on the same data.
+"""
+
+import argparse
+import io
+import json
+import math
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from clinic_data import (ADMIN_EMAIL, BENCH_PASSWORD, DEFAULT_DATABASE, DEFAULT_UPLOADS, SAMPLE_FILE_BYTES,
+                         bench_app, use_database)
+
+_SERVER_TIMING = re.compile(r'db;dur=([\d.]+);desc="(\d+) queries"')
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    return values[max(math.ceil(fraction * len(values)) - 1, 0)]
+
+class Bench:
+    def __init__(self, app, seed):
+        self.app = app
+        self.rng = random.Random(seed)
+        self.client = self.login(app.test_client())
+        from mini_erp_alFassih import db
+        from mini_erp_alFassih.models import Patient, Document
+        with app.app_context():
+            self.patients = db.session.scalar(db.select(db.func.max(Patient.id))) or 0
+            self.documents = db.session.scalar(db.select(db.func.max(Document.id))) or 0
+        if not self.patients:
+            sys.exit('The database has no patients; build a clinic with benchmarks/clinic_data.py first.')
+
+    def login(self, client):
+        response = client.post('/login', data={'email': ADMIN_EMAIL, 'password': BENCH_PASSWORD})
+        if response.status_code != 302:
+            sys.exit(f'Could not log in as {ADMIN_EMAIL} (HTTP {response.status_code}).')
+        return client
+
+    # Scenarios: each issues one request and returns the response
+    def scenario_login(self):
+        return self.app.test_client().post('/login', data={'email': ADMIN_EMAIL, 'password': BENCH_PASSWORD})
+
+    def scenario_list_patients(self):
+        return self.client.get('/patients/')
+
+    def scenario_search_patients(self):
+        from clinic_data import LAST_NAMES
+        return self.client.get('/patients/', query_string={'q': self.rng.choice(LAST_NAMES)[:4]})
+
+    def scenario_view_patient(self):
+        return self.client.get(f'/patients/{self.rng.randrange(self.patients) + 1}')
+
+    def scenario_list_sessions(self):
+        return self.client.get('/sessions/')
+
+    def scenario_admin_dashboard(self):
+        return self.client.get('/admin/dashboard')
+
+    def scenario_upload_document(self):
+        response = self.client.post(f'/patients/{self.rng.randrange(self.patients) + 1}/documents/upload',
+                                    data={'title': 'Benchmark upload',
+                                          'file': (io.BytesIO(b'%PDF-1.4\n' + self.rng.randbytes(SAMPLE_FILE_BYTES)),
+                                                   'benchmark.pdf')},
+                                    content_type='multipart/form-data')
+        return response
+
+    def scenario_download_document(self):
+        return self.client.get(f'/patients/documents/{self.rng.randrange(self.documents) + 1}/download')
+
+    def run(self, name, repeat, warmup):
+        scenario = getattr(self, f'scenario_{name}')
+        for _ in range(warmup):
+            scenario().close()
+        latencies, queries, db_ms, statuses = [], [], [], {}
+        for _ in range(repeat):
+            started = time.perf_counter()
+            response = scenario()
+            response.get_data() # Streamed bodies are produced while being read
+            latencies.append((time.perf_counter() - started) * 1000)
+            response.close()
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            timing = _SERVER_TIMING.search(response.headers.get('Server-Timing', ''))
+            if timing:
+                db_ms.append(float(timing.group(1)))
+                queries.append(int(timing.group(2)))
+        latencies.sort()
+        return {
+            'requests': repeat,
+            'p50_ms': round(percentile(latencies, 0.5), 2),
+            'p99_ms': round(percentile(latencies, 0.99), 2),
+            'mean_ms': round(sum(latencies) / repeat, 2),
+            'max_ms': round(latencies[-1], 2),
+            'queries': round(sum(queries) / len(queries), 1) if queries else None,
+            'db_ms': round(sum(db_ms) / len(db_ms), 2) if db_ms else None,
+            'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        }
+
+    def clean_up(self):
+        """Removes the documents the upload scenario added, keeping the clinic the same for the next run."""
+        from mini_erp_alFassih import db
+        from mini_erp_alFassih.models import Document
+        with self.app.app_context():
+            for document in Document.query.filter(Document.title == 'Benchmark upload').all():
+                path = os.path.join(self.app.config['UPLOAD_FOLDER'], document.filename)
+                if os.path.exists(path):
+                    os.remove(path)
+                db.session.delete(document)
+            db.session.commit()
+
+SCENARIOS = [name[len('scenario_'):] for name in vars(Bench) if name.startswith('scenario_')]
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _clinic_size(app):
+    from mini_erp_alFassih import db
+    from mini_erp_alFassih.models import Patient, Therapist, Session, Document
+    with app.app_context():
+        return {model.__tablename__: db.session.scalar(db.select(db.func.count()).select_from(model))
+                for model in (Patient, Therapist, Session, Document)}
+
+def _change(new, old):
+    if new is None or not old:
+        return ''
+    return f'{(new - old) / old * 100:+.0f}%'
+
+def report(results, baseline=None):
+    print(f"{'scenario':<20}{'p50 ms':>9}{'p99 ms':>9}{'mean ms':>9}{'queries':>9}{'db ms':>8}  statuses")
+    for name, result in results.items():
+        print(f"{name:<20}{result['p50_ms']:>9.1f}{result['p99_ms']:>9.1f}{result['mean_ms']:>9.1f}"
+              f"{result['queries'] if result['queries'] is not None else '-':>9}"
+              f"{result['db_ms'] if result['db_ms'] is not None else '-':>8}  "
+              f"{' '.join(f'{status}x{count}' for status, count in result['statuses'].items())}")
+        old = (baseline or {}).get('results', {}).get(name)
+        if old:
+            queries = '' if result['queries'] is None or old['queries'] is None else f"{result['queries'] - old['queries']:+g}"
+            print(f"{'  vs ' + (baseline.get('commit') or 'baseline'):<20}{_change(result['p50_ms'], old['p50_ms']):>9}"
+                  f"{_change(result['p99_ms'], old['p99_ms']):>9}{_change(result['mean_ms'], old['mean_ms']):>9}"
+                  f"{queries:>9}{_change(result['db_ms'], old['db_ms']):>8}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--database', default=DEFAULT_DATABASE, help='Database built by clinic_data.py.')
+    parser.add_argument('--uploads', default=DEFAULT_UPLOADS, help='Upload folder used by clinic_data.py.')
+    parser.add_argument('--repeat', type=int, default=50, help='Timed requests per scenario.')
+    parser.add_argument('--warmup', type=int, default=5, help='Untimed requests per scenario first.')
+    parser.add_argument('--only', nargs='+', choices=SCENARIOS, metavar='SCENARIO',
+                        help=f"Scenarios to run (default: all of {', '.join(SCENARIOS)}).")
+    parser.add_argument('--seed', type=int, default=1, help='Seed for picking patients and documents.')
+    parser.add_argument('--save', help='Write the results to this JSON file.')
+    parser.add_argument('--compare', help='Results file of an earlier run to compare against.')
+    args = parser.parse_args()
+
+    use_database(args.database)
+    app = bench_app(args.uploads)
+    app.config['WTF_CSRF_ENABLED'] = False # Forms are posted without first fetching them
+
+    bench = Bench(app, args.seed)
+    results = {}
+    try:
+        for name in args.only or SCENARIOS:
+            results[name] = bench.run(name, args.repeat, args.warmup)
+    finally:
+        bench.clean_up()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as source:
+            baseline = json.load(source)
+    clinic = _clinic_size(app)
+    print(f"Clinic: {', '.join(f'{count:,} {table}s' for table, count in clinic.items())}; "
+          f"{args.repeat} requests per scenario")
+    report(results, baseline)
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as output:
+            json.dump({'commit': _git_commit(), 'date': datetime.now().isoformat(timespec='seconds'),
+                       'python': platform.python_version(), 'database': app.config['SQLALCHEMY_DATABASE_URI'].split(':')[0],
+                       'clinic': clinic, 'repeat': args.repeat, 'results': results}, output, indent=2)
+
+if __name__ == '__main__':
+    main()
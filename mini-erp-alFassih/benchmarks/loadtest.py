@@ -0,0 +1,329 @@
+"""
+Load test: how many concurrent front-desk users one node supports.
+
+Starts the app under a production WSGI server (gunicorn, or waitress with
+--server waitress, e.g. on Windows) against a clinic built by clinic_data.py, then runs
+--users virtual users, started evenly over --ramp seconds, until --duration
+seconds have passed. Each user logs in through the login form and then keeps
+choosing one of the SCENARIOS by weight: searching for a patient, opening a
+patient, booking a session, uploading a document, or logging out and in again.
+Between actions a user pauses for a random think time averaging --think
+seconds (0 drives the server as hard as the users can).
+
+Forms are fetched before they are posted, with the CSRF token taken from the
+page, as a browser would. Each request is recorded with its latency and
+whether it got the expected status; connection failures and timeouts count
+as errors. The results -- throughput, latency percentiles and error rates
+overall, per request type and per second of the run -- are written as JSON
+to --output (or stdout), with a summary on stderr. Sessions and documents the
+run created are deleted afterwards.
+
+    python benchmarks/loadtest.py [--users 20] [--ramp 10] [--duration 60] [--think 1]
+                                  [--server gunicorn] [--workers 4] [--threads 4] [--output load.json]
+
+Pass --url to load a server that is already running instead (nothing is then
+started or cleaned up; --database must still be the clinic the server uses).
+"""
+
+import argparse
+import http.client
+import importlib.util
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from urllib.parse import urlencode, urlsplit
+
+from clinic_data import (ADMIN_EMAIL, STAFF_EMAIL, BENCH_PASSWORD, DEFAULT_DATABASE, DEFAULT_UPLOADS,
+                         LAST_NAMES, SAMPLE_FILE_BYTES, bench_app, config_name, use_database)
+from endpoints import percentile, _git_commit
+
+SCENARIOS = { # Relative weights of what a front-desk user does next
+    'search': 40,
+    'open_patient': 30,
+    'book_session': 15,
+    'upload_document': 5,
+    'relogin': 10,
+}
+LOAD_TEST_MARK = 'Load test' # Title of uploaded documents and notes of booked sessions, for the clean-up
+_CSRF_TOKEN = re.compile(r'<meta name="csrf-token" content="([^"]+)"')
+
+class VirtualUser(threading.Thread):
+    def __init__(self, number, target, start_at, deadline, think, clinic, epoch):
+        super().__init__(name=f'virtual-user-{number}', daemon=True)
+        self.email = ADMIN_EMAIL if number % 2 else STAFF_EMAIL
+        self.host, self.port = target
+        self.start_at = start_at
+        self.deadline = deadline
+        self.think = think
+        self.clinic = clinic
+        self.epoch = epoch
+        self.rng = random.Random(number)
+        self.samples = [] # (seconds since the run started, label, latency ms, status or error name, ok)
+        self.cookies = {}
+        self.connection = None
+
+    def _connect(self):
+        if self.connection is not None:
+            self.connection.close()
+        self.connection = http.client.HTTPConnection(self.host, self.port, timeout=30)
+
+    def request(self, label, method, path, body=None, content_type=None, expect=200):
+        """Sends one request on the user's keep-alive connection; returns the page text, or None on failure."""
+        headers = {'Cookie': '; '.join(f'{name}={value}' for name, value in self.cookies.items())}
+        if content_type:
+            headers['Content-Type'] = content_type
+        started = time.perf_counter()
+        try:
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            text = response.read().decode('utf-8', 'replace')
+            outcome = response.status
+            for cookie in response.headers.get_all('Set-Cookie') or ():
+                name, _, value = cookie.split(';', 1)[0].partition('=')
+                if value:
+                    self.cookies[name.strip()] = value
+                else: # Cleared, e.g. the remember cookie on logout
+                    self.cookies.pop(name.strip(), None)
+        except (OSError, http.client.HTTPException) as error:
+            text, outcome = None, type(error).__name__
+            self._connect() # The connection may be half-used; start afresh
+        latency_ms = (time.perf_counter() - started) * 1000
+        ok = outcome == expect
+        self.samples.append((started - self.epoch, label, latency_ms, outcome, ok))
+        return text if ok else None
+
+    def _form_token(self, label, path):
+        page = self.request(label, 'GET', path)
+        match = _CSRF_TOKEN.search(page or '')
+        return match.group(1) if match else None
+
+    def _post_form(self, label, path, token, fields):
+        return self.request(label, 'POST', path, body=urlencode(dict(fields, csrf_token=token)),
+                            content_type='application/x-www-form-urlencoded', expect=302)
+
+    def _patient_id(self):
+        return self.rng.randrange(self.clinic['patients']) + 1
+
+    # Scenarios
+    def login(self):
+        self.cookies.clear()
+        token = self._form_token('login form', '/login')
+        if token is not None:
+            self._post_form('login', '/login', token, {'email': self.email, 'password': BENCH_PASSWORD})
+
+    def relogin(self):
+        self.request('logout', 'GET', '/logout', expect=302)
+        self.login()
+
+    def search(self):
+        self.request('search', 'GET', '/patients/?' + urlencode({'q': self.rng.choice(LAST_NAMES)[:self.rng.randint(3, 6)]}))
+
+    def open_patient(self):
+        self.request('open patient', 'GET', f'/patients/{self._patient_id()}')
+
+    def book_session(self):
+        patient_id = self._patient_id()
+        token = self._form_token('booking form', f'/sessions/new?patient_id={patient_id}')
+        if token is None:
+            return
+        start = (datetime.now() + timedelta(days=self.rng.randint(1, 30))).replace(
+            hour=self.rng.randint(8, 17), minute=self.rng.choice((0, 30)))
+        self._post_form('book session', '/sessions/new', token, {
+            'patient': patient_id, 'therapist': self.rng.randrange(self.clinic['therapists']) + 1,
+            'start_time': start.strftime('%Y-%m-%dT%H:%M'),
+            'end_time': (start + timedelta(minutes=45)).strftime('%Y-%m-%dT%H:%M'),
+            'session_type': 'Suivi', 'status': 'Scheduled', 'notes': LOAD_TEST_MARK,
+        })
+
+    def upload_document(self):
+        patient_id = self._patient_id()
+        path = f'/patients/{patient_id}/documents/upload'
+        token = self._form_token('upload form', path)
+        if token is None:
+            return
+        boundary = uuid.uuid4().hex
+        parts = [f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+                 for name, value in (('csrf_token', token), ('title', LOAD_TEST_MARK), ('document_type', 'Bilan'))]
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="scan.pdf"\r\n'
+                     f'Content-Type: application/pdf\r\n\r\n'.encode()
+                     + b'%PDF-1.4\n' + self.rng.randbytes(SAMPLE_FILE_BYTES) + f'\r\n--{boundary}--\r\n'.encode())
+        self.request('upload document', 'POST', path, body=b''.join(parts),
+                     content_type=f'multipart/form-data; boundary={boundary}', expect=302)
+
+    def run(self):
+        time.sleep(max(self.start_at - time.monotonic(), 0))
+        self._connect()
+        self.login()
+        names, weights = list(SCENARIOS), list(SCENARIOS.values())
+        while time.monotonic() < self.deadline:
+            if self.think:
+                time.sleep(min(self.rng.expovariate(1 / self.think), max(self.deadline - time.monotonic(), 0)))
+                if time.monotonic() >= self.deadline:
+                    break
+            getattr(self, self.rng.choices(names, weights)[0])()
+        self.connection.close()
+
+def _summary(samples, seconds):
+    latencies = sorted(latency for _, _, latency, _, _ in samples)
+    failures = {}
+    for _, _, _, outcome, ok in samples:
+        if not ok:
+            failures[str(outcome)] = failures.get(str(outcome), 0) + 1
+    errors = sum(failures.values())
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'error_rate': round(errors / len(samples), 4) if samples else 0.0,
+        'throughput_rps': round(len(samples) / seconds, 2),
+        'latency_ms': {name: round(percentile(latencies, fraction), 1) if latencies else None
+                       for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p95', 0.95), ('p99', 0.99), ('max', 1.0))},
+        'failures': failures,
+    }
+
+def _free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+def start_server(args, port):
+    """Launches the app under args.server on 127.0.0.1:port and waits until it answers."""
+    if importlib.util.find_spec(args.server) is None:
+        sys.exit(f'{args.server} is not installed; pip install {args.server} (or choose another --server).')
+    bind = f'127.0.0.1:{port}'
+    if args.server == 'gunicorn':
+        command = [sys.executable, '-m', 'gunicorn', '--workers', str(args.workers), '--threads', str(args.threads),
+                   '--bind', bind, '--log-level', 'warning', 'clinic_data:bench_app()']
+    else: # waitress serves from one process with a thread pool
+        command = [sys.executable, '-m', 'waitress', '--listen', bind, '--threads', str(args.threads),
+                   '--call', 'clinic_data:bench_app']
+    env = dict(os.environ, BENCH_UPLOADS=args.uploads, FLASK_CONFIG=config_name(args.database))
+    server = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+    give_up = time.monotonic() + 60
+    while time.monotonic() < give_up:
+        if server.poll() is not None:
+            sys.exit(f'{args.server} exited with status {server.returncode} during start-up.')
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/login')
+            connection.getresponse().read()
+            connection.close()
+            return server
+        except OSError:
+            time.sleep(0.5)
+    server.terminate()
+    sys.exit(f'{args.server} did not answer on {bind} within a minute.')
+
+def clean_up(app):
+    """Deletes the sessions and documents created by the virtual users."""
+    from mini_erp_alFassih import db
+    from mini_erp_alFassih.models import Session, Document
+    with app.app_context():
+        removed = 0
+        for session in Session.query.filter(Session.notes == LOAD_TEST_MARK).all():
+            db.session.delete(session)
+            removed += 1
+        for document in Document.query.filter(Document.title == LOAD_TEST_MARK).all():
+            path = os.path.join(app.config['UPLOAD_FOLDER'], document.filename)
+            if os.path.exists(path):
+                os.remove(path)
+            db.session.delete(document)
+            removed += 1
+        db.session.commit()
+    return removed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--database', default=DEFAULT_DATABASE, help='Database built by clinic_data.py.')
+    parser.add_argument('--uploads', default=DEFAULT_UPLOADS, help='Upload folder used by clinic_data.py.')
+    parser.add_argument('--users', type=int, default=20, help='Concurrent virtual users.')
+    parser.add_argument('--ramp', type=float, default=10, help='Seconds over which the users are started.')
+    parser.add_argument('--duration', type=float, default=60, help='Seconds from the first user starting to the end.')
+    parser.add_argument('--think', type=float, default=1.0, help='Mean pause in seconds between a user\'s actions.')
+    parser.add_argument('--server', choices=('gunicorn', 'waitress'), default='gunicorn')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn worker processes.')
+    parser.add_argument('--threads', type=int, default=4, help='Threads per worker process.')
+    parser.add_argument('--url', help='Load this running server instead of starting one, e.g. http://127.0.0.1:8000')
+    parser.add_argument('--output', help='Write the JSON results here instead of to stdout.')
+    args = parser.parse_args()
+    if args.ramp > args.duration:
+        parser.error('--ramp must not exceed --duration')
+
+    use_database(args.database)
+    app = bench_app(args.uploads)
+    from mini_erp_alFassih import db
+    from mini_erp_alFassih.models import Patient, Therapist
+    with app.app_context():
+        clinic = {'patients': db.session.scalar(db.select(db.func.max(Patient.id))) or 0,
+                  'therapists': db.session.scalar(db.select(db.func.max(Therapist.id))) or 0}
+    if not clinic['patients'] or not clinic['therapists']:
+        sys.exit('The database has no patients or therapists; build a clinic with benchmarks/clinic_data.py first.')
+
+    server = None
+    if args.url:
+        target = urlsplit(args.url)
+        host, port = target.hostname, target.port or 80
+    else:
+        host, port = '127.0.0.1', _free_port()
+        server = start_server(args, port)
+    try:
+        print(f'{args.users} users over {args.ramp:g}s, {args.duration:g}s in total, against '
+              f'{args.url or f"{args.server} ({args.workers} workers x {args.threads} threads)"}', file=sys.stderr)
+        epoch, started = time.perf_counter(), time.monotonic()
+        users = [VirtualUser(n, (host, port), started + args.ramp * n / args.users, started + args.duration,
+                             args.think, clinic, epoch) for n in range(args.users)]
+        for user in users:
+            user.start()
+        for user in users:
+            user.join()
+        elapsed = time.monotonic() - started
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    removed = clean_up(app) if server is not None else 0
+
+    samples = sorted(sample for user in users for sample in user.samples)
+    labels = sorted({label for _, label, _, _, _ in samples})
+    timeline = []
+    for second in range(int(elapsed) + 1):
+        in_second = [s for s in samples if second <= s[0] < second + 1]
+        timeline.append({'second': second, 'requests': len(in_second), 'errors': sum(not s[4] for s in in_second),
+                         'users': sum(1 for user in users if user.start_at - started <= second)})
+    results = {
+        'commit': _git_commit(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'settings': {'users': args.users, 'ramp_s': args.ramp, 'duration_s': args.duration, 'think_s': args.think,
+                     'server': 'external' if args.url else args.server,
+                     'workers': None if args.url or args.server == 'waitress' else args.workers,
+                     'threads': None if args.url else args.threads},
+        'clinic': clinic,
+        'elapsed_s': round(elapsed, 2),
+        'total': _summary(samples, elapsed),
+        'requests': {label: _summary([s for s in samples if s[1] == label], elapsed) for label in labels},
+        'timeline': timeline,
+    }
+
+    print(f"{'request':<18}{'count':>8}{'rps':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}", file=sys.stderr)
+    for label, summary in list(results['requests'].items()) + [('total', results['total'])]:
+        latency = summary['latency_ms']
+        print(f"{label:<18}{summary['requests']:>8}{summary['throughput_rps']:>8.1f}{latency['p50']:>9.1f}"
+              f"{latency['p95']:>9.1f}{latency['p99']:>9.1f}{summary['error_rate']:>8.1%}", file=sys.stderr)
+    if removed:
+        print(f'Removed {removed} sessions and documents created by the run.', file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(results, output, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+if __name__ == '__main__':
+    main()
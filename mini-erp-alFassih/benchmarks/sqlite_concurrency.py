@@ -0,0 +1,136 @@
+"""
+Concurrent reads against a busy writer, with and without the SQLite profile.
+
+One writer process keeps inserting batches of sessions, each in its own
+transaction, while reader processes run the kind of aggregate query the
+schedule and analytics pages issue. The same workload runs once with SQLite's
+defaults (rollback journal) and once with Config.SQLITE_PRAGMAS applied
+through database.configure_sqlite, and reports read latency, throughput and
+lock errors for both.
+
+    python benchmarks/sqlite_concurrency.py [--seconds 5] [--readers 4] [--batch 1000]
+"""
+
+import argparse
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.exc import OperationalError
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from mini_erp_alFassih import db
+from mini_erp_alFassih.config import Config
+from mini_erp_alFassih.database import configure_sqlite
+from mini_erp_alFassih.models import User, Patient, Therapist, Session
+
+PROFILES = (
+    ('sqlite defaults', {}),
+    ('SQLITE_PRAGMAS', Config.SQLITE_PRAGMAS),
+)
+
+def _session_rows(count, offset):
+    start = datetime(2027, 1, 4, 8)
+    return [{'patient_id': 1, 'therapist_id': 1 + (offset + i) % 5,
+             'start_time': start + timedelta(minutes=30 * (offset + i)),
+             'end_time': start + timedelta(minutes=30 * (offset + i) + 30),
+             'status': 'Scheduled'}
+            for i in range(count)]
+
+def _seed(engine, sessions):
+    db.metadata.create_all(engine, tables=[User.__table__, Patient.__table__, Therapist.__table__, Session.__table__])
+    with engine.begin() as conn:
+        conn.execute(Patient.__table__.insert(), [{'id': 1, 'first_name': 'Bench', 'last_name': 'Patient'}])
+        conn.execute(Therapist.__table__.insert(),
+                     [{'id': n, 'first_name': 'Bench', 'last_name': f'Therapist {n}'} for n in range(1, 6)])
+        conn.execute(Session.__table__.insert(), _session_rows(sessions, 0))
+
+def _engine(path, pragmas):
+    engine = create_engine(f'sqlite:///{path}')
+    configure_sqlite(engine, pragmas)
+    return engine
+
+def _writer(path, pragmas, deadline, batch, offset, results):
+    engine = _engine(path, pragmas)
+    commits, errors = 0, 0
+    while time.time() < deadline:
+        try:
+            with engine.begin() as conn:
+                conn.execute(Session.__table__.insert(), _session_rows(batch, offset))
+            offset += batch
+            commits += 1
+        except OperationalError:
+            errors += 1
+    results.put(('writer', commits, errors))
+
+def _reader(path, pragmas, deadline, day, results):
+    # One therapist's day, as the reception schedule reads it
+    query = (select(func.count(Session.id), func.max(Session.end_time))
+             .where(Session.therapist_id == 1, Session.start_time >= day, Session.start_time < day + timedelta(days=1)))
+    latencies, errors = [], 0
+    with _engine(path, pragmas).connect() as conn:
+        while time.time() < deadline:
+            started = time.perf_counter()
+            try:
+                conn.execute(query).one()
+            except OperationalError:
+                errors += 1
+            finally:
+                conn.rollback() # Ends the read transaction, as a request would
+            latencies.append(time.perf_counter() - started)
+    results.put(('reader', latencies, errors))
+
+def run(pragmas, seconds, readers, batch, seed_sessions):
+    """Runs the writer and each reader in its own process, so they only contend for the database."""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.db')
+        engine = _engine(path, pragmas)
+        _seed(engine, seed_sessions)
+        engine.dispose()
+
+        results = multiprocessing.Queue()
+        deadline = time.time() + 1 + seconds # The extra second covers process start-up
+        day = datetime(2027, 1, 4) + timedelta(days=seed_sessions // 96)
+        processes = [multiprocessing.Process(target=_writer, args=(path, pragmas, deadline, batch, seed_sessions, results))]
+        processes += [multiprocessing.Process(target=_reader, args=(path, pragmas, deadline, day, results))
+                      for _ in range(readers)]
+        for process in processes:
+            process.start()
+        outcomes = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+    latencies = sorted(value for kind, values, _ in outcomes if kind == 'reader' for value in values)
+    commits = sum(values for kind, values, _ in outcomes if kind == 'writer')
+    return {
+        'reads_per_second': len(latencies) / seconds,
+        'read_p50_ms': statistics.median(latencies) * 1000,
+        'read_p99_ms': latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        'read_max_ms': latencies[-1] * 1000,
+        'write_batches_per_second': commits / seconds,
+        'lock_errors': sum(errors for _, _, errors in outcomes),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=5.0, help='Duration of each run.')
+    parser.add_argument('--readers', type=int, default=4, help='Reader processes.')
+    parser.add_argument('--batch', type=int, default=1000, help='Sessions inserted per write transaction.')
+    parser.add_argument('--seed', type=int, default=20000, help='Sessions in the table before the run.')
+    args = parser.parse_args()
+
+    print(f'{args.readers} readers, 1 writer ({args.batch} rows per commit), {args.seconds:g}s per profile')
+    print(f"{'profile':<18}{'reads/s':>10}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}{'commits/s':>11}{'locked':>8}")
+    for name, pragmas in PROFILES:
+        result = run(pragmas, args.seconds, args.readers, args.batch, args.seed)
+        print(f"{name:<18}{result['reads_per_second']:>10.0f}{result['read_p50_ms']:>9.2f}{result['read_p99_ms']:>9.2f}"
+              f"{result['read_max_ms']:>9.1f}{result['write_batches_per_second']:>11.1f}{result['lock_errors']:>8}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""Add patient activity summary columns
+
+Revision ID: a3f1c9d2e7b4
+Revises: 12c8bbffbc70
+Create Date: 2026-10-19 09:12:41.508213
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3f1c9d2e7b4'
+down_revision = '12c8bbffbc70'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('patient', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('last_session_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('next_session_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('session_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('document_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.create_index(batch_op.f('ix_patient_last_session_at'), ['last_session_at'], unique=False)
+        batch_op.create_index(batch_op.f('ix_patient_next_session_at'), ['next_session_at'], unique=False)
+        batch_op.create_index(batch_op.f('ix_patient_session_count'), ['session_count'], unique=False)
+
+    # Backfill existing rows; afterwards the app keeps them current (or run `flask rebuild-patient-summaries`)
+    op.execute("""
+        UPDATE patient SET
+            last_session_at = (SELECT MAX(s.start_time) FROM session s
+                               WHERE s.patient_id = patient.id AND s.status = 'Completed'),
+            next_session_at = (SELECT MIN(s.start_time) FROM session s
+                               WHERE s.patient_id = patient.id AND s.status = 'Scheduled'
+                                 AND s.start_time >= CURRENT_TIMESTAMP),
+            session_count = (SELECT COUNT(s.id) FROM session s WHERE s.patient_id = patient.id),
+            document_count = (SELECT COUNT(d.id) FROM document d WHERE d.patient_id = patient.id)
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('patient', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_patient_session_count'))
+        batch_op.drop_index(batch_op.f('ix_patient_next_session_at'))
+        batch_op.drop_index(batch_op.f('ix_patient_last_session_at'))
+        batch_op.drop_column('document_count')
+        batch_op.drop_column('session_count')
+        batch_op.drop_column('next_session_at')
+        batch_op.drop_column('last_session_at')
@@ -0,0 +1,29 @@
+"""Add therapist updated_at
+
+Revision ID: a8d4f2c61e53
+Revises: f3c8d6e92b47
+Create Date: 2026-10-19 20:31:08.264117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a8d4f2c61e53'
+down_revision = 'f3c8d6e92b47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('therapist', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+
+    # Existing therapists count as changed now, so cached activity reports are rebuilt once
+    op.execute(sa.text('UPDATE therapist SET updated_at = CURRENT_TIMESTAMP'))
+
+
+def downgrade():
+    with op.batch_alter_table('therapist', schema=None) as batch_op:
+        batch_op.drop_column('updated_at')
@@ -0,0 +1,30 @@
+"""Add composite session indexes for the filtered sessions list
+
+Revision ID: b7e2d4a1c6f3
+Revises: a3f1c9d2e7b4
+Create Date: 2026-10-19 10:03:17.224908
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e2d4a1c6f3'
+down_revision = 'a3f1c9d2e7b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('session', schema=None) as batch_op:
+        batch_op.create_index('ix_session_therapist_id_start_time', ['therapist_id', 'start_time'], unique=False)
+        batch_op.create_index('ix_session_patient_id_start_time', ['patient_id', 'start_time'], unique=False)
+        batch_op.create_index('ix_session_status_start_time', ['status', 'start_time'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('session', schema=None) as batch_op:
+        batch_op.drop_index('ix_session_status_start_time')
+        batch_op.drop_index('ix_session_patient_id_start_time')
+        batch_op.drop_index('ix_session_therapist_id_start_time')
@@ -0,0 +1,37 @@
+"""Add session updated_at and therapist calendar token
+
+Revision ID: c4e8a2f61d09
+Revises: b7e2d4a1c6f3
+Create Date: 2026-10-19 11:42:05.318042
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e8a2f61d09'
+down_revision = 'b7e2d4a1c6f3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('session', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+
+    with op.batch_alter_table('therapist', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('calendar_token', sa.String(length=64), nullable=True))
+        batch_op.create_index(batch_op.f('ix_therapist_calendar_token'), ['calendar_token'], unique=True)
+
+    # Existing sessions count as changed now, so every calendar client fetches a full feed once
+    op.execute(sa.text('UPDATE session SET updated_at = CURRENT_TIMESTAMP'))
+
+
+def downgrade():
+    with op.batch_alter_table('therapist', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_therapist_calendar_token'))
+        batch_op.drop_column('calendar_token')
+
+    with op.batch_alter_table('session', schema=None) as batch_op:
+        batch_op.drop_column('updated_at')
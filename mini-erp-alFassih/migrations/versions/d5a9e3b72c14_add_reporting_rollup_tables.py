@@ -0,0 +1,76 @@
+"""Add reporting rollup tables
+
+Revision ID: d5a9e3b72c14
+Revises: c4e8a2f61d09
+Create Date: 2026-10-19 15:08:27.604113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5a9e3b72c14'
+down_revision = 'c4e8a2f61d09'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('session_rollup',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('grain', sa.String(length=10), nullable=False),
+    sa.Column('bucket', sa.DateTime(), nullable=False),
+    sa.Column('therapist_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(length=50), nullable=False),
+    sa.Column('session_type', sa.String(length=150), nullable=False),
+    sa.Column('session_count', sa.Integer(), nullable=False),
+    sa.Column('booked_minutes', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('grain', 'bucket', 'therapist_id', 'status', 'session_type', name='uq_session_rollup_key')
+    )
+    op.create_table('activity_rollup',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('grain', sa.String(length=10), nullable=False),
+    sa.Column('bucket', sa.DateTime(), nullable=False),
+    sa.Column('new_patients', sa.Integer(), nullable=False),
+    sa.Column('documents_uploaded', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('grain', 'bucket', name='uq_activity_rollup_key')
+    )
+    op.create_table('rollup_state',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('high_water', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.create_table('rollup_stale_hour',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('bucket', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+    # The rollup job scans these for rows changed since its high-water mark
+    with op.batch_alter_table('patient', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_patient_created_at'), ['created_at'], unique=False)
+
+    with op.batch_alter_table('document', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_document_uploaded_at'), ['uploaded_at'], unique=False)
+
+    with op.batch_alter_table('session', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_session_updated_at'), ['updated_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('session', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_session_updated_at'))
+
+    with op.batch_alter_table('document', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_document_uploaded_at'))
+
+    with op.batch_alter_table('patient', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_patient_created_at'))
+
+    op.drop_table('rollup_stale_hour')
+    op.drop_table('rollup_state')
+    op.drop_table('activity_rollup')
+    op.drop_table('session_rollup')
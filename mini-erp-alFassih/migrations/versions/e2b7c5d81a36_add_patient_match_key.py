@@ -0,0 +1,45 @@
+"""Add patient match key
+
+Revision ID: e2b7c5d81a36
+Revises: d5a9e3b72c14
+Create Date: 2026-10-19 16:31:52.118407
+
+"""
+import importlib
+
+from alembic import op
+import sqlalchemy as sa
+from flask import current_app
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b7c5d81a36'
+down_revision = 'd5a9e3b72c14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('patient', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('match_key', sa.String(length=255), nullable=True))
+        batch_op.create_index(batch_op.f('ix_patient_match_key'), ['match_key'], unique=False)
+
+    # Keys must match what the app computes, so the backfill uses the app's own normalization
+    patient_match_key = importlib.import_module(f'{current_app.import_name}.matching').patient_match_key
+    connection = op.get_bind()
+    patient = sa.table('patient', sa.column('id', sa.Integer), sa.column('first_name', sa.String),
+                       sa.column('last_name', sa.String), sa.column('date_of_birth', sa.Date),
+                       sa.column('match_key', sa.String))
+    rows = connection.execute(sa.select(patient.c.id, patient.c.first_name, patient.c.last_name,
+                                        patient.c.date_of_birth)).all()
+    if rows:
+        connection.execute(
+            patient.update().where(patient.c.id == sa.bindparam('patient_id')).values(match_key=sa.bindparam('key')),
+            [{'patient_id': row.id, 'key': patient_match_key(row.first_name, row.last_name, row.date_of_birth)}
+             for row in rows])
+
+
+def downgrade():
+    with op.batch_alter_table('patient', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_patient_match_key'))
+        batch_op.drop_column('match_key')
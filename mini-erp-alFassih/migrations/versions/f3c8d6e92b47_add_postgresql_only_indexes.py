@@ -0,0 +1,40 @@
+"""Add PostgreSQL-only indexes: scheduled sessions, match key prefixes and patient search
+
+Revision ID: f3c8d6e92b47
+Revises: e2b7c5d81a36
+Create Date: 2026-10-19 19:12:40.537201
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3c8d6e92b47'
+down_revision = 'e2b7c5d81a36'
+branch_labels = None
+depends_on = None
+
+
+def _postgresql():
+    return op.get_bind().dialect.name == 'postgresql'
+
+
+def upgrade():
+    if not _postgresql(): # See models.dialect_index; other backends get none of these
+        return
+    op.create_index('ix_session_scheduled_start_time', 'session', ['start_time'], unique=False,
+                    postgresql_where=sa.text("status = 'Scheduled'"))
+    op.create_index('ix_patient_match_key_prefix', 'patient', ['match_key'], unique=False,
+                    postgresql_ops={'match_key': 'text_pattern_ops'})
+    op.create_index('ix_patient_match_key_search', 'patient',
+                    [sa.text("to_tsvector('simple', replace(match_key, '|', ' '))")], unique=False,
+                    postgresql_using='gin')
+
+
+def downgrade():
+    if not _postgresql():
+        return
+    op.drop_index('ix_patient_match_key_search', table_name='patient')
+    op.drop_index('ix_patient_match_key_prefix', table_name='patient')
+    op.drop_index('ix_session_scheduled_start_time', table_name='session')
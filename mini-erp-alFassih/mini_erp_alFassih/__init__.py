@@ -8,9 +8,10 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_login import LoginManager
 from .config import config_by_name # Import config
+from .replicas import RoutingSession
 
 # Initialize extensions that don't need the app object immediately
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession}) # Reads of @read_replica views may go to a replica
 migrate = Migrate()
 login_manager = LoginManager()
 
@@ -41,8 +42,23 @@ def create_app(config_name=None):
 
     # Initialize extensions with the app object
     db.init_app(app)
+    from .database import init_engines
+    init_engines(app, db) # SQLite pragmas from the config class (see database.py)
+    from .replicas import replica_router
+    replica_router.init_app(app) # REPLICA_DATABASE_URLS, if any (see replicas.py)
+    from .querystats import query_stats
+    query_stats.init_app(app) # Query counts per request: Server-Timing, N+1 warnings, @query_budget
+    from .metrics import init_app as init_metrics
+    init_metrics(app) # Request, query, upload and cache counters for /metrics
+    from .slowqueries import slow_queries, slow_queries_cli
+    slow_queries.init_app(app)
+    app.cli.add_command(slow_queries_cli)
+    from .profiling import init_profiler
+    init_profiler(app) # Profiles requests sent with X-Profile or picked by PROFILER_SAMPLE_RATE
     migrate.init_app(app, db)
     login_manager.init_app(app)
+    from flask_wtf.csrf import generate_csrf
+    app.jinja_env.globals['csrf_token'] = generate_csrf # layout.html and hand-written forms embed the token
 
     # Flask-Login settings (can be set after init_app)
     login_manager.login_view = 'auth.login'
@@ -50,6 +66,25 @@ def create_app(config_name=None):
     login_manager.login_message_category = 'info'
 
     from . import models # Import models after db is initialized and configured
+    from . import summaries # Registers the flush hooks and the periodic job that maintain Patient activity summaries
+    app.cli.add_command(summaries.rebuild_patient_summaries_command)
+    from . import matching # Registers the hooks that keep Patient.match_key current
+    from . import signals # Registers the hooks that announce committed session changes
+    from .schedule import daily_schedule
+    daily_schedule.init_app(app)
+    from .calendar_feed import therapist_calendars
+    therapist_calendars.init_app(app)
+    from .analytics import analytics_cache
+    analytics_cache.init_app(app)
+    from .jobs import jobs, jobs_cli
+    jobs.init_app(app)
+    app.cli.add_command(jobs_cli)
+    from .reminders import reminders_cli # Also registers the reminder tasks
+    app.cli.add_command(reminders_cli)
+    from .rollups import rollups_cli # Also registers the rollup job and its flush hook
+    app.cli.add_command(rollups_cli)
+    from .live import live_bp, broker as live_broker
+    live_broker.init_app(app)
 
     @login_manager.user_loader
     def load_user(user_id):
@@ -65,53 +100,33 @@ def create_app(config_name=None):
     from .admin import admin_bp
     app.register_blueprint(admin_bp)
 
-    from .patients import patients_bp
+    from .patients import patients_bp, patients_cli
     app.register_blueprint(patients_bp, url_prefix='/patients')
+    app.cli.add_command(patients_cli)
 
-    from .sessions import sessions_bp
+    from .sessions import sessions_bp, sessions_cli
     app.register_blueprint(sessions_bp, url_prefix='/sessions')
+    app.cli.add_command(sessions_cli)
+
+    app.register_blueprint(live_bp, url_prefix='/live')
+
+    from .jobs import jobs_bp
+    app.register_blueprint(jobs_bp, url_prefix='/jobs')
+
+    from .metrics import metrics_bp
+    app.register_blueprint(metrics_bp)
+
+    from .reports import reports_bp # Also registers the report rendering task
+    app.register_blueprint(reports_bp, url_prefix='/reports')
 
     from .errors import errors_bp # Import the errors blueprint
     app.register_blueprint(errors_bp)
 
+    from .applog import init_logging, configure_logging
+    init_logging(app) # Request ids and the access log
     if not app.debug and not app.testing: # Configure logging for production-like environments
-        import logging
-        from logging.handlers import RotatingFileHandler
-        # import os # os is already imported at the top
-
-        # Ensure instance folder exists (it should from earlier UPLOAD_FOLDER setup, but double check)
-        # This was already done earlier in create_app, so it's likely redundant here, but safe.
-        if not os.path.exists(app.instance_path):
-            try:
-                os.makedirs(app.instance_path)
-            except OSError:
-                 # Handle potential race condition or permission issue if necessary
-                pass
-
-
-        # Log to a file in the instance folder
-        file_handler = RotatingFileHandler(
-            os.path.join(app.instance_path, 'alfassih.log'), # Log file path
-            maxBytes=10240,  # Max 10KB per file before rotating
-            backupCount=10   # Keep 10 backup files
-        )
-
-        # Set a specific format for the log messages
-        log_format = logging.Formatter(
-            '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
-        )
-        file_handler.setFormatter(log_format)
-
-        # Set the logging level for the file handler
-        file_handler.setLevel(logging.INFO) # Log INFO level and above (WARNING, ERROR, CRITICAL)
-
-        # Add the file handler to the app's logger
-        app.logger.addHandler(file_handler)
-
-        # Also set the app's logger level (if not set, it might default to WARNING)
-        app.logger.setLevel(logging.INFO)
-
-        app.logger.info('Al-Fasih application startup') # Test log message
+        configure_logging(app) # Queued JSON records written by a background thread; sinks set by LOG_SINKS
+        app.logger.info('Al-Fasih application startup')
 
     return app
 
@@ -1,4 +1,4 @@
-from flask import render_template, request, redirect, url_for, flash, jsonify
+from flask import render_template, request, redirect, url_for, flash, jsonify, current_app, abort, Response, send_file
 from flask_login import login_required, current_user
 from datetime import datetime, timedelta
 
@@ -7,20 +7,40 @@ from .forms import TherapistForm, EditTherapistProfileForm
 from ..models import User, Therapist, Patient, Document, Session # Use .. for parent package
 from .. import db # Use .. for parent package
 from ..decorators import admin_required # Use .. for parent package
+from ..live import broker as live_broker
+from ..analytics import analytics_cache, therapist_rows
+from ..rollups import GRAINS, session_series, activity_series
+from ..replicas import read_replica
+from ..querystats import query_budget
+from ..metrics import cache_lookup
+from ..profiling import flame_tree
+
+# Counters shown on the dashboard, shared by every open dashboard in this process.
+# Dropped whenever a live 'dashboard' event arrives, so N open tabs cost one set of counts per change.
+# Filled from the primary only: a replica read right after the event would cache counts from before it.
+_stats_cache = {'stats': None, 'computed_at': None}
+
+def _invalidate_dashboard_stats(message):
+    if message['channel'] == 'dashboard':
+        _stats_cache['stats'] = None
+
+live_broker.add_listener(_invalidate_dashboard_stats)
+
+def _dashboard_stats():
+    now = datetime.utcnow()
+    ttl = timedelta(seconds=current_app.config.get('DASHBOARD_STATS_TTL', 60))
+    if cache_lookup('dashboard_stats', _stats_cache['stats'] is not None and now - _stats_cache['computed_at'] < ttl):
+        return _stats_cache['stats']
 
-@admin_bp.route('/dashboard')
-@login_required
-@admin_required
-def admin_dashboard():
     total_patients = Patient.query.count()
     total_documents = Document.query.count()
     total_therapists = Therapist.query.count()
     total_sessions = Session.query.count()
 
-    seven_days_ago = datetime.utcnow() - timedelta(days=7)
+    seven_days_ago = now - timedelta(days=7)
     new_patients_last_7_days = Patient.query.filter(Patient.created_at >= seven_days_ago).count()
 
-    today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
     today_end = today_start + timedelta(days=1)
     sessions_today = Session.query.filter(
         Session.start_time >= today_start,
@@ -36,6 +56,15 @@ def admin_dashboard():
         'new_patients_last_7_days': new_patients_last_7_days,
         'sessions_today': sessions_today
     }
+    _stats_cache.update(stats=stats, computed_at=now)
+    return stats
+
+@admin_bp.route('/dashboard')
+@login_required
+@admin_required
+@query_budget(11)
+def admin_dashboard():
+    stats = _dashboard_stats()
 
     recent_patients = Patient.query.order_by(Patient.created_at.desc()).limit(5).all()
     now = datetime.utcnow()
@@ -53,9 +82,62 @@ def admin_dashboard():
                            upcoming_sessions=upcoming_sessions,
                            year=datetime.now().year)
 
+@admin_bp.route('/dashboard/stats')
+@login_required
+@admin_required
+def admin_dashboard_stats():
+    """Current dashboard counters; fetched by open dashboards when a live 'counters' event arrives."""
+    return jsonify(_dashboard_stats())
+
+def _analytics_period(month, months):
+    """Returns [start, end) covering `months` calendar months starting with 'YYYY-MM'."""
+    try:
+        start = datetime.strptime(month, '%Y-%m')
+    except (TypeError, ValueError):
+        start = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    total = start.year * 12 + start.month - 1 + months
+    return start, datetime(total // 12, total % 12 + 1, 1)
+
+@admin_bp.route('/analytics')
+@login_required
+@admin_required
+@read_replica
+@query_budget(8)
+def therapist_analytics():
+    months = min(max(request.args.get('months', 1, type=int), 1), 60)
+    start, end = _analytics_period(request.args.get('month'), months)
+    report = analytics_cache.report(start, end)
+    if request.args.get('format') == 'json':
+        return jsonify(start=start.isoformat(), end=end.isoformat(), therapists=therapist_rows(report),
+                       weeks=report['weeks'], totals=report['totals'])
+    return render_template('admin/analytics.html', title='Therapist Analytics', report=report,
+                           therapists=therapist_rows(report), month=start.strftime('%Y-%m'), months=months,
+                           last_day=end - timedelta(days=1), year=datetime.now().year)
+
+@admin_bp.route('/analytics/series')
+@login_required
+@admin_required
+@read_replica
+def analytics_series():
+    """Chart data from the rollup tables: /admin/analytics/series?grain=day&month=2020-03&months=1[&therapist_id=N]"""
+    grain = request.args.get('grain', 'day')
+    if grain not in GRAINS:
+        return jsonify(error=f"grain must be one of {', '.join(GRAINS)}"), 400
+    months = min(max(request.args.get('months', 1, type=int), 1), 60)
+    start, end = _analytics_period(request.args.get('month'), months)
+    sessions = session_series(grain, start, end, therapist_id=request.args.get('therapist_id', type=int))
+    return jsonify(
+        grain=grain, start=start.isoformat(), end=end.isoformat(),
+        sessions=[{'bucket': row.bucket.isoformat(), 'status': row.status, 'session_count': row.session_count,
+                   'booked_minutes': row.booked_minutes} for row in sessions],
+        activity=[{'bucket': row.bucket.isoformat(), 'new_patients': row.new_patients,
+                   'documents_uploaded': row.documents_uploaded} for row in activity_series(grain, start, end)],
+    )
+
 @admin_bp.route('/therapists')
 @login_required
 @admin_required
+@query_budget(4)
 def list_therapists():
     therapists = Therapist.query.all()
     return render_template('admin/therapist_list.html', therapists=therapists, title='Manage Therapists', year=datetime.now().year)
@@ -125,6 +207,16 @@ def edit_therapist(therapist_id):
                            therapist=therapist, user_email=user_email, user_is_active=user_is_active,
                            year=datetime.now().year, form_type='edit')
 
+@admin_bp.route('/therapists/<int:therapist_id>/calendar-token', methods=['POST'])
+@login_required
+@admin_required
+def regenerate_calendar_token(therapist_id):
+    therapist = Therapist.query.get_or_404(therapist_id)
+    therapist.regenerate_calendar_token()
+    db.session.commit()
+    flash('A new calendar feed link was issued. The previous link no longer works.', 'success')
+    return redirect(url_for('admin.edit_therapist', therapist_id=therapist.id))
+
 @admin_bp.route('/therapists/<int:therapist_id>/delete', methods=['POST'])
 @login_required
 @admin_required
@@ -138,6 +230,7 @@ def delete_therapist(therapist_id):
 @admin_bp.route('/users')
 @login_required
 @admin_required
+@query_budget(4)
 def list_users():
     users = User.query.order_by(User.email).all()
     return render_template('admin/user_list.html', users=users, title='Manage Users', year=datetime.now().year)
@@ -167,3 +260,48 @@ def deactivate_user(user_id):
         db.session.commit()
         flash(f'User {user.email} has been deactivated.', 'warning')
     return redirect(url_for('admin.list_users'))
+
+def _stored_profile(profile_id):
+    profile = current_app.extensions['profiler'].load(profile_id)
+    if profile is None:
+        abort(404)
+    return profile
+
+@admin_bp.route('/profiles')
+@login_required
+@admin_required
+def list_profiles():
+    profiler = current_app.extensions['profiler']
+    profiles = [profile for profile in map(profiler.load, profiler.profile_ids()) if profile is not None]
+    return render_template('admin/profile_list.html', profiles=profiles, title='Request Profiles',
+                           token_configured=bool(current_app.config.get('PROFILER_TOKEN')),
+                           sample_rate=current_app.config.get('PROFILER_SAMPLE_RATE'), year=datetime.now().year)
+
+@admin_bp.route('/profiles/<profile_id>')
+@login_required
+@admin_required
+def view_profile(profile_id):
+    profile = _stored_profile(profile_id)
+    tree = flame_tree(profile['stacks']) if profile['mode'] == 'sample' else None
+    return render_template('admin/profile.html', profile=profile, tree=tree, title='Request Profile',
+                           year=datetime.now().year)
+
+@admin_bp.route('/profiles/<profile_id>/collapsed')
+@login_required
+@admin_required
+def profile_collapsed(profile_id):
+    """Collapsed stacks for flamegraph.pl, speedscope and similar tools."""
+    profile = _stored_profile(profile_id)
+    lines = [f'{stack or "all"} {count}' for stack, count in sorted(profile.get('stacks', {}).items())]
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain',
+                    headers={'Content-Disposition': f'attachment; filename={profile_id}.collapsed'})
+
+@admin_bp.route('/profiles/<profile_id>/pstats')
+@login_required
+@admin_required
+def profile_pstats(profile_id):
+    """cProfile stats for pstats or snakeviz."""
+    if _stored_profile(profile_id)['mode'] != 'cprofile':
+        abort(404)
+    return send_file(current_app.extensions['profiler'].path(profile_id, '.prof'), as_attachment=True,
+                     download_name=f'{profile_id}.prof', mimetype='application/octet-stream')
@@ -0,0 +1,153 @@
+"""
+Therapist utilization and attendance analytics.
+
+Everything is aggregated in the database with GROUP BY over the
+start_time-indexed session table, so a report over years of sessions returns a
+few rows per therapist and per week instead of loading Session objects.
+
+utilization = booked hours (sessions not cancelled) / available hours, where
+available hours are THERAPIST_WEEKLY_HOURS spread over the days in the period.
+Completion, cancellation and no-show rates are taken over sessions that have
+already started, since upcoming sessions have no outcome yet.
+
+Reports are cached per period and reused until a session in the period is
+added, edited or removed (checked with one count/max(updated_at) query).
+"""
+
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from . import db
+from .models import Therapist, Session
+from .metrics import cache_lookup
+
+def dialect_name():
+    return db.session.get_bind().dialect.name
+
+def session_hours():
+    """SQL expression for a session's length in hours."""
+    if dialect_name() == 'postgresql':
+        return db.func.extract('epoch', Session.end_time - Session.start_time) / 3600.0
+    return (db.func.julianday(Session.end_time) - db.func.julianday(Session.start_time)) * 24.0
+
+def _week_start():
+    """Monday of the week each session falls in."""
+    if dialect_name() == 'postgresql':
+        return db.func.date(db.func.date_trunc('week', Session.start_time))
+    return db.func.date(Session.start_time, 'weekday 0', '-6 days')
+
+def _aggregates(now):
+    """Per-group columns: totals, hours booked and outcome counts."""
+    def count_where(*criteria):
+        return db.func.coalesce(db.func.sum(db.case((db.and_(*criteria), 1), else_=0)), 0)
+    return [
+        db.func.count(Session.id).label('total'),
+        db.func.coalesce(db.func.sum(db.case((Session.status != 'Cancelled', session_hours()), else_=0)), 0)
+            .label('booked_hours'),
+        count_where(Session.start_time < now).label('started'),
+        count_where(Session.start_time < now, Session.status == 'Completed').label('completed'),
+        count_where(Session.start_time < now, Session.status == 'Cancelled').label('cancelled'),
+        count_where(Session.start_time < now, Session.status == 'No Show').label('no_show'),
+    ]
+
+def _rates(row):
+    started = row.started or 0
+    def rate(count):
+        return round(count / started, 4) if started else None
+    return {
+        'total': row.total,
+        'booked_hours': round(float(row.booked_hours), 2),
+        'started': started,
+        'completed': row.completed,
+        'cancelled': row.cancelled,
+        'no_show': row.no_show,
+        'completion_rate': rate(row.completed),
+        'cancellation_rate': rate(row.cancelled),
+        'no_show_rate': rate(row.no_show),
+    }
+
+def compute_report(start, end, weekly_hours, now=None):
+    """Aggregates sessions starting in [start, end) per therapist, per week and overall."""
+    now = now or datetime.utcnow()
+    in_period = (Session.start_time >= start, Session.start_time < end)
+    available_hours = weekly_hours * (end - start).total_seconds() / (7 * 86400)
+
+    by_therapist = {}
+    for row in db.session.execute(
+            db.select(Session.therapist_id, *_aggregates(now)).where(*in_period).group_by(Session.therapist_id)):
+        stats = _rates(row)
+        stats['available_hours'] = round(available_hours, 2)
+        stats['utilization'] = round(stats['booked_hours'] / available_hours, 4) if available_hours else None
+        by_therapist[row.therapist_id] = stats
+
+    week = _week_start().label('week')
+    weeks = []
+    for row in db.session.execute(db.select(week, *_aggregates(now)).where(*in_period).group_by(week).order_by(week)):
+        stats = _rates(row)
+        stats['week'] = str(row.week)
+        weeks.append(stats)
+
+    totals = _rates(db.session.execute(db.select(*_aggregates(now)).where(*in_period)).one())
+    return {'start': start, 'end': end, 'available_hours': round(available_hours, 2),
+            'by_therapist': by_therapist, 'weeks': weeks, 'totals': totals}
+
+def _period_validator(start, end):
+    return tuple(db.session.execute(
+        db.select(db.func.count(Session.id), db.func.max(Session.updated_at))
+        .where(Session.start_time >= start, Session.start_time < end)
+    ).one())
+
+class AnalyticsCache:
+    """Per-process cache of period reports, at most max_periods of them."""
+
+    def __init__(self, max_periods=24, ttl=300, weekly_hours=40):
+        self.max_periods = max_periods
+        self.ttl = ttl
+        self.weekly_hours = weekly_hours
+        self._reports = OrderedDict() # (start, end) -> (validator, computed_at, report)
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.max_periods = app.config.get('ANALYTICS_CACHE_PERIODS', self.max_periods)
+        self.ttl = app.config.get('ANALYTICS_CACHE_TTL', self.ttl)
+        self.weekly_hours = app.config.get('THERAPIST_WEEKLY_HOURS', self.weekly_hours)
+        app.extensions['analytics'] = self
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._reports.clear()
+
+    def report(self, start, end, now=None):
+        now = now or datetime.utcnow()
+        validator = _period_validator(start, end)
+        with self._lock:
+            cached = self._reports.get((start, end))
+        # Periods still in progress also age out, since "started" moves with the clock
+        if cache_lookup('analytics', cached is not None and cached[0] == validator
+                        and (end <= cached[1] or now - cached[1] < timedelta(seconds=self.ttl))):
+            return cached[2]
+
+        report = compute_report(start, end, self.weekly_hours, now=now)
+        with self._lock:
+            self._reports[(start, end)] = (validator, now, report)
+            self._reports.move_to_end((start, end))
+            while len(self._reports) > self.max_periods:
+                self._reports.popitem(last=False)
+        return report
+
+analytics_cache = AnalyticsCache()
+
+def therapist_rows(report):
+    """Joins a report's per-therapist numbers with current therapist names, listing idle therapists too."""
+    therapists = db.session.execute(
+        db.select(Therapist.id, Therapist.first_name, Therapist.last_name)
+        .order_by(Therapist.last_name, Therapist.first_name)
+    ).all()
+    idle = {'total': 0, 'booked_hours': 0.0, 'started': 0, 'completed': 0, 'cancelled': 0, 'no_show': 0,
+            'completion_rate': None, 'cancellation_rate': None, 'no_show_rate': None,
+            'available_hours': report['available_hours'], 'utilization': 0.0}
+    return [dict(report['by_therapist'].get(therapist.id, idle), therapist_id=therapist.id,
+                 name=f'{therapist.first_name} {therapist.last_name}')
+            for therapist in therapists]
@@ -0,0 +1,192 @@
+"""
+Non-blocking, structured application logging.
+
+Request threads never touch a file or socket to log: app.logger gets a single
+QueueHandler that stamps each record with its request context and drops it on
+a bounded in-memory queue. A QueueListener thread takes records off the queue
+and writes them to the configured sinks (LOG_SINKS):
+
+- 'file': LOG_FILE_PATH (default instance/alfassih.log), rotated at
+  LOG_FILE_MAX_BYTES keeping LOG_FILE_BACKUPS old files;
+- 'stdout': for process managers and containers that collect output;
+- 'syslog': a SysLogHandler sending to LOG_SYSLOG_ADDRESS.
+
+With LOG_FORMAT = 'json' every line is one JSON object: time, level, logger,
+message, plus request_id, user_id, endpoint, method and path inside a request,
+and duration_ms and status on the access log line written when a request ends
+(LOG_ACCESS). Each request gets an id, taken from a well-formed X-Request-ID
+header or generated, and echoed back in the response.
+
+If the sinks fall behind and LOG_QUEUE_SIZE records are waiting, new records
+are dropped and counted rather than slowing requests down.
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import re
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, SysLogHandler
+
+from flask import current_app, g, has_request_context, request
+from flask.logging import default_handler
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+_VALID_REQUEST_ID = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+_CONTEXT_FIELDS = ('request_id', 'user_id', 'endpoint', 'method', 'path', 'status', 'duration_ms')
+
+class RequestContextFilter(logging.Filter):
+    """Copies the request's identifiers onto records while still in the request thread."""
+
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = g.get('request_id')
+            user = g.get('_login_user') # Set by Flask-Login once loaded; never triggers a query here
+            record.user_id = user.get_id() if user is not None and user.is_authenticated else None
+            record.endpoint = request.endpoint
+            record.method = request.method
+            record.path = request.path
+        return True
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in _CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
+
+    def format(self, record):
+        line = super().format(record)
+        request_id = getattr(record, 'request_id', None)
+        return f'{line} [request {request_id}]' if request_id else line
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler with a bounded queue that drops records instead of waiting, and restarts its
+    listener in processes forked after it was set up (e.g. gunicorn --preload)."""
+
+    def __init__(self, sinks, queue_size):
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self.sinks = sinks
+        self.dropped = 0
+        self.listener = None
+        self._pid = None
+        self._start_listener()
+        self.addFilter(RequestContextFilter())
+
+    def _start_listener(self):
+        if self._pid is not None: # Forked: the parent's listener thread and queue state did not come along
+            self.queue = queue.Queue(maxsize=self.queue.maxsize)
+        self._pid = os.getpid()
+        self.listener = QueueListener(self.queue, *self.sinks, respect_handler_level=True)
+        self.listener.start()
+
+    def prepare(self, record):
+        # Render the message and traceback now; the listener thread formats the rest
+        record.message = record.getMessage()
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg, record.args, record.exc_info = record.message, None, None
+        return record
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            self._start_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        """Writes out the queued records and stops the listener."""
+        if self.listener is not None and self._pid == os.getpid():
+            self.listener.stop()
+            self.listener = None
+        for sink in self.sinks:
+            sink.close()
+        super().close()
+
+def _sinks(app):
+    formatter = JsonFormatter() if app.config.get('LOG_FORMAT', 'json') == 'json' else TextFormatter()
+    sinks = []
+    for name in app.config.get('LOG_SINKS') or ('file',):
+        if name == 'file':
+            path = app.config.get('LOG_FILE_PATH') or os.path.join(app.instance_path, 'alfassih.log')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            sink = RotatingFileHandler(path, maxBytes=app.config.get('LOG_FILE_MAX_BYTES', 10485760),
+                                       backupCount=app.config.get('LOG_FILE_BACKUPS', 10), encoding='utf-8')
+        elif name == 'stdout':
+            sink = logging.StreamHandler(sys.stdout)
+        elif name == 'syslog':
+            address = app.config.get('LOG_SYSLOG_ADDRESS') or '/dev/log'
+            sink = SysLogHandler(address=tuple(address.rsplit(':', 1)) if ':' in address else address)
+        else:
+            raise ValueError(f'Unknown log sink {name!r}; use file, stdout or syslog.')
+        sink.setFormatter(formatter)
+        sinks.append(sink)
+    return sinks
+
+def init_logging(app):
+    """Registers the request id and access log hooks, and closing the log handler at exit.
+    Called once per app; configure_logging sets up (or replaces) the handler they use."""
+    app.before_request(_assign_request_id)
+    app.after_request(_echo_request_id)
+    app.teardown_request(_log_access)
+    atexit.register(_close_log_handler, app)
+
+def configure_logging(app):
+    """Sends app.logger through the queue to LOG_SINKS, replacing any handler set up earlier.
+    Returns the QueueHandler; closing it flushes and detaches the sinks."""
+    handler = NonBlockingQueueHandler(_sinks(app), app.config.get('LOG_QUEUE_SIZE', 10000))
+    for previous in [h for h in app.logger.handlers if isinstance(h, NonBlockingQueueHandler)]:
+        app.logger.removeHandler(previous) # Apps created earlier in this process share the logger
+        previous.close()
+    app.logger.removeHandler(default_handler) # Flask's own handler writes to stderr in the request thread
+    app.logger.addHandler(handler)
+    app.logger.setLevel(app.config.get('LOG_LEVEL', 'INFO'))
+    app.extensions['log_handler'] = handler
+    return handler
+
+def _close_log_handler(app):
+    handler = app.extensions.get('log_handler')
+    if handler is not None:
+        handler.close()
+
+def _assign_request_id():
+    incoming = request.headers.get(REQUEST_ID_HEADER, '')
+    g.request_id = incoming if _VALID_REQUEST_ID.match(incoming) else uuid.uuid4().hex
+    g.request_started = time.perf_counter()
+
+def _echo_request_id(response):
+    response.headers[REQUEST_ID_HEADER] = g.get('request_id', '')
+    g.response_status = response.status_code
+    return response
+
+def _log_access(exc):
+    started = g.pop('request_started', None)
+    if started is None or 'log_handler' not in current_app.extensions or not current_app.config.get('LOG_ACCESS', True):
+        return
+    duration_ms = round((time.perf_counter() - started) * 1000, 1)
+    status = g.pop('response_status', None) or 500
+    current_app.logger.info(f'{request.method} {request.path} {status} {duration_ms} ms',
+                            extra={'status': status, 'duration_ms': duration_ms})
@@ -0,0 +1,162 @@
+"""
+Per-therapist iCalendar (.ics) feeds.
+
+A feed covers a window of days around today. Its validator (ETag and
+Last-Modified) comes from one aggregate query over the therapist's sessions in
+that window: the row count plus the latest Session.updated_at and
+Patient.updated_at. Calendar apps polling every few minutes therefore cost that
+query and a 304 until something changes.
+
+When the feed did change, cached VEVENT blocks are reused for sessions whose
+timestamps did not move, the rows are streamed from the database in batches,
+and the finished body is kept for the next client with the same validator.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from . import db
+from .models import Patient, Session
+from .metrics import cache_lookup
+
+# Session.status -> iCalendar STATUS
+EVENT_STATUS = {
+    'Scheduled': 'CONFIRMED',
+    'Completed': 'CONFIRMED',
+    'Cancelled': 'CANCELLED',
+}
+
+def feed_window(today, past_days, future_days):
+    """Returns the [start, end) datetimes of a feed built on the given date."""
+    start = datetime.combine(today - timedelta(days=past_days), datetime.min.time())
+    return start, datetime.combine(today + timedelta(days=future_days + 1), datetime.min.time())
+
+def feed_validator(therapist_id, window):
+    """Returns (etag, last_modified) for the therapist's feed over window."""
+    count, session_changed, patient_changed = db.session.execute(
+        db.select(db.func.count(Session.id), db.func.max(Session.updated_at), db.func.max(Patient.updated_at))
+        .join(Patient, Session.patient_id == Patient.id)
+        .where(Session.therapist_id == therapist_id,
+               Session.start_time >= window[0], Session.start_time < window[1])
+    ).one()
+    # The count catches deleted sessions, which leave no newer timestamp behind
+    key = f'{therapist_id}:{window[0].isoformat()}:{count}:{session_changed}:{patient_changed}'
+    last_modified = max((stamp for stamp in (session_changed, patient_changed) if stamp is not None), default=None)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest(), last_modified
+
+def _escape(text):
+    return (text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+def _fold(line):
+    """Splits a content line into chunks of at most 75 octets, as RFC 5545 requires."""
+    chunks, current, size = [], '', 0
+    for char in line:
+        width = len(char.encode('utf-8'))
+        if size + width > 75:
+            chunks.append(current)
+            current, size = ' ', 1
+        current += char
+        size += width
+    chunks.append(current)
+    return '\r\n'.join(chunks) + '\r\n'
+
+def _local_time(value):
+    # Session times are entered as clinic wall-clock times, so they are emitted as floating times
+    return value.strftime('%Y%m%dT%H%M%S')
+
+def _utc_time(value):
+    return value.strftime('%Y%m%dT%H%M%SZ')
+
+def _event(row):
+    patient = f'{row.first_name} {row.last_name[:1]}.' # Initial only: feeds end up on personal devices
+    summary = f"{row.session_type or 'Session'}: {patient}"
+    lines = [
+        'BEGIN:VEVENT',
+        f'UID:session-{row.id}@al-fasih',
+        f'DTSTAMP:{_utc_time(row.updated_at or row.start_time)}',
+        f'DTSTART:{_local_time(row.start_time)}',
+        f'DTEND:{_local_time(row.end_time)}',
+        f'SUMMARY:{_escape(summary)}',
+        f'STATUS:{EVENT_STATUS.get(row.status, "TENTATIVE")}',
+        f'DESCRIPTION:{_escape(f"Status: {row.status}")}',
+        'END:VEVENT',
+    ]
+    return ''.join(_fold(line) for line in lines)
+
+class CalendarFeedCache:
+    """Per-process cache of feed bodies and their VEVENT blocks, for at most max_feeds therapists."""
+
+    def __init__(self, max_feeds=100, batch_size=200):
+        self.max_feeds = max_feeds
+        self.batch_size = batch_size
+        self._feeds = OrderedDict() # therapist_id -> {'etag', 'body', 'events'}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.max_feeds = app.config.get('CALENDAR_FEED_CACHE_SIZE', self.max_feeds)
+        app.extensions['calendar_feeds'] = self
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._feeds.clear()
+
+    def cached_body(self, therapist_id, etag):
+        """Returns the stored body if it was built for this validator, else None."""
+        with self._lock:
+            feed = self._feeds.get(therapist_id)
+            if not cache_lookup('calendar_feed', feed is not None and feed['etag'] == etag):
+                return None
+            self._feeds.move_to_end(therapist_id)
+            return feed['body']
+
+    def stream(self, therapist, window, etag):
+        """Yields the feed in chunks and stores the finished body under etag."""
+        with self._lock:
+            previous = self._feeds.get(therapist.id)
+        previous_events = previous['events'] if previous else {}
+        events, chunks = {}, []
+
+        header = ''.join(_fold(line) for line in (
+            'BEGIN:VCALENDAR',
+            'VERSION:2.0',
+            'PRODID:-//Al-Fasih//Therapist Calendar//EN',
+            'CALSCALE:GREGORIAN',
+            f'X-WR-CALNAME:{_escape(f"{therapist.first_name} {therapist.last_name} - Sessions")}',
+        ))
+        chunks.append(header)
+        yield header
+
+        rows = db.session.execute(
+            db.select(Session.id, Session.start_time, Session.end_time, Session.session_type, Session.status,
+                      Session.updated_at, Patient.first_name, Patient.last_name,
+                      Patient.updated_at.label('patient_updated_at'))
+            .join(Patient, Session.patient_id == Patient.id)
+            .where(Session.therapist_id == therapist.id,
+                   Session.start_time >= window[0], Session.start_time < window[1])
+            .order_by(Session.start_time, Session.id)
+            .execution_options(yield_per=self.batch_size)
+        )
+        for row in rows:
+            stamp = (row.updated_at, row.patient_updated_at)
+            cached = previous_events.get(row.id)
+            text = cached[1] if cached is not None and cached[0] == stamp else _event(row)
+            events[row.id] = (stamp, text)
+            chunks.append(text)
+            yield text
+
+        footer = 'END:VCALENDAR\r\n'
+        chunks.append(footer)
+        yield footer
+
+        # Only reached when the client read the whole feed; an aborted download stores nothing
+        with self._lock:
+            self._feeds[therapist.id] = {'etag': etag, 'body': ''.join(chunks), 'events': events}
+            self._feeds.move_to_end(therapist.id)
+            while len(self._feeds) > self.max_feeds:
+                self._feeds.popitem(last=False)
+
+therapist_calendars = CalendarFeedCache()
@@ -1,4 +1,5 @@
 import os
+import re
 from dotenv import load_dotenv
 
 # Determine project root (one level up from this app package file) to load .env
@@ -19,8 +20,97 @@ class Config:
     # Flask prepends app.instance_path to it by default when using from_object.
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///alfassih.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Applied to every new SQLite connection (see database.py); an empty dict keeps SQLite's defaults
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL', # Readers are not blocked by a writer
+        'synchronous': 'NORMAL', # No fsync per commit; safe with WAL
+        'busy_timeout': 5000, # Milliseconds a writer waits for the lock before "database is locked"
+        'foreign_keys': 'ON',
+        'cache_size': -20000, # KiB of page cache per connection
+        'mmap_size': 134217728, # Bytes of the file read through memory mapping
+        'temp_store': 'MEMORY', # Sorts and temporary indexes stay off disk
+    }
+    # Comma-separated read replicas for the @read_replica views (see replicas.py); empty reads everything from the primary
+    REPLICA_DATABASE_URLS = [url.strip() for url in (os.environ.get('REPLICA_DATABASE_URLS') or '').split(',') if url.strip()]
+    REPLICA_MAX_LAG = 10 # Seconds a replica may trail the primary; also how long a user's reads stay on the primary after a POST
+    REPLICA_CHECK_INTERVAL = 5 # Seconds between lag checks of each replica
+    QUERY_INSTRUMENTATION = True # Count and time each request's SQL statements (see querystats.py)
+    QUERY_REPEAT_THRESHOLD = 5 # The same statement this many times in one request is logged as a possible N+1
+    SERVER_TIMING_HEADER = True # Report the request's query count and database time in a Server-Timing header
+    METRICS_DIR = os.environ.get('METRICS_DIR') # Shared by the worker processes so /metrics covers all of them
+    METRICS_FLUSH_INTERVAL = 5 # Seconds between writes of a process's totals to METRICS_DIR
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN') # If set, /metrics requires "Authorization: Bearer <token>"
+    # Application log (see applog.py): records are queued and written by a background thread
+    LOG_SINKS = [sink.strip() for sink in (os.environ.get('LOG_SINKS') or 'file').split(',') if sink.strip()] # file, stdout, syslog
+    LOG_FORMAT = os.environ.get('LOG_FORMAT') or 'json' # 'json' (one object per line) or 'text'
+    LOG_LEVEL = os.environ.get('LOG_LEVEL') or 'INFO'
+    LOG_FILE_PATH = os.environ.get('LOG_FILE_PATH') # Defaults to instance/alfassih.log
+    LOG_FILE_MAX_BYTES = 10485760 # Rotated at this size...
+    LOG_FILE_BACKUPS = 10 # ...keeping this many old files
+    LOG_SYSLOG_ADDRESS = os.environ.get('LOG_SYSLOG_ADDRESS') # 'host:port' or a socket path; defaults to /dev/log
+    LOG_QUEUE_SIZE = 10000 # Records waiting for the sinks beyond this are dropped rather than blocking requests
+    LOG_ACCESS = True # One record per request with its status and duration
+    SLOW_QUERY_THRESHOLD_MS = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS') or 200) # 0 turns the slow query log off
+    SLOW_QUERY_LOG_PATH = os.environ.get('SLOW_QUERY_LOG_PATH') # JSON lines; defaults to instance/slow_queries.log
+    SLOW_QUERY_LOG_MAX_BYTES = 10485760 # Rotated at this size...
+    SLOW_QUERY_LOG_BACKUPS = 5 # ...keeping this many old files
+    SLOW_QUERY_EXPLAIN_INTERVAL = 300 # Seconds before the plan of an already explained statement is captured again
+    SLOW_QUERY_EXPLAIN_ANALYZE = False # PostgreSQL: EXPLAIN ANALYZE slow SELECTs, which runs them a second time
+    # Request profiling (see profiling.py); with neither of the next two set no request is profiled
+    PROFILER_TOKEN = os.environ.get('PROFILER_TOKEN') # Requests sending "X-Profile: <token>" are profiled
+    PROFILER_SAMPLE_RATE = float(os.environ.get('PROFILER_SAMPLE_RATE') or 0) # Fraction of all requests profiled at random
+    PROFILER_MODE = os.environ.get('PROFILER_MODE') or 'sample' # 'sample' (stack sampling, low overhead) or 'cprofile'
+    PROFILER_INTERVAL_MS = 5 # Milliseconds between stack samples
+    PROFILER_DIR = os.environ.get('PROFILER_DIR') # Stored profiles; defaults to instance/profiles
+    PROFILER_KEEP = 200 # Older profiles are deleted
     DEBUG = False # Default to False, overridden by DevelopmentConfig
     UPLOAD_FOLDER_NAME = 'uploads' # Keep upload folder name configurable
+    PATIENT_SESSIONS_PER_PAGE = 20 # Sessions shown per "load more" step on the patient detail page
+    SESSIONS_PER_PAGE = 50 # Page size of the keyset-paginated sessions list
+    SCHEDULE_CACHE_DAYS = 7 # Days of reception schedule kept in memory per worker
+    SCHEDULE_CACHE_TTL = 60 # Seconds before a cached day is rebuilt, bounding staleness from other workers' writes
+    SCHEDULE_POLL_SECONDS = 15 # How often the reception screen re-checks its schedule (cheap: usually a 304)
+    PATIENT_INACTIVE_DAYS = 90 # No completed session for this long marks a patient as inactive in the list filter
+    PATIENT_SUMMARY_INTERVAL = 300 # Seconds between runs of the job moving past next_session_at values on
+    # Live updates (Server-Sent Events). 'memory' only reaches clients of the same worker process;
+    # with several workers use 'redis' (needs the redis package) or a 'module:Class' backend.
+    LIVE_EVENTS_BACKEND = os.environ.get('LIVE_EVENTS_BACKEND') or 'memory'
+    LIVE_EVENTS_REDIS_URL = os.environ.get('LIVE_EVENTS_REDIS_URL') or 'redis://localhost:6379/0'
+    LIVE_EVENTS_QUEUE_SIZE = 100 # Undelivered events buffered per client before it is told to resync
+    LIVE_EVENTS_HEARTBEAT = 15 # Seconds between keep-alive comments on an idle stream
+    LIVE_EVENTS_STREAM_SECONDS = 300 # A stream ends after this long and the browser reconnects, freeing the worker
+    LIVE_EVENTS_RETRY_MS = 3000 # Reconnect delay suggested to the browser
+    CALENDAR_PAST_DAYS = 30 # Therapist .ics feeds cover this many days back...
+    CALENDAR_FUTURE_DAYS = 180 # ...and this many ahead
+    CALENDAR_FEED_CACHE_SIZE = 100 # Therapist feeds kept in memory per worker
+    JOB_QUEUE_PATH = os.environ.get('JOB_QUEUE_PATH') # SQLite job queue file; defaults to instance/jobs.sqlite3
+    JOB_MAX_ATTEMPTS = 5 # Tries per job before it is marked failed
+    JOB_RETRY_DELAY = 30 # Seconds before the first retry; doubles with each further attempt
+    JOB_WORKER_CONCURRENCY = 2 # Threads per `flask jobs worker` process
+    JOB_POLL_INTERVAL = 1.0 # Seconds an idle worker thread waits before checking the queue again
+    JOB_RETENTION_DAYS = 7 # Done and failed jobs are deleted after this long; keep above REMINDER_LEAD_HOURS
+    JOB_PURGE_INTERVAL = 3600 # Seconds between sweeps for expired jobs
+    REMINDER_LEAD_HOURS = 24 # Reminders go out once a session starts within this many hours
+    REMINDER_SCAN_INTERVAL = 300 # Seconds between scans for sessions needing a reminder
+    REMINDER_SENDER = os.environ.get('REMINDER_SENDER') or 'file' # 'file', 'smtp' or 'package.module:ClassName'
+    REMINDER_OUTBOX_PATH = None # File sender output; defaults to instance/reminders_outbox.jsonl
+    REMINDER_SMTP_HOST = os.environ.get('REMINDER_SMTP_HOST') or 'localhost'
+    REMINDER_SMTP_PORT = int(os.environ.get('REMINDER_SMTP_PORT') or 25)
+    REMINDER_FROM_ADDRESS = os.environ.get('REMINDER_FROM_ADDRESS') or 'reminders@localhost'
+    THERAPIST_WEEKLY_HOURS = 40 # Bookable hours per therapist per week; the denominator of utilization
+    ANALYTICS_CACHE_PERIODS = 24 # Analytics reports kept in memory per worker
+    ANALYTICS_CACHE_TTL = 300 # Seconds a report for a period still in progress is reused
+    ROLLUP_INTERVAL = 300 # Seconds between runs of the rollups.refresh job
+    ROLLUP_LAG = 60 # Rows changed more recently than this wait for the next run (lets open transactions commit)
+    REPORT_BATCH_SIZE = 500 # Rows fetched per round trip (and per XLSX chunk) when streaming a report
+    REPORT_CACHE_DIR = os.environ.get('REPORT_CACHE_DIR') # Pre-rendered reports; defaults to <instance>/reports
+    PATIENT_IMPORT_BATCH_SIZE = 1000 # Rows validated and inserted per statement
+    SESSION_IMPORT_BATCH_SIZE = 1000 # Rows resolved and inserted per statement
+    IMPORT_MAX_LISTED = 200 # Rejected rows listed on the import pages; the counts cover all of them
+    DEDUP_MIN_SCORE = 0.85 # Candidate pairs scoring below this are not reported as duplicates
+    DEDUP_MAX_BLOCK = 500 # Larger name buckets are skipped rather than compared pairwise
+    DEDUP_MAX_LISTED = 100 # Candidate pairs shown on the duplicates page
+    DASHBOARD_STATS_TTL = 60 # Seconds the dashboard counters are reused when no change event arrives
 
 
 class DevelopmentConfig(Config):
@@ -47,9 +137,36 @@ class ProductionConfig(Config):
     REMEMBER_COOKIE_HTTPONLY = True
     REMEMBER_COOKIE_SAMESITE = 'Lax' # Or 'Strict'
 
+    SERVER_TIMING_HEADER = False # Keeps database timings out of responses to the public internet
+
+    # Longer lock waits and a larger cache for a busy single-server deployment
+    SQLITE_PRAGMAS = dict(Config.SQLITE_PRAGMAS, busy_timeout=15000, cache_size=-65536, mmap_size=536870912)
+
+class PostgresConfig(ProductionConfig):
+    # For several app servers sharing one database; needs a driver such as psycopg2.
+    # Older platform URLs use the 'postgres://' scheme, which SQLAlchemy no longer accepts.
+    SQLALCHEMY_DATABASE_URI = re.sub(r'^postgres://', 'postgresql://',
+                                     os.environ.get('DATABASE_URL') or 'postgresql://localhost/alfassih')
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE') or 10), # Connections kept open per worker process
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW') or 10), # Extra connections allowed during bursts
+        'pool_timeout': 10, # Seconds a request waits for a free connection before failing
+        'pool_pre_ping': True, # Replaces connections the server or a proxy closed while idle
+        'pool_recycle': 1800, # Seconds before a connection is reopened, ahead of idle timeouts in between
+        'connect_args': {
+            'connect_timeout': 5,
+            'application_name': 'alfassih',
+            # Milliseconds; a runaway query is cancelled instead of holding its connection and locks.
+            # Raise DB_STATEMENT_TIMEOUT_MS for processes running long jobs such as rollup rebuilds.
+            'options': f"-c statement_timeout={int(os.environ.get('DB_STATEMENT_TIMEOUT_MS') or 30000)}"
+                       f" -c lock_timeout=10000 -c idle_in_transaction_session_timeout=60000",
+        },
+    }
+
 
 config_by_name = dict(
     development=DevelopmentConfig,
     production=ProductionConfig,
+    postgres=PostgresConfig,
     default=DevelopmentConfig # Default to development for safety if FLASK_CONFIG not set
 )
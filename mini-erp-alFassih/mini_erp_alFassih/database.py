@@ -0,0 +1,46 @@
+"""
+Per-dialect tuning of the SQLAlchemy engines.
+
+With SQLAlchemy's defaults a SQLite file runs in rollback-journal mode: every
+commit fsyncs twice and a writer locks readers out until it commits, so under
+concurrent requests readers wait and writers fail with "database is locked".
+The SQLITE_PRAGMAS profile of the config class is applied to every new DBAPI
+connection from a connect event:
+
+- journal_mode=WAL lets readers keep reading the last committed snapshot while
+  one writer appends to the log (persistent in the file once set);
+- synchronous=NORMAL fsyncs at checkpoints instead of on every commit, which is
+  safe in WAL mode (a power cut can lose the last commits, never corrupt);
+- busy_timeout makes a second writer wait for the lock instead of failing;
+- cache_size (negative: KiB) and mmap_size keep hot pages in memory;
+- foreign_keys enforces the FOREIGN KEY constraints SQLite ignores by default.
+
+An empty SQLITE_PRAGMAS leaves SQLite at its defaults.
+"""
+
+from sqlalchemy import event
+
+def _sqlite_pragma_listener(pragmas):
+    statements = [f'PRAGMA {name}={value}' for name, value in pragmas.items()]
+
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for statement in statements:
+                cursor.execute(statement)
+        finally:
+            cursor.close()
+    return set_pragmas
+
+def configure_sqlite(engine, pragmas):
+    """Applies pragmas ({name: value}) to every connection the engine opens from now on."""
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+    event.listen(engine, 'connect', _sqlite_pragma_listener(pragmas))
+
+def init_engines(app, db):
+    """Tunes every engine of db for the app's config; call right after db.init_app(app)."""
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        configure_sqlite(engine, app.config.get('SQLITE_PRAGMAS') or {})
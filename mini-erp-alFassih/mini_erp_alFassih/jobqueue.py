@@ -0,0 +1,226 @@
+"""
+Durable job queue in a local SQLite file.
+
+Jobs survive restarts and are shared by every process on the host that opens
+the same file. A job is claimed under a lease: if its worker dies, the lease
+expires and another worker picks it up, so handlers must tolerate running
+twice. Failed jobs are retried with exponential backoff until max_attempts.
+An idempotency key makes enqueueing the same logical job twice a no-op.
+"""
+
+import json
+import os
+import sqlite3
+from contextlib import closing, contextmanager
+from datetime import datetime, timedelta
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS job (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    queue TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    idempotency_key TEXT UNIQUE,
+    status TEXT NOT NULL DEFAULT 'queued', -- queued, running, done, failed
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    run_at TEXT NOT NULL,
+    locked_until TEXT,
+    last_error TEXT,
+    result TEXT,
+    owner_id INTEGER, -- User who enqueued the job; only they (and admins) see its status
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_job_queue_status_run_at ON job (queue, status, run_at);
+"""
+
+# Columns added after the first release, created on open in queue files that predate them
+ADDED_COLUMNS = {
+    'result': 'TEXT',
+    'owner_id': 'INTEGER',
+}
+
+def _timestamp(value):
+    # Fixed-width ISO strings compare in time order, so SQLite can range-scan them
+    return value.strftime('%Y-%m-%dT%H:%M:%S.%f')
+
+class Job:
+    def __init__(self, row):
+        self.id = row['id']
+        self.queue = row['queue']
+        self.payload = json.loads(row['payload'])
+        self.idempotency_key = row['idempotency_key']
+        self.status = row['status']
+        self.attempts = row['attempts']
+        self.max_attempts = row['max_attempts']
+        self.last_error = row['last_error']
+        self.result = json.loads(row['result']) if row['result'] is not None else None
+        self.owner_id = row['owner_id']
+        self.run_at = row['run_at']
+        self.created_at = row['created_at']
+        self.updated_at = row['updated_at']
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'task': self.queue,
+            'status': self.status,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'last_error': self.last_error,
+            'result': self.result,
+            'run_at': self.run_at,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at,
+        }
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.queue} {self.status} attempt {self.attempts}/{self.max_attempts}>'
+
+class JobQueue:
+    def __init__(self, path, max_attempts=5, retry_delay=30):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay # Seconds before the first retry; doubles with each attempt
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            existing = {row['name'] for row in conn.execute('PRAGMA table_info(job)')}
+            for name, column_type in ADDED_COLUMNS.items():
+                if name not in existing:
+                    conn.execute(f'ALTER TABLE job ADD COLUMN {name} {column_type}')
+
+    @contextmanager
+    def _connect(self):
+        # A connection per call keeps the queue safe to share between threads and processes
+        with closing(sqlite3.connect(self.path, timeout=30, isolation_level=None)) as conn:
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL') # Readers never block the single writer
+            conn.execute('PRAGMA synchronous=NORMAL')
+            yield conn
+
+    def enqueue(self, queue, payloads, now=None, run_at=None, max_attempts=None):
+        """Adds jobs given as (idempotency_key, payload) pairs in one transaction.
+        Keys already present are skipped; returns the number of jobs added.
+        """
+        now = _timestamp(now or datetime.utcnow())
+        rows = [(queue, json.dumps(payload, default=str), key, max_attempts or self.max_attempts,
+                 _timestamp(run_at) if run_at else now, now, now) for key, payload in payloads]
+        if not rows:
+            return 0
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            before = conn.total_changes
+            conn.executemany(
+                'INSERT OR IGNORE INTO job (queue, payload, idempotency_key, max_attempts, run_at, created_at, updated_at)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            added = conn.total_changes - before
+            conn.execute('COMMIT')
+        return added
+
+    def enqueue_one(self, queue, payload, key=None, now=None, run_at=None, max_attempts=None, owner_id=None):
+        """Adds one job and returns its id. With a key already in use, returns the existing job's id;
+        if that job failed for good, it is queued again (with the new payload) rather than left dead.
+        """
+        now = _timestamp(now or datetime.utcnow())
+        values = (json.dumps(payload, default=str), max_attempts or self.max_attempts,
+                  _timestamp(run_at) if run_at else now, owner_id)
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            cursor = conn.execute(
+                'INSERT OR IGNORE INTO job (queue, payload, max_attempts, run_at, owner_id, idempotency_key,'
+                ' created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (queue, *values, key, now, now))
+            if cursor.rowcount:
+                job_id = cursor.lastrowid
+            else:
+                row = conn.execute('SELECT id, status FROM job WHERE idempotency_key = ?', (key,)).fetchone()
+                job_id = row['id']
+                if row['status'] == 'failed':
+                    conn.execute("UPDATE job SET status = 'queued', attempts = 0, payload = ?, max_attempts = ?,"
+                                 " run_at = ?, owner_id = ?, locked_until = NULL, last_error = NULL, result = NULL,"
+                                 " updated_at = ? WHERE id = ?", (*values, now, job_id))
+            conn.execute('COMMIT')
+        return job_id
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute('SELECT * FROM job WHERE id = ?', (job_id,)).fetchone()
+        return Job(row) if row is not None else None
+
+    def claim(self, queues, limit=1, lease=60, now=None):
+        """Marks up to limit due jobs from the given queue name(s) as running for lease seconds
+        (or, given a {queue: seconds} mapping, for their own queue's lease) and returns them.
+        Jobs whose previous lease ran out are claimed again, unless that was their last attempt:
+        a job that keeps killing its worker is marked failed instead.
+        """
+        queues = [queues] if isinstance(queues, str) else list(queues)
+        now = now or datetime.utcnow()
+        stamp = _timestamp(now)
+        in_queues = f"queue IN ({', '.join('?' * len(queues))})"
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE') # Takes the write lock up front, so two workers never claim one job
+            conn.execute(
+                f"UPDATE job SET status = 'failed', locked_until = NULL, updated_at = ?,"
+                " last_error = 'Lease expired on the last attempt; the worker stopped or timed out.'"
+                f" WHERE {in_queues} AND status = 'running' AND locked_until < ? AND attempts >= max_attempts",
+                (stamp, *queues, stamp))
+            rows = conn.execute(
+                f"SELECT * FROM job WHERE {in_queues} AND ("
+                "  (status = 'queued' AND run_at <= ?) OR (status = 'running' AND locked_until < ?)"
+                ") ORDER BY run_at, id LIMIT ?", (*queues, stamp, stamp, limit)).fetchall()
+            conn.executemany(
+                "UPDATE job SET status = 'running', attempts = attempts + 1, locked_until = ?, updated_at = ? WHERE id = ?",
+                [(_timestamp(now + timedelta(seconds=lease[row['queue']] if isinstance(lease, dict) else lease)),
+                  stamp, row['id']) for row in rows])
+            conn.execute('COMMIT')
+        jobs = [Job(row) for row in rows]
+        for job in jobs:
+            job.status, job.attempts = 'running', job.attempts + 1
+        return jobs
+
+    def complete(self, job, result=None, now=None):
+        """Marks the job done, storing result (anything JSON-serializable) for the status API."""
+        with self._connect() as conn:
+            conn.execute("UPDATE job SET status = 'done', locked_until = NULL, last_error = NULL, result = ?,"
+                         " updated_at = ? WHERE id = ?",
+                         (json.dumps(result, default=str) if result is not None else None,
+                          _timestamp(now or datetime.utcnow()), job.id))
+        job.status, job.result = 'done', result
+
+    def fail(self, job, error, now=None):
+        """Schedules a retry with exponential backoff, or marks the job failed after its last attempt."""
+        now = now or datetime.utcnow()
+        if job.attempts >= job.max_attempts:
+            status, run_at = 'failed', now
+        else:
+            status, run_at = 'queued', now + timedelta(seconds=self.retry_delay * 2 ** (job.attempts - 1))
+        with self._connect() as conn:
+            conn.execute("UPDATE job SET status = ?, run_at = ?, locked_until = NULL, last_error = ?, updated_at = ?"
+                         " WHERE id = ?", (status, _timestamp(run_at), str(error)[:2000], _timestamp(now), job.id))
+        job.status = status
+        return status
+
+    def purge(self, before):
+        """Deletes done and failed jobs last updated before the given time; returns how many."""
+        with self._connect() as conn:
+            cursor = conn.execute("DELETE FROM job WHERE status IN ('done', 'failed') AND updated_at < ?",
+                                  (_timestamp(before),))
+        return cursor.rowcount
+
+    def counts(self, queue=None):
+        """Returns {status: number of jobs}, optionally for one queue."""
+        with self._connect() as conn:
+            if queue is None:
+                rows = conn.execute('SELECT status, COUNT(*) FROM job GROUP BY status').fetchall()
+            else:
+                rows = conn.execute('SELECT status, COUNT(*) FROM job WHERE queue = ? GROUP BY status',
+                                    (queue,)).fetchall()
+        return {status: count for status, count in rows}
+
+    def stats(self):
+        """Returns {queue: {status: number of jobs}} for every queue."""
+        stats = {}
+        with self._connect() as conn:
+            for queue, status, count in conn.execute('SELECT queue, status, COUNT(*) FROM job GROUP BY queue, status'):
+                stats.setdefault(queue, {})[status] = count
+        return stats
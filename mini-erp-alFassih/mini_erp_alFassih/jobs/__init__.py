@@ -0,0 +1,8 @@
+from flask import Blueprint
+from flask.cli import AppGroup
+
+jobs_bp = Blueprint('jobs', __name__)
+jobs_cli = AppGroup('jobs', help='Run and inspect background jobs.')
+
+from .manager import jobs
+from . import routes, commands
@@ -0,0 +1,27 @@
+import click
+from flask import current_app
+
+from . import jobs_cli
+from .manager import jobs
+from .worker import Worker
+
+@jobs_cli.command('worker')
+@click.option('--concurrency', '-c', default=None, type=int, help='Jobs run in parallel (default JOB_WORKER_CONCURRENCY).')
+@click.option('--task', 'task_names', multiple=True, help='Only run these tasks (repeatable). Default: all.')
+def worker_command(concurrency, task_names):
+    """Runs background jobs until interrupted."""
+    unknown = set(task_names) - set(jobs.tasks)
+    if unknown:
+        raise click.BadParameter(f"Unknown task(s): {', '.join(sorted(unknown))}", param_hint='--task')
+    worker = Worker(current_app._get_current_object(), jobs, task_names=task_names,
+                    concurrency=concurrency or current_app.config.get('JOB_WORKER_CONCURRENCY', 2),
+                    poll_interval=current_app.config.get('JOB_POLL_INTERVAL', 1.0))
+    click.echo(f'Job worker started: {worker.concurrency} thread(s), tasks {", ".join(worker.task_names)}.')
+    worker.run()
+    click.echo('Job worker stopped.')
+
+@jobs_cli.command('stats')
+def stats_command():
+    """Prints job counts per task and status."""
+    for task_name, counts in sorted(jobs.queue.stats().items()):
+        click.echo(f"{task_name}: {', '.join(f'{status}={count}' for status, count in sorted(counts.items()))}")
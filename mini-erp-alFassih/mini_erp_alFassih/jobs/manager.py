@@ -0,0 +1,71 @@
+"""
+Task registry and the entry point blueprints use to run work in the background.
+
+    @jobs.task('reports.render', timeout=600)
+    def render_report(payload):
+        ...
+        return {'path': path} # Stored as the job's result
+
+    job_id = jobs.enqueue('reports.render', {'month': '2026-09'}, key='report:2026-09')
+
+Jobs go to the SQLite queue (jobqueue.py) and are executed by `flask jobs worker`
+processes, which can be scaled independently of the web workers.
+"""
+
+import os
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from ..jobqueue import JobQueue
+
+class Task:
+    def __init__(self, name, func, max_attempts, timeout, every):
+        self.name = name
+        self.func = func
+        self.max_attempts = max_attempts
+        self.timeout = timeout # Lease length: a job running longer is assumed dead and retried
+        self.every = every # Seconds (or the config setting holding them) between runs of a periodic task
+
+class JobManager:
+    def __init__(self):
+        self.tasks = {}
+        self.queue = None
+
+    def init_app(self, app):
+        path = app.config.get('JOB_QUEUE_PATH') or os.path.join(app.instance_path, 'jobs.sqlite3')
+        self.queue = JobQueue(path, max_attempts=app.config.get('JOB_MAX_ATTEMPTS', 5),
+                              retry_delay=app.config.get('JOB_RETRY_DELAY', 30))
+        app.extensions['jobs'] = self
+
+    def task(self, name, max_attempts=None, timeout=300, every=None):
+        """Registers the decorated function(payload) as the handler for jobs named name.
+        With every=N (or the name of a config setting), workers also enqueue the task with an
+        empty payload every N seconds.
+        """
+        def decorator(func):
+            self.tasks[name] = Task(name, func, max_attempts, timeout, every)
+            return func
+        return decorator
+
+    def enqueue(self, name, payload=None, key=None, run_at=None, owner_id=None):
+        """Queues a job for a registered task and returns its id.
+        Reusing a key returns the id of the job already queued under it, unless that job failed
+        for good, in which case it is queued again.
+        owner_id is the user allowed to poll the job's status (admins see every job).
+        """
+        if name not in self.tasks:
+            raise KeyError(f'No background task is registered as {name!r}.')
+        return self.queue.enqueue_one(name, payload or {}, key=key, run_at=run_at,
+                                      max_attempts=self.tasks[name].max_attempts, owner_id=owner_id)
+
+    def get(self, job_id):
+        return self.queue.get(job_id)
+
+jobs = JobManager()
+
+@jobs.task('jobs.purge', every='JOB_PURGE_INTERVAL')
+def purge_finished_jobs(payload):
+    """Drops finished jobs, including the rows periodic tasks leave behind, once past the retention window."""
+    cutoff = datetime.utcnow() - timedelta(days=current_app.config['JOB_RETENTION_DAYS'])
+    return {'purged': jobs.queue.purge(cutoff)}
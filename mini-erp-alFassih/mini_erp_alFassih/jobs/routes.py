@@ -0,0 +1,23 @@
+from flask import jsonify, abort
+from flask_login import login_required, current_user
+
+from . import jobs_bp
+from .manager import jobs
+from ..decorators import admin_required
+
+@jobs_bp.route('/<int:job_id>')
+@login_required
+def job_status(job_id):
+    """Status, attempts, last error and result of one job, for clients polling a job they started."""
+    job = jobs.get(job_id)
+    # Other users' jobs look the same as missing ones, so ids can't be probed
+    if job is None or (job.owner_id != current_user.id and getattr(current_user, 'role', None) != 'admin'):
+        abort(404)
+    return jsonify(job.to_dict())
+
+@jobs_bp.route('/')
+@login_required
+@admin_required
+def job_stats():
+    """Job counts per task and status."""
+    return jsonify(jobs.queue.stats())
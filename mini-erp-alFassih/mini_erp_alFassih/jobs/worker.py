@@ -0,0 +1,82 @@
+"""
+The background worker behind `flask jobs worker`.
+
+Each worker process runs `concurrency` threads that claim one job at a time
+and call its task handler inside an app context. On SIGINT/SIGTERM the worker
+stops claiming, lets running jobs finish and exits; a job cut short by a hard
+kill is retried once its lease (the task timeout) runs out.
+"""
+
+import signal
+import threading
+import time
+
+from .. import db
+
+class Worker:
+    def __init__(self, app, manager, task_names=None, concurrency=2, poll_interval=1.0):
+        self.app = app
+        self.manager = manager
+        self.task_names = list(task_names or manager.tasks)
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.stopping = threading.Event()
+        self._periodic_buckets = {}
+
+    def run_once(self):
+        """Claims and runs at most one job; returns False when nothing was due."""
+        tasks = self.manager.tasks
+        # Each job is leased for its own task's timeout, so a hung short task is retried promptly
+        claimed = self.manager.queue.claim(self.task_names, limit=1,
+                                           lease={name: tasks[name].timeout for name in self.task_names})
+        if not claimed:
+            return False
+        job = claimed[0]
+        with self.app.app_context():
+            try:
+                result = tasks[job.queue].func(job.payload)
+            except Exception as e:
+                db.session.rollback()
+                status = self.manager.queue.fail(job, e)
+                self.app.logger.exception(f'Job {job.id} ({job.queue}) failed on attempt {job.attempts}, now {status}')
+            else:
+                self.manager.queue.complete(job, result)
+            finally:
+                db.session.remove()
+        return True
+
+    def _loop(self):
+        while not self.stopping.is_set():
+            if not self.run_once():
+                self.stopping.wait(self.poll_interval)
+
+    def enqueue_periodic(self, now=None):
+        """Queues each periodic task once per interval. Every worker tries, but they all use the
+        same idempotency key for an interval, so only one job is added.
+        """
+        now = now or time.time()
+        for name in self.task_names:
+            task = self.manager.tasks[name]
+            every = self.app.config[task.every] if isinstance(task.every, str) else task.every
+            if not every:
+                continue
+            bucket = int(now // every)
+            if self._periodic_buckets.get(name) != bucket:
+                self.manager.queue.enqueue_one(name, {}, key=f'{name}@{bucket}')
+                self._periodic_buckets[name] = bucket
+
+    def stop(self, *args):
+        self.stopping.set()
+
+    def run(self):
+        """Runs until stopped; call from the main thread so signal handlers can be installed."""
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, self.stop)
+        threads = [threading.Thread(target=self._loop, name=f'job-worker-{n}') for n in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        while not self.stopping.is_set():
+            self.enqueue_periodic()
+            self.stopping.wait(1.0)
+        for thread in threads:
+            thread.join() # Each finishes its current job before exiting
@@ -0,0 +1,6 @@
+from flask import Blueprint
+
+live_bp = Blueprint('live', __name__)
+
+from .broker import broker
+from . import publish, routes
@@ -0,0 +1,136 @@
+"""
+In-process publish/subscribe for live updates, with a pluggable transport.
+
+Messages are published to a backend. The default MemoryBackend hands them
+straight back to this process; RedisBackend (needs the optional `redis` package)
+relays them through Redis pub/sub so every worker process sees every message.
+Either way, delivery to local subscribers happens in Broker._dispatch.
+"""
+
+import importlib
+import itertools
+import json
+import queue
+import threading
+import uuid
+
+class Subscription:
+    """A bounded queue of messages for one client connection."""
+
+    def __init__(self, channels, maxsize):
+        self.channels = set(channels)
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def get(self, timeout):
+        """Returns the next message, or None if nothing arrived within timeout seconds."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+class MemoryBackend:
+    """Delivers messages only within the current process."""
+
+    def __init__(self, broker, app):
+        self.broker = broker
+
+    def publish(self, message):
+        self.broker._dispatch(message)
+
+    def close(self):
+        pass
+
+class RedisBackend:
+    """Relays messages through Redis pub/sub so all worker processes receive them."""
+
+    def __init__(self, broker, app):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("LIVE_EVENTS_BACKEND='redis' requires the 'redis' package (pip install redis).")
+        self.broker = broker
+        self.channel = app.config.get('LIVE_EVENTS_REDIS_CHANNEL', 'alfassih-live')
+        self.client = redis.Redis.from_url(app.config['LIVE_EVENTS_REDIS_URL'])
+        self.pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        self.pubsub.subscribe(**{self.channel: self._on_redis_message})
+        self.thread = self.pubsub.run_in_thread(sleep_time=1.0, daemon=True)
+
+    def _on_redis_message(self, redis_message):
+        self.broker._dispatch(json.loads(redis_message['data']))
+
+    def publish(self, message):
+        self.client.publish(self.channel, json.dumps(message, default=str))
+
+    def close(self):
+        self.thread.stop()
+        self.pubsub.close()
+
+BACKENDS = {
+    'memory': MemoryBackend,
+    'redis': RedisBackend,
+}
+
+def _load_backend_class(name):
+    """Resolves a backend by short name or as a 'package.module:ClassName' path."""
+    if name in BACKENDS:
+        return BACKENDS[name]
+    module_name, _, class_name = name.partition(':')
+    return getattr(importlib.import_module(module_name), class_name)
+
+class Broker:
+    def __init__(self):
+        self.backend = None
+        self.origin = uuid.uuid4().hex # Identifies messages published by this process
+        self.subscriber_queue_size = 100
+        self._subscriptions = set()
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def init_app(self, app):
+        if self.backend is not None:
+            self.backend.close()
+        self.subscriber_queue_size = app.config.get('LIVE_EVENTS_QUEUE_SIZE', self.subscriber_queue_size)
+        self.backend = _load_backend_class(app.config.get('LIVE_EVENTS_BACKEND', 'memory'))(self, app)
+        app.extensions['live_broker'] = self
+
+    def subscribe(self, channels):
+        subscription = Subscription(channels, self.subscriber_queue_size)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def add_listener(self, callback):
+        """Registers callback(message) for every message, local or relayed from another process."""
+        self._listeners.append(callback)
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscriptions)
+
+    def publish(self, channel, event, data):
+        message = {'channel': channel, 'event': event, 'data': data, 'origin': self.origin}
+        if self.backend is None: # Not initialized (e.g. a script using models without create_app)
+            return
+        self.backend.publish(message)
+
+    def _dispatch(self, message):
+        message = dict(message, id=next(self._ids))
+        for callback in self._listeners:
+            callback(message)
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            if message['channel'] in subscription.channels:
+                try:
+                    subscription.queue.put_nowait(message)
+                except queue.Full:
+                    # A stalled client must not block publishers; it will resync on reconnect
+                    subscription.dropped += 1
+
+broker = Broker()
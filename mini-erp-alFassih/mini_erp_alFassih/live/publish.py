@@ -0,0 +1,55 @@
+"""
+Turns committed data changes (see signals.py) into live events.
+
+'schedule' channel: one event per changed session (session.created, session.updated,
+session.cancelled, session.deleted) and schedule.renamed when names shown on the
+schedule change.
+'dashboard' channel: a counters event with per-table row deltas whenever anything
+counted on the admin dashboard may have changed.
+
+Messages relayed from other processes also mark the local schedule cache stale.
+"""
+
+from ..signals import sessions_changed, counters_changed
+from ..schedule import daily_schedule
+from .broker import broker
+
+def _session_event(change):
+    if change['kind'] == 'updated' and change['status'] == 'Cancelled':
+        return 'session.cancelled'
+    return f"session.{change['kind']}"
+
+def _session_data(change):
+    start_time = change['start_time']
+    return {
+        'id': change['id'],
+        'patient_id': change['patient_id'],
+        'therapist_id': change['therapist_id'],
+        'start_time': start_time.isoformat() if start_time else None,
+        'status': change['status'],
+    }
+
+def _on_sessions_changed(sender, changes=(), renamed=None, **extra):
+    for change in changes:
+        broker.publish('schedule', _session_event(change), _session_data(change))
+    if renamed and (renamed['patients'] or renamed['therapists']):
+        broker.publish('schedule', 'schedule.renamed',
+                       {'patients': sorted(renamed['patients']), 'therapists': sorted(renamed['therapists'])})
+    # Status changes move 'sessions today' even when no row was added or removed
+    broker.publish('dashboard', 'counters', {'deltas': {}, 'sessions_changed': len(changes)})
+
+def _on_counters_changed(sender, deltas=None, **extra):
+    broker.publish('dashboard', 'counters', {'deltas': deltas, 'sessions_changed': 0})
+
+def _on_remote_message(message):
+    """Applies schedule changes committed by other worker processes to this process's cache."""
+    if message['origin'] == broker.origin or message['channel'] != 'schedule':
+        return
+    if message['event'] == 'schedule.renamed':
+        daily_schedule.mark_stale([], names_changed=True)
+    else:
+        daily_schedule.mark_stale([message['data']['id']])
+
+sessions_changed.connect(_on_sessions_changed, weak=False)
+counters_changed.connect(_on_counters_changed, weak=False)
+broker.add_listener(_on_remote_message)
@@ -0,0 +1,58 @@
+import json
+import time
+
+from flask import Response, request, current_app, abort
+from flask_login import login_required, current_user
+
+from . import live_bp
+from .broker import broker
+from .. import db
+
+# Channel -> role required to subscribe (None: any logged-in user)
+CHANNELS = {
+    'schedule': None,
+    'dashboard': 'admin',
+}
+
+def _format_event(message):
+    return f"id: {message['id']}\nevent: {message['event']}\ndata: {json.dumps(message['data'])}\n\n"
+
+@live_bp.route('/stream')
+@login_required
+def stream():
+    """Server-Sent Events stream of the requested channels, e.g. /live/stream?channels=schedule,dashboard."""
+    requested = [name for name in request.args.get('channels', 'schedule').split(',') if name]
+    channels = [name for name in requested
+                if name in CHANNELS and CHANNELS[name] in (None, getattr(current_user, 'role', None))]
+    if not channels or len(channels) != len(requested):
+        abort(403)
+
+    heartbeat = current_app.config.get('LIVE_EVENTS_HEARTBEAT', 15)
+    lifetime = current_app.config.get('LIVE_EVENTS_STREAM_SECONDS', 300)
+    retry_ms = current_app.config.get('LIVE_EVENTS_RETRY_MS', 3000)
+    subscription = broker.subscribe(channels)
+    # The stream never touches the database; hand the connection back before it starts
+    db.session.remove()
+
+    def generate():
+        try:
+            yield f'retry: {retry_ms}\n\n'
+            deadline = time.monotonic() + lifetime
+            while time.monotonic() < deadline:
+                message = subscription.get(timeout=heartbeat)
+                if subscription.dropped:
+                    # Events were lost while this client lagged; it should reload instead of patching
+                    subscription.dropped = 0
+                    yield 'event: resync\ndata: {}\n\n'
+                if message is None:
+                    yield ': keep-alive\n\n' # Keeps proxies from closing an idle connection
+                else:
+                    yield _format_event(message)
+            # Ending the stream frees this worker thread; EventSource reconnects after retry_ms
+        finally:
+            broker.unsubscribe(subscription)
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no' # Stop nginx from buffering the stream
+    return response
@@ -0,0 +1,70 @@
+"""
+Normalized patient keys for finding the same person twice.
+
+Patient.match_key holds last name, first name and date of birth reduced to a
+canonical form: case, accents, Arabic diacritics and letter variants (alef
+forms, taa marbuta, alef maqsura), tatweel, punctuation and extra spaces are
+ignored. It is indexed and kept current by the hooks below, so the importer can
+check a whole batch of rows against existing patients with one IN query.
+Set-based inserts must fill it in themselves with patient_match_key.
+
+The same key backs the patient search: every word typed must start a word of
+the patient's name. On PostgreSQL this is a full-text prefix query served by a
+GIN index; SQLite runs the equivalent LIKE over the column.
+"""
+
+import re
+import unicodedata
+from functools import lru_cache
+
+from sqlalchemy import event
+
+from . import db
+from .analytics import dialect_name
+from .models import Patient
+
+# Letters that are routinely typed interchangeably; hamza-carrying alefs are handled by NFKD
+LETTER_VARIANTS = str.maketrans({
+    'ة': 'ه', # Taa marbuta
+    'ى': 'ي', # Alef maqsura
+    'ـ': None, # Tatweel
+})
+
+_NON_WORD = re.compile(r'[\W_]+')
+
+@lru_cache(maxsize=50000) # Imports repeat the same first and last names many times
+def normalize_name(value):
+    if not value:
+        return ''
+    text = str(value)
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(char for char in text if not unicodedata.combining(char)) # Accents and harakat
+    return ' '.join(_NON_WORD.sub(' ', text.translate(LETTER_VARIANTS).casefold()).split())
+
+def patient_match_key(first_name, last_name, date_of_birth):
+    return f"{normalize_name(last_name)}|{normalize_name(first_name)}|{date_of_birth.isoformat() if date_of_birth else ''}"
+
+@event.listens_for(Patient, 'before_insert')
+@event.listens_for(Patient, 'before_update')
+def _set_match_key(mapper, connection, target):
+    target.match_key = patient_match_key(target.first_name, target.last_name, target.date_of_birth)
+
+def match_key_startswith(prefix):
+    """Criterion for match keys beginning with prefix (e.g. 'last|first|' for a name with any birth date)."""
+    if dialect_name() == 'postgresql':
+        # A range would follow the column collation, which need not sort '~' after letters and digits
+        return Patient.match_key.startswith(prefix, autoescape=True)
+    return db.and_(Patient.match_key >= prefix, Patient.match_key < prefix + '~')
+
+def search_criteria(text):
+    """Criteria matching patients whose name words start with every word of text; None if text has no words."""
+    words = normalize_name(text).split()
+    if not words:
+        return None
+    if dialect_name() == 'postgresql':
+        # Must stay the expression indexed by ix_patient_match_key_search (models.py)
+        document = db.func.to_tsvector('simple', db.func.replace(Patient.match_key, '|', ' '))
+        return [document.bool_op('@@')(db.func.to_tsquery('simple', ' & '.join(f'{word}:*' for word in words)))]
+    words_of_key = ' ' + db.func.replace(Patient.match_key, '|', ' ')
+    return [words_of_key.like(f'% {word}%') for word in words]
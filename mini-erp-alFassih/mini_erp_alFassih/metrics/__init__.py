@@ -0,0 +1,62 @@
+import time
+
+from flask import Blueprint, g, request
+
+metrics_bp = Blueprint('metrics', __name__)
+
+from .registry import registry
+
+http_requests = registry.counter('alfassih_http_requests_total', 'Requests handled, by endpoint, method and status code.',
+                                 ('endpoint', 'method', 'status'))
+http_request_seconds = registry.histogram('alfassih_http_request_duration_seconds',
+                                          'Time from the start of a request until its response was sent.', ('endpoint',))
+upload_bytes = registry.counter('alfassih_upload_bytes_total', 'Bytes received in multipart (file upload) requests.',
+                                ('endpoint',))
+db_queries = registry.counter('alfassih_db_queries_total', 'SQL statements issued while handling requests.', ('endpoint',))
+db_seconds = registry.counter('alfassih_db_query_seconds_total', 'Time spent in SQL statements while handling requests.',
+                              ('endpoint',))
+cache_requests = registry.counter('alfassih_cache_requests_total',
+                                  'Lookups in the in-process caches; hit ratio = hit / (hit + miss).', ('cache', 'result'))
+
+@registry.gauge('alfassih_jobs', 'Background jobs in the queue, by task and status.', ('queue', 'status'))
+def _job_counts():
+    from ..jobs import jobs
+    if jobs.queue is None:
+        return []
+    return [((queue, status), count) for queue, statuses in sorted(jobs.queue.stats().items())
+            for status, count in sorted(statuses.items())]
+
+def cache_lookup(cache, hit):
+    """Counts one lookup in cache; returns hit so callers can wrap their test."""
+    cache_requests.inc(cache=cache, result='hit' if hit else 'miss')
+    return hit
+
+def init_app(app):
+    registry.configure(app.config.get('METRICS_DIR'), app.config.get('METRICS_FLUSH_INTERVAL', 5))
+    app.extensions['metrics'] = registry
+    if _start not in app.before_request_funcs.get(None, []):
+        app.before_request(_start)
+        app.after_request(_remember_status)
+        app.teardown_request(_finish)
+
+def _start():
+    g.metrics_started = time.perf_counter()
+    g.pop('metrics_status', None)
+
+def _remember_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+def _finish(exc):
+    # Teardown runs once a streamed response has been sent, so its time is included
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return
+    endpoint = request.endpoint or 'unmatched' # Unknown URLs share one label instead of one each
+    status = g.pop('metrics_status', None) or 500
+    http_requests.inc(endpoint=endpoint, method=request.method, status=status)
+    http_request_seconds.observe(time.perf_counter() - started, endpoint=endpoint)
+    if request.mimetype == 'multipart/form-data' and request.content_length:
+        upload_bytes.inc(request.content_length, endpoint=endpoint)
+
+from . import routes
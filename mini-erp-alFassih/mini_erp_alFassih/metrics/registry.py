@@ -0,0 +1,214 @@
+"""
+Counters and histograms for /metrics, cheap enough to update on every request.
+
+Each thread adds to its own dict of samples, so recording a value takes no
+lock: a dict has a single writer and the GIL makes copying it safe. A scrape
+sums the per-thread dicts; dicts of threads that have exited are folded into
+one so servers that start a thread per request do not grow the list forever.
+
+Worker processes each count for themselves. With METRICS_DIR set, every
+process also writes its totals to <METRICS_DIR>/<pid>-<random>.json (every
+METRICS_FLUSH_INTERVAL seconds from a background thread, and on exit), and a
+scrape answered by any worker adds up the files of all of them. Files of processes that have
+exited are kept, so counters never go backwards; empty the directory when the
+whole service is redeployed.
+
+Gauges such as the job queue depth are not counted but read when scraped,
+from functions registered with Registry.gauge().
+"""
+
+import atexit
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Metric:
+    def __init__(self, registry, kind, name, help, labels):
+        self.registry = registry
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+
+    def _key(self, labels):
+        return tuple(str(labels[label]) for label in self.labels)
+
+class Counter(Metric):
+    def inc(self, amount=1, **labels):
+        shard = self.registry._shard()
+        key = (self.name, self._key(labels), None)
+        shard[key] = shard.get(key, 0) + amount
+
+class Histogram(Metric):
+    def __init__(self, registry, name, help, labels, buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, 'histogram', name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        shard = self.registry._shard()
+        label_values = self._key(labels)
+        bucket = (self.name, label_values, bisect.bisect_left(self.buckets, value)) # len(buckets) is +Inf
+        shard[bucket] = shard.get(bucket, 0) + 1
+        total = (self.name, label_values, 'sum')
+        shard[total] = shard.get(total, 0) + value
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self._gauges = [] # (name, help, labels, function returning [(label values, value)])
+        self._shards = [] # (thread, samples)
+        self._retired = {} # Samples of exited threads
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.directory = None
+        self.flush_interval = 5
+        self._file = None
+        self._pid = None
+
+    def counter(self, name, help, labels=()):
+        return self._register(Counter(self, 'counter', name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self, name, help, labels, buckets))
+
+    def gauge(self, name, help, labels=()):
+        """Decorator: the function returns [(label values tuple, value)] when /metrics is scraped."""
+        def decorator(func):
+            self._gauges.append((name, help, tuple(labels), func))
+            return func
+        return decorator
+
+    def _register(self, metric):
+        self.metrics.setdefault(metric.name, metric)
+        return self.metrics[metric.name]
+
+    def _shard(self):
+        samples = getattr(self._local, 'samples', None)
+        if samples is None:
+            samples = self._local.samples = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), samples))
+        return samples
+
+    def configure(self, directory=None, flush_interval=5):
+        if directory != self.directory:
+            self._pid = self._file = None
+        self.directory = directory
+        self.flush_interval = flush_interval
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            if self._file is None:
+                atexit.register(self._flush_quietly)
+            self._own_file()
+
+    def _own_file(self):
+        # Workers forked from a master that loaded the app (gunicorn --preload) each need a file of their own
+        if self.directory and self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._file = os.path.join(self.directory, f'{self._pid}-{uuid.uuid4().hex[:8]}.json')
+            threading.Thread(target=self._flush_periodically, args=(self._file,), name='metrics-flush', daemon=True).start()
+        return self._file
+
+    def _flush_periodically(self, file):
+        while self._file == file:
+            time.sleep(self.flush_interval)
+            self._flush_quietly()
+
+    def local_samples(self):
+        """This process's totals: {(name, label values, bucket index | 'sum' | None): value}."""
+        totals = {}
+        with self._lock:
+            alive = []
+            for thread, samples in self._shards:
+                if thread.is_alive():
+                    alive.append((thread, samples))
+                else:
+                    _add(self._retired, samples)
+            self._shards = alive
+            _add(totals, self._retired)
+        for _, samples in alive:
+            _add(totals, samples.copy())
+        return totals
+
+    def flush(self):
+        """Writes this process's totals to METRICS_DIR, if one is configured."""
+        if self._own_file() is None:
+            return
+        payload = [[name, list(labels), bucket, value] for (name, labels, bucket), value in self.local_samples().items()]
+        partial = f'{self._file}.part'
+        with open(partial, 'w', encoding='utf-8') as output:
+            json.dump(payload, output)
+        os.replace(partial, self._file) # Readers see the previous or the new totals, never half a file
+
+    def _flush_quietly(self):
+        try:
+            self.flush()
+        except OSError: # The directory was removed; the next scrape just misses this process
+            pass
+
+    def samples(self):
+        """Totals of every process sharing METRICS_DIR (only this one without it)."""
+        totals = self.local_samples()
+        if self.directory:
+            own_file = self._own_file()
+            for path in glob.glob(os.path.join(self.directory, '*.json')):
+                if path == own_file:
+                    continue
+                try:
+                    with open(path, encoding='utf-8') as source:
+                        rows = json.load(source)
+                except (OSError, ValueError):
+                    continue # Removed or replaced while we read it
+                _add(totals, {(name, tuple(labels), bucket): value for name, labels, bucket, value in rows})
+        return totals
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        by_metric = {}
+        for (name, labels, bucket), value in self.samples().items():
+            by_metric.setdefault(name, {}).setdefault(labels, {})[bucket] = value
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            lines.append(f'# HELP {name} {metric.help}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            for labels, values in sorted(by_metric.get(name, {}).items()):
+                if metric.kind == 'counter':
+                    lines.append(f'{name}{_labels(metric.labels, labels)} {_number(values[None])}')
+                    continue
+                cumulative = 0
+                for index, bound in enumerate(metric.buckets + (float('inf'),)):
+                    cumulative += values.get(index, 0)
+                    le = '+Inf' if index == len(metric.buckets) else _number(float(bound))
+                    lines.append(f'{name}_bucket{_labels(metric.labels, labels, [("le", le)])} {cumulative}')
+                lines.append(f'{name}_sum{_labels(metric.labels, labels)} {_number(values.get("sum", 0.0))}')
+                lines.append(f'{name}_count{_labels(metric.labels, labels)} {cumulative}')
+        for name, help, label_names, func in self._gauges:
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} gauge')
+            for labels, value in func():
+                lines.append(f'{name}{_labels(label_names, labels)} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+def _add(totals, samples):
+    for key, value in samples.items():
+        totals[key] = totals.get(key, 0) + value
+
+registry = Registry()
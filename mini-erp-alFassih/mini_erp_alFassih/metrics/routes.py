@@ -0,0 +1,14 @@
+import hmac
+
+from flask import current_app, request, abort
+
+from . import metrics_bp
+from .registry import registry
+
+@metrics_bp.route('/metrics')
+def metrics():
+    """Prometheus text format. With METRICS_TOKEN set, scrapers must send it as a bearer token."""
+    token = current_app.config.get('METRICS_TOKEN')
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        abort(401)
+    return current_app.response_class(registry.render(), mimetype='text/plain; version=0.0.4')
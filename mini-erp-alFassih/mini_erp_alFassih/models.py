@@ -1,8 +1,13 @@
 from . import db
+import secrets
 from datetime import datetime
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 
+def dialect_index(dialect, name, *expressions, **kwargs):
+    """An index created only on one database backend (create_all and the migrations both skip it elsewhere)."""
+    return db.Index(name, *expressions, info={'dialect': dialect}, **kwargs).ddl_if(dialect=dialect)
+
 class User(UserMixin, db.Model): # Inherit from UserMixin
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), index=True, unique=True, nullable=False)
@@ -29,22 +34,42 @@ class Patient(db.Model):
     date_of_birth = db.Column(db.Date, nullable=True)
     contact_info = db.Column(db.Text, nullable=True)
     anamnesis = db.Column(db.Text, nullable=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    match_key = db.Column(db.String(255), nullable=True, index=True) # Normalized name + birth date, see matching.py
+    # Denormalized activity summary, kept current by summaries.py on Session/Document writes
+    last_session_at = db.Column(db.DateTime, nullable=True, index=True) # Latest 'Completed' session start
+    next_session_at = db.Column(db.DateTime, nullable=True, index=True) # Earliest upcoming 'Scheduled' session start
+    session_count = db.Column(db.Integer, default=0, server_default='0', nullable=False, index=True)
+    document_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
     documents = db.relationship('Document', backref='patient', lazy=True, cascade="all, delete-orphan")
     sessions = db.relationship('Session', backref='assigned_patient', lazy='dynamic', cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # PostgreSQL only: serves match key prefix lookups (LIKE 'key%'), which the default-collation index cannot
+        dialect_index('postgresql', 'ix_patient_match_key_prefix', 'match_key',
+                      postgresql_ops={'match_key': 'text_pattern_ops'}),
+        # PostgreSQL only: full-text index over the name words of match_key, for the patient search
+        # (matching.search_criteria uses the same expression). SQLite scans the match_key column instead.
+        dialect_index('postgresql', 'ix_patient_match_key_search',
+                      db.func.to_tsvector(db.literal_column("'simple'"), db.func.replace(match_key, '|', ' ')),
+                      postgresql_using='gin'),
+    )
+
     def __repr__(self):
         return f'<Patient {self.id}: {self.first_name} {self.last_name}>'
 
 class Document(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False, index=True)
+    # active_history loads the old patient before an expired row is moved, so the summary flush hook
+    # can refresh the patient it left
+    patient_id = db.column_property(db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False, index=True),
+                                    active_history=True)
     document_type = db.Column(db.String(100), nullable=True) # Or False if always required
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text, nullable=True)
     filename = db.Column(db.String(255), nullable=False)
-    uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
+    uploaded_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
     def __repr__(self):
         return f'<Document {self.title}>'
@@ -55,21 +80,88 @@ class Therapist(db.Model):
     first_name = db.Column(db.String(100), nullable=False)
     last_name = db.Column(db.String(100), nullable=False, index=True)
     specialization = db.Column(db.String(150), nullable=True)
+    calendar_token = db.Column(db.String(64), nullable=True, unique=True, index=True) # Secret in the .ics feed URL
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow) # Activity report validator
     sessions = db.relationship('Session', backref='assigned_therapist', lazy='dynamic', cascade="all, delete-orphan")
     user = db.relationship('User', backref=db.backref('therapist_profile', uselist=False))
 
+    def regenerate_calendar_token(self):
+        """Issues a new feed token; the previous feed URL stops working."""
+        self.calendar_token = secrets.token_urlsafe(32)
+        return self.calendar_token
+
     def __repr__(self):
         return f'<Therapist {self.first_name} {self.last_name}>'
 
 class Session(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False, index=True)
+    # active_history for the summary flush hook, as on Document.patient_id
+    patient_id = db.column_property(db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False, index=True),
+                                    active_history=True)
     therapist_id = db.Column(db.Integer, db.ForeignKey('therapist.id'), nullable=False, index=True)
-    start_time = db.Column(db.DateTime, nullable=False, index=True)
+    # active_history loads the old value before an expired session is moved, so the rollup flush
+    # hook can see which hour it left
+    start_time = db.column_property(db.Column(db.DateTime, nullable=False, index=True), active_history=True)
     end_time = db.Column(db.DateTime, nullable=False)
     session_type = db.Column(db.String(150), nullable=True)
     status = db.Column(db.String(50), default='Scheduled', nullable=False, index=True) # E.g., 'Scheduled', 'Completed', 'Cancelled', 'No Show'
     notes = db.Column(db.Text, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True) # Calendar feeds, rollups
+
+    # Composite indexes backing the filtered, start_time-ordered sessions list
+    __table_args__ = (
+        db.Index('ix_session_therapist_id_start_time', 'therapist_id', 'start_time'),
+        db.Index('ix_session_patient_id_start_time', 'patient_id', 'start_time'),
+        db.Index('ix_session_status_start_time', 'status', 'start_time'),
+        # PostgreSQL only: upcoming-session lookups (reminders, conflict checks) read a much smaller index
+        dialect_index('postgresql', 'ix_session_scheduled_start_time', 'start_time',
+                      postgresql_where=db.text("status = 'Scheduled'")),
+    )
 
     def __repr__(self):
         return f'<Session {self.id} Patient {self.patient_id} Therapist {self.therapist_id} on {self.start_time.strftime("%Y-%m-%d %H:%M")}>'
+
+# Pre-aggregated reporting tables, maintained by rollups.py. Each grain ('hour', 'day', 'month')
+# has one row per bucket start and dimension combination.
+class SessionRollup(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    grain = db.Column(db.String(10), nullable=False)
+    bucket = db.Column(db.DateTime, nullable=False)
+    therapist_id = db.Column(db.Integer, nullable=False) # No foreign key: history outlives deleted therapists
+    status = db.Column(db.String(50), nullable=False)
+    session_type = db.Column(db.String(150), nullable=False, default='') # '' for sessions without a type
+    session_count = db.Column(db.Integer, nullable=False, default=0)
+    booked_minutes = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('grain', 'bucket', 'therapist_id', 'status', 'session_type', name='uq_session_rollup_key'),
+    )
+
+    def __repr__(self):
+        return f'<SessionRollup {self.grain} {self.bucket} therapist {self.therapist_id} {self.status}: {self.session_count}>'
+
+class ActivityRollup(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    grain = db.Column(db.String(10), nullable=False)
+    bucket = db.Column(db.DateTime, nullable=False)
+    new_patients = db.Column(db.Integer, nullable=False, default=0)
+    documents_uploaded = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('grain', 'bucket', name='uq_activity_rollup_key'),
+    )
+
+    def __repr__(self):
+        return f'<ActivityRollup {self.grain} {self.bucket}>'
+
+class RollupState(db.Model):
+    """High-water mark of the rollup job: source rows changed up to this time are aggregated."""
+    name = db.Column(db.String(50), primary_key=True)
+    high_water = db.Column(db.DateTime, nullable=True)
+
+class RollupStaleHour(db.Model):
+    """Hour buckets that lost rows (deletes, moved sessions), which the high-water mark cannot see.
+    Duplicates are harmless; the rollup job reads them distinct and clears what it processed.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    bucket = db.Column(db.DateTime, nullable=False)
@@ -1,5 +1,7 @@
 from flask import Blueprint
+from flask.cli import AppGroup
 
 patients_bp = Blueprint('patients', __name__, template_folder='templates')
+patients_cli = AppGroup('patients', help='Bulk patient maintenance.')
 
-from . import routes
+from . import routes, commands
@@ -0,0 +1,69 @@
+import os
+
+import click
+from flask import current_app
+
+from . import patients_cli
+from .importer import import_patients
+from .dedup import find_duplicates, merge_patients
+from .. import db
+from ..models import Patient
+from ..spreadsheets import open_table
+
+@patients_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--dry-run', is_flag=True, help='Validate and check for duplicates without importing anything.')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows validated and inserted per batch.')
+def import_command(path, dry_run, batch_size):
+    """Imports patients from a CSV or XLSX file with a header row."""
+    with open(path, 'rb') as stream:
+        try:
+            headers, rows = open_table(stream, os.path.basename(path))
+            result = import_patients(headers, rows, dry_run=dry_run, batch_size=batch_size)
+        except ValueError as e:
+            db.session.rollback()
+            raise click.ClickException(str(e))
+    db.session.commit()
+
+    for error in result['errors']:
+        click.echo(f"Row {error['row']}: " + '; '.join(f'{field}: {message}' for field, message in error['errors'].items()))
+    for duplicate in result['duplicates']:
+        original = (f"patient {duplicate['patient_id']}" if 'patient_id' in duplicate
+                    else f"row {duplicate['same_as_row']}")
+        click.echo(f"Row {duplicate['row']}: duplicate of {original}")
+    verb = 'Would import' if dry_run else 'Imported'
+    click.echo(f"{verb} {result['imported']} of {result['rows']} rows; "
+               f"{len(result['duplicates'])} duplicates, {len(result['errors'])} invalid.")
+
+@patients_cli.command('duplicates')
+@click.option('--min-score', type=float, default=None, help='Lowest score reported (default: DEDUP_MIN_SCORE).')
+@click.option('--limit', default=50, show_default=True, help='Pairs listed; 0 lists all of them.')
+def duplicates_command(min_score, limit):
+    """Lists pairs of patients that are probably the same person."""
+    config = current_app.config
+    result = find_duplicates(min_score=config.get('DEDUP_MIN_SCORE', 0.85) if min_score is None else min_score,
+                             max_block=config.get('DEDUP_MAX_BLOCK', 500))
+    pairs = result['pairs'][:limit] if limit else result['pairs']
+    names = dict(db.session.execute(
+        db.select(Patient.id, Patient.first_name + ' ' + Patient.last_name)
+        .where(Patient.id.in_({patient_id for pair in pairs for patient_id in pair['patient_ids']}))
+    ).all())
+    for pair in pairs:
+        first, second = pair['patient_ids']
+        click.echo(f"{pair['score']:.2f}  #{first} {names[first]}  ~  #{second} {names[second]}")
+    click.echo(f"{len(result['pairs'])} candidate pairs among {result['patients']} patients"
+               + (f"; {result['skipped_blocks']} oversized name buckets skipped." if result['skipped_blocks'] else '.'))
+
+@patients_cli.command('merge')
+@click.argument('keep_id', type=int)
+@click.argument('duplicate_id', type=int)
+def merge_command(keep_id, duplicate_id):
+    """Merges patient DUPLICATE_ID into KEEP_ID and deletes DUPLICATE_ID."""
+    try:
+        result = merge_patients(keep_id, duplicate_id)
+    except ValueError as e:
+        db.session.rollback()
+        raise click.ClickException(str(e))
+    db.session.commit()
+    click.echo(f"Merged patient #{duplicate_id} into #{keep_id}: "
+               f"{result['sessions']} sessions and {result['documents']} documents moved.")
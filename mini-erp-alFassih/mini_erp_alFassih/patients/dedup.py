@@ -0,0 +1,152 @@
+"""
+Finding and merging duplicate patient records.
+
+Comparing every patient with every other one does not scale, so detection
+works in two passes:
+
+1. Blocking: each patient is put into a few buckets keyed on normalized names
+   (matching.normalize_name): last name + date of birth, first name + date of
+   birth, and the sorted name words alone. Only patients sharing a bucket are
+   compared, which catches a typo in either name, swapped first/last names and
+   a missing birth date. Buckets above max_block patients (very common names
+   without a birth date) are skipped and counted instead of compared.
+2. Scoring: each candidate pair gets a 0..1 score, mostly from name similarity
+   (difflib ratio, the better of straight and swapped name order) and partly
+   from the birth dates. Pairs at or above min_score are reported.
+
+merge_patients moves every session and document of the duplicate to the kept
+patient with one UPDATE per table, fills the kept patient's empty fields from
+the duplicate and deletes it. The caller owns the transaction and commits once.
+"""
+
+from collections import defaultdict
+from datetime import datetime
+from difflib import SequenceMatcher
+
+from .. import db
+from ..matching import normalize_name
+from ..models import Patient, Document, Session
+from ..signals import note_session_changes
+from ..summaries import refresh_patient_summaries, SUMMARY_COLUMNS
+
+NAME_WEIGHT = 0.7 # The rest of the score comes from the birth dates
+
+def blocking_keys(first, last, date_of_birth):
+    """Buckets a patient with normalized first and last names falls into."""
+    keys = ['n|' + ' '.join(sorted(f'{first} {last}'.split()))]
+    if date_of_birth:
+        keys.append(f'l|{last}|{date_of_birth}')
+        keys.append(f'f|{first}|{date_of_birth}')
+    return keys
+
+def _similarity(a, b):
+    if a == b:
+        return 1.0
+    if not a or not b:
+        return 0.0
+    return SequenceMatcher(None, a, b, autojunk=False).ratio()
+
+def _date_score(a, b):
+    if a is None or b is None:
+        return 0.5 # Unknown: neither confirms nor rules out the match
+    if a == b:
+        return 1.0
+    if (a.year, a.month, a.day) == (b.year, b.day, b.month):
+        return 0.5 # Day and month swapped
+    # One part mistyped
+    return 0.5 if sum(x == y for x, y in zip((a.year, a.month, a.day), (b.year, b.month, b.day))) == 2 else 0.0
+
+def match_score(a, b):
+    """Scores two (first, last, date_of_birth) tuples of normalized names."""
+    straight = (_similarity(a[0], b[0]) + _similarity(a[1], b[1])) / 2
+    name = straight
+    if straight < 1.0:
+        name = max(straight, (_similarity(a[0], b[1]) + _similarity(a[1], b[0])) / 2)
+    return round(NAME_WEIGHT * name + (1 - NAME_WEIGHT) * _date_score(a[2], b[2]), 4)
+
+def find_duplicates(min_score=0.85, max_block=500, batch_size=2000):
+    """Returns candidate pairs, best first, as {'patient_ids': (older, newer), 'score'},
+    plus the number of oversized buckets skipped.
+    """
+    people = {}
+    blocks = defaultdict(list)
+    rows = db.session.execute(
+        db.select(Patient.id, Patient.first_name, Patient.last_name, Patient.date_of_birth)
+        .order_by(Patient.id)
+        .execution_options(yield_per=batch_size)
+    )
+    for row in rows:
+        person = (normalize_name(row.first_name), normalize_name(row.last_name), row.date_of_birth)
+        people[row.id] = person
+        for key in blocking_keys(*person):
+            blocks[key].append(row.id)
+
+    pairs, seen, skipped_blocks = [], set(), 0
+    for ids in blocks.values():
+        if len(ids) < 2:
+            continue
+        if len(ids) > max_block:
+            skipped_blocks += 1
+            continue
+        for i, first_id in enumerate(ids):
+            for second_id in ids[i + 1:]:
+                if (first_id, second_id) in seen:
+                    continue
+                seen.add((first_id, second_id))
+                score = match_score(people[first_id], people[second_id])
+                if score >= min_score:
+                    pairs.append({'patient_ids': (first_id, second_id), 'score': score})
+    pairs.sort(key=lambda pair: (-pair['score'], pair['patient_ids']))
+    return {'patients': len(people), 'pairs': pairs, 'skipped_blocks': skipped_blocks}
+
+def _merged_text(kept, duplicate, duplicate_id):
+    if not duplicate or duplicate.strip() == (kept or '').strip():
+        return kept
+    if not kept:
+        return duplicate
+    return f'{kept}\n\n[Merged from patient #{duplicate_id}]\n{duplicate}'
+
+def merge_patients(keep_id, duplicate_id, now=None):
+    """Moves the duplicate's sessions and documents to the kept patient and deletes the duplicate."""
+    if keep_id == duplicate_id:
+        raise ValueError('A patient cannot be merged into itself.')
+    keep = db.session.get(Patient, keep_id)
+    duplicate = db.session.get(Patient, duplicate_id)
+    if keep is None or duplicate is None:
+        raise ValueError('Both patients must exist.')
+    now = now or datetime.utcnow()
+
+    moved = db.session.execute(
+        db.select(Session.id, Session.therapist_id, Session.start_time, Session.status)
+        .where(Session.patient_id == duplicate_id)
+    ).all()
+    if moved:
+        db.session.execute(
+            db.update(Session).where(Session.patient_id == duplicate_id).values(patient_id=keep_id, updated_at=now),
+            execution_options={'synchronize_session': 'fetch'}
+        )
+    documents = db.session.execute(
+        db.update(Document).where(Document.patient_id == duplicate_id).values(patient_id=keep_id),
+        execution_options={'synchronize_session': 'fetch'}
+    ).rowcount
+
+    if keep.date_of_birth is None:
+        keep.date_of_birth = duplicate.date_of_birth
+    keep.contact_info = _merged_text(keep.contact_info, duplicate.contact_info, duplicate_id)
+    keep.anamnesis = _merged_text(keep.anamnesis, duplicate.anamnesis, duplicate_id)
+
+    # The duplicate owns nothing any more; expiring its collection keeps the delete cascade from
+    # acting on documents loaded before the UPDATE above
+    db.session.expire(duplicate, ['documents'])
+    db.session.delete(duplicate)
+    db.session.flush()
+
+    # Set-based UPDATEs bypass the flush hooks, so refresh the summary and queue change signals here
+    refresh_patient_summaries(db.session.connection(), {keep_id})
+    db.session.expire(keep, SUMMARY_COLUMNS)
+    note_session_changes(db.session, [
+        {'id': row.id, 'kind': 'updated', 'patient_id': keep_id, 'therapist_id': row.therapist_id,
+         'start_time': row.start_time, 'status': row.status}
+        for row in moved
+    ])
+    return {'kept': keep_id, 'merged': duplicate_id, 'sessions': len(moved), 'documents': documents}
@@ -1,6 +1,6 @@
 from flask_wtf import FlaskForm
 from flask_wtf.file import FileField, FileRequired, FileAllowed
-from wtforms import StringField, DateField, TextAreaField, SubmitField
+from wtforms import StringField, DateField, TextAreaField, BooleanField, SubmitField, HiddenField
 from wtforms.validators import DataRequired, Optional
 
 class PatientForm(FlaskForm):
@@ -20,3 +20,16 @@ class DocumentForm(FlaskForm):
         FileAllowed(['jpg', 'jpeg', 'png', 'pdf', 'doc', 'docx', 'txt'], 'Allowed file types: Images, PDF, DOC, TXT')
     ])
     submit = SubmitField('Upload Document')
+
+class PatientImportForm(FlaskForm):
+    file = FileField('Patient List (CSV or XLSX)', validators=[
+        FileRequired(),
+        FileAllowed(['csv', 'xlsx'], 'Allowed file types: CSV, XLSX')
+    ])
+    dry_run = BooleanField('Check only (import nothing)')
+    submit = SubmitField('Import Patients')
+
+class MergePatientsForm(FlaskForm):
+    keep_id = HiddenField(validators=[DataRequired()])
+    duplicate_id = HiddenField(validators=[DataRequired()])
+    submit = SubmitField('Merge')
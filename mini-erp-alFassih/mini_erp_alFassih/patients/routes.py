@@ -1,18 +1,59 @@
 from flask import render_template, request, redirect, url_for, current_app, send_from_directory, flash
 from flask_login import login_required
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from . import patients_bp
-from .forms import PatientForm, DocumentForm
+from .forms import PatientForm, DocumentForm, PatientImportForm, MergePatientsForm
+from .importer import import_patients
+from .dedup import find_duplicates, merge_patients
 from ..models import Patient, Document, Session # Use .. for parent package
 from .. import db # Use .. for parent package
 from ..utils import save_document # Use .. for parent package
+from ..spreadsheets import open_table
+from ..matching import search_criteria
+from ..decorators import admin_required
+from ..replicas import read_replica
+from ..querystats import query_budget
 
 @patients_bp.route('/') # Corresponds to /patients/ due to url_prefix in __init__.py blueprint registration
 @login_required
+@read_replica
+@query_budget(4)
 def list_patients():
-    patients = Patient.query.all()
-    return render_template('patients/patients.html', patients=patients, title='Patients', year=datetime.now().year)
+    # Sorting and filtering use the denormalized summary columns (see summaries.py), which are indexed
+    sort_orders = {
+        'name': (Patient.last_name.asc(), Patient.first_name.asc()),
+        'last_session': (Patient.last_session_at.desc().nulls_last(), Patient.id.desc()),
+        'next_session': (Patient.next_session_at.asc().nulls_last(), Patient.id.asc()),
+        'sessions': (Patient.session_count.desc(), Patient.id.desc()),
+    }
+    sort = request.args.get('sort', 'name')
+    if sort not in sort_orders:
+        sort = 'name'
+    activity = request.args.get('activity', '')
+
+    query = Patient.query
+    now = datetime.utcnow()
+    # A next_session_at in the past counts as none; the summaries.refresh_lapsed job catches up with it
+    if activity == 'upcoming':
+        query = query.filter(Patient.next_session_at >= now)
+    elif activity == 'inactive':
+        cutoff = now - timedelta(days=current_app.config.get('PATIENT_INACTIVE_DAYS', 90))
+        query = query.filter(db.or_(Patient.last_session_at < cutoff, Patient.last_session_at.is_(None)),
+                             db.or_(Patient.next_session_at < now, Patient.next_session_at.is_(None)))
+    elif activity == 'no_sessions':
+        query = query.filter(Patient.session_count == 0)
+    else:
+        activity = ''
+    # Matches the start of name words, ignoring case, accents and spelling variants (see matching.py)
+    search = request.args.get('q', '').strip()
+    criteria = search_criteria(search)
+    if criteria:
+        query = query.filter(*criteria)
+
+    patients = query.order_by(*sort_orders[sort]).all()
+    return render_template('patients/patients.html', patients=patients, sort=sort, activity=activity,
+                           search=search, title='Patients', year=datetime.now().year)
 
 @patients_bp.route('/new', methods=['GET', 'POST']) # Corresponds to /patients/new
 @login_required
@@ -32,12 +73,108 @@ def create_patient():
         return redirect(url_for('patients.list_patients'))
     return render_template('patients/patient_form.html', form=form, title='Create Patient', year=datetime.now().year)
 
+@patients_bp.route('/import', methods=['GET', 'POST']) # Corresponds to /patients/import
+@login_required
+def import_patients_view():
+    form = PatientImportForm()
+    result = None
+    if form.validate_on_submit():
+        upload = form.file.data
+        try:
+            headers, rows = open_table(upload.stream, upload.filename)
+            result = import_patients(headers, rows, dry_run=form.dry_run.data,
+                                     batch_size=current_app.config.get('PATIENT_IMPORT_BATCH_SIZE', 1000))
+        except ValueError as e:
+            db.session.rollback()
+            flash(f'The file could not be imported: {e}', 'danger')
+        else:
+            db.session.commit()
+            if not result['dry_run']:
+                flash(f"Imported {result['imported']} patients.", 'success')
+    return render_template('patients/patient_import.html', form=form, result=result,
+                           max_listed=current_app.config.get('IMPORT_MAX_LISTED', 200),
+                           title='Import Patients', year=datetime.now().year)
+
+@patients_bp.route('/duplicates') # Corresponds to /patients/duplicates
+@login_required
+@admin_required
+@read_replica
+def duplicate_patients():
+    config = current_app.config
+    result = find_duplicates(min_score=config.get('DEDUP_MIN_SCORE', 0.85),
+                             max_block=config.get('DEDUP_MAX_BLOCK', 500))
+    pairs = result['pairs'][:config.get('DEDUP_MAX_LISTED', 100)]
+    # The listed pairs are rendered from one query instead of a lookup per patient
+    ids = {patient_id for pair in pairs for patient_id in pair['patient_ids']}
+    patients = {patient.id: patient for patient in Patient.query.filter(Patient.id.in_(ids))} if ids else {}
+    return render_template('patients/patient_duplicates.html', result=result, pairs=pairs, patients=patients,
+                           form=MergePatientsForm(), title='Duplicate Patients', year=datetime.now().year)
+
+@patients_bp.route('/merge', methods=['POST']) # Corresponds to /patients/merge
+@login_required
+@admin_required
+def merge_patients_view():
+    form = MergePatientsForm()
+    if not form.validate_on_submit():
+        flash('Invalid merge request.', 'danger')
+        return redirect(url_for('patients.duplicate_patients'))
+    try:
+        result = merge_patients(int(form.keep_id.data), int(form.duplicate_id.data))
+    except ValueError as e:
+        db.session.rollback()
+        flash(f'The patients could not be merged: {e}', 'danger')
+        return redirect(url_for('patients.duplicate_patients'))
+    db.session.commit()
+    flash(f"Merged patient #{result['merged']} into #{result['kept']}: "
+          f"{result['sessions']} sessions and {result['documents']} documents moved.", 'success')
+    return redirect(url_for('patients.view_patient', patient_id=result['kept']))
+
+def _patient_sessions_page(patient_id, page):
+    """Returns one page of a patient's sessions (newest first) and whether older ones exist.
+    The therapist is joined in the same query so the rows render without extra lookups.
+    """
+    per_page = current_app.config.get('PATIENT_SESSIONS_PER_PAGE', 20)
+    rows = Session.query.filter(Session.patient_id == patient_id).options(
+        db.joinedload(Session.assigned_therapist)
+    ).order_by(Session.start_time.desc(), Session.id.desc()) \
+     .offset((page - 1) * per_page).limit(per_page + 1).all() # One extra row tells us if there is more
+    return rows[:per_page], len(rows) > per_page
+
+def _patient_session_counts(patient_id):
+    """Counts a patient's sessions per status with a single grouped query."""
+    counts = dict(
+        db.session.query(Session.status, db.func.count(Session.id))
+        .filter(Session.patient_id == patient_id)
+        .group_by(Session.status)
+        .all()
+    )
+    counts['total'] = sum(counts.values())
+    return counts
+
 @patients_bp.route('/<int:patient_id>') # Corresponds to /patients/<id>
 @login_required
+@query_budget(7)
 def view_patient(patient_id):
+    # Documents are fetched with a second SELECT ... IN query instead of a lazy load from the template
+    patient = Patient.query.options(db.selectinload(Patient.documents)).get_or_404(patient_id)
+    page = max(request.args.get('sessions_page', 1, type=int), 1) # Plain paging when "load more" runs without JS
+    patient_sessions, has_more_sessions = _patient_sessions_page(patient.id, page=page)
+    session_counts = _patient_session_counts(patient.id)
+    return render_template('patients/patient_detail.html', patient=patient, patient_sessions=patient_sessions,
+                           has_more_sessions=has_more_sessions, next_sessions_page=page + 1, session_counts=session_counts,
+                           title='Patient Details', year=datetime.now().year)
+
+@patients_bp.route('/<int:patient_id>/sessions') # Corresponds to /patients/<id>/sessions?page=N ("load more")
+@login_required
+@query_budget(4)
+def patient_sessions(patient_id):
     patient = Patient.query.get_or_404(patient_id)
-    patient_sessions = patient.sessions.order_by(Session.start_time.desc()).all()
-    return render_template('patients/patient_detail.html', patient=patient, patient_sessions=patient_sessions, title='Patient Details', year=datetime.now().year)
+    page = max(request.args.get('page', 2, type=int), 1)
+    patient_sessions, has_more_sessions = _patient_sessions_page(patient.id, page=page)
+    headers = {}
+    if has_more_sessions: # Tells the "load more" button where the following page lives
+        headers['X-Next-Page'] = url_for('patients.patient_sessions', patient_id=patient.id, page=page + 1)
+    return render_template('patients/_session_rows.html', patient_sessions=patient_sessions), 200, headers
 
 @patients_bp.route('/<int:patient_id>/edit', methods=['GET', 'POST']) # Corresponds to /patients/<id>/edit
 @login_required
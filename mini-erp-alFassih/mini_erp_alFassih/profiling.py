@@ -0,0 +1,219 @@
+"""
+Opt-in profiling of individual requests.
+
+ProfilerMiddleware wraps the WSGI app. A request is profiled when it carries an
+"X-Profile: <PROFILER_TOKEN>" header, or when it is picked at random at
+PROFILER_SAMPLE_RATE; every other request goes straight through after two
+config lookups, so the middleware can stay installed in production.
+
+Two ways of profiling (PROFILER_MODE, or "X-Profile-Mode" on a token request):
+
+- 'sample': a separate thread records the request thread's stack every
+  PROFILER_INTERVAL_MS. The request runs at nearly full speed and the result
+  is a set of collapsed stacks ("module:func;module:func 12") drawn as a flame
+  graph under /admin/profiles, or downloaded for flamegraph.pl or speedscope.
+- 'cprofile': cProfile traces every call. Exact call counts, but the request
+  runs several times slower; the stats can be downloaded for pstats/snakeviz.
+  Only one request is traced at a time; others fall back to sampling.
+
+Profiles cover the whole WSGI call including streamed response bodies, and are
+kept as JSON in PROFILER_DIR (default instance/profiles), newest PROFILER_KEEP
+only. They hold function names, timings and the request path, never
+parameters, bodies or headers.
+"""
+
+import cProfile
+import hmac
+import io
+import json
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from werkzeug.wsgi import ClosingIterator
+
+PROFILE_ID = re.compile(r'^\d{8}T\d{6}-[0-9a-f]{8}$')
+MODES = ('sample', 'cprofile')
+_cprofile_lock = threading.Lock() # The interpreter supports one cProfile at a time
+
+def _frame_name(frame):
+    code = frame.f_code
+    name = f"{frame.f_globals.get('__name__', '?')}:{getattr(code, 'co_qualname', code.co_name)}"
+    return name.replace(';', ':')
+
+def collapse(frame, root=None):
+    """The stack ending at frame as 'outer;...;inner', leaving out root and the frames above it."""
+    names = []
+    while frame is not None and frame is not root:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+class StackSampler(threading.Thread):
+    def __init__(self, thread_id, interval, root):
+        super().__init__(name='request-profiler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.root = root
+        self.stacks = Counter()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[collapse(frame, self.root)] += 1
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        self.root = None
+        return self.stacks
+
+def flame_tree(stacks, min_share=0.005):
+    """Nests collapsed stacks into {'name', 'value', 'children'} nodes, dropping those below min_share of the total.
+    Each node's 'share' is its percentage of all samples and 'width' its percentage of its parent's."""
+    root = {'name': 'all', 'value': 0, 'children': {}}
+    for stack, count in stacks.items():
+        root['value'] += count
+        node = root
+        for name in stack.split(';') if stack else ():
+            node = node['children'].setdefault(name, {'name': name, 'value': 0, 'children': {}})
+            node['value'] += count
+    smallest = root['value'] * min_share
+
+    def finish(node, parent_value):
+        node['share'] = 100 * node['value'] / (root['value'] or 1)
+        node['width'] = 100 * node['value'] / (parent_value or 1)
+        children = sorted((c for c in node['children'].values() if c['value'] >= smallest), key=lambda c: -c['value'])
+        node['children'] = [finish(child, node['value']) for child in children]
+        return node
+    return finish(root, root['value'])
+
+class _Profile:
+    def __init__(self, environ, mode, interval, root):
+        self.environ = environ
+        self.status = None
+        self.started = time.perf_counter()
+        self.profiler = None
+        if mode == 'cprofile' and _cprofile_lock.acquire(blocking=False):
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        else:
+            self.sampler = StackSampler(threading.get_ident(), interval, root)
+            self.sampler.start()
+
+    def start_response(self, start_response):
+        def recording_start_response(status, headers, exc_info=None):
+            self.status = int(status.split(' ', 1)[0])
+            return start_response(status, headers, exc_info)
+        return recording_start_response
+
+    def finish(self):
+        """Stops profiling; returns the profile record and, for cProfile, its Stats."""
+        duration_ms = round((time.perf_counter() - self.started) * 1000, 1)
+        record = {
+            'method': self.environ.get('REQUEST_METHOD'),
+            'path': self.environ.get('PATH_INFO'),
+            'status': self.status or 500,
+            'duration_ms': duration_ms,
+        }
+        if self.profiler is not None:
+            self.profiler.disable()
+            _cprofile_lock.release()
+            summary = io.StringIO()
+            stats = pstats.Stats(self.profiler, stream=summary)
+            stats.sort_stats('cumulative').print_stats(40)
+            record.update(mode='cprofile', calls=stats.total_calls, summary=summary.getvalue())
+            return record, stats
+        stacks = self.sampler.stop()
+        record.update(mode='sample', interval_ms=round(self.sampler.interval * 1000, 3),
+                      samples=sum(stacks.values()), stacks=dict(stacks))
+        return record, None
+
+class ProfilerMiddleware:
+    def __init__(self, wsgi_app, flask_app):
+        self.wsgi_app = wsgi_app
+        self.flask_app = flask_app
+
+    def _mode(self, environ):
+        config = self.flask_app.config
+        token = config.get('PROFILER_TOKEN')
+        if token and hmac.compare_digest(environ.get('HTTP_X_PROFILE', '').encode(), token.encode()):
+            requested = environ.get('HTTP_X_PROFILE_MODE')
+            return requested if requested in MODES else config.get('PROFILER_MODE', 'sample')
+        rate = config.get('PROFILER_SAMPLE_RATE')
+        if rate and random.random() < rate:
+            return config.get('PROFILER_MODE', 'sample')
+        return None
+
+    def __call__(self, environ, start_response):
+        mode = self._mode(environ)
+        if mode is None:
+            return self.wsgi_app(environ, start_response)
+        profile = _Profile(environ, mode, self.flask_app.config.get('PROFILER_INTERVAL_MS', 5) / 1000,
+                           sys._getframe())
+        try:
+            app_iter = self.wsgi_app(environ, profile.start_response(start_response))
+        except BaseException:
+            self._save(*profile.finish())
+            raise
+        return ClosingIterator(app_iter, [lambda: self._save(*profile.finish())])
+
+    @property
+    def directory(self):
+        return self.flask_app.config.get('PROFILER_DIR') or os.path.join(self.flask_app.instance_path, 'profiles')
+
+    def _save(self, record, stats):
+        record['id'] = f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}-{uuid.uuid4().hex[:8]}"
+        record['created'] = time.time()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            if stats is not None:
+                stats.dump_stats(self.path(record['id'], '.prof'))
+            with open(self.path(record['id']), 'w', encoding='utf-8') as output:
+                json.dump(record, output)
+        except OSError as error: # The profiled response has been sent already; don't fail it now
+            self.flask_app.logger.warning(f'Could not store request profile: {error}')
+            return
+        self.flask_app.logger.info(f"Profiled {record['method']} {record['path']} as {record['id']}")
+        for old in self.profile_ids()[self.flask_app.config.get('PROFILER_KEEP', 200):]:
+            for suffix in ('.json', '.prof'):
+                try:
+                    os.remove(self.path(old, suffix))
+                except FileNotFoundError:
+                    pass
+
+    def path(self, profile_id, suffix='.json'):
+        if not PROFILE_ID.match(profile_id):
+            raise ValueError(f'Not a profile id: {profile_id!r}')
+        return os.path.join(self.directory, profile_id + suffix)
+
+    def profile_ids(self):
+        """Stored profiles, newest first."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted((name[:-5] for name in names if name.endswith('.json') and PROFILE_ID.match(name[:-5])),
+                      reverse=True)
+
+    def load(self, profile_id):
+        """The stored record, or None if there is no such profile."""
+        try:
+            with open(self.path(profile_id), encoding='utf-8') as source:
+                return json.load(source)
+        except (ValueError, OSError):
+            return None
+
+def init_profiler(app):
+    """Wraps app.wsgi_app once; the PROFILER_* settings are read per request."""
+    if 'profiler' not in app.extensions:
+        app.wsgi_app = app.extensions['profiler'] = ProfilerMiddleware(app.wsgi_app, app)
+    return app.extensions['profiler']
@@ -0,0 +1,168 @@
+"""
+Per-request SQL instrumentation.
+
+Every statement a request sends to any engine (primary or replica) is counted
+and timed from SQLAlchemy's before/after_cursor_execute events. At the end of
+the request:
+
+- a Server-Timing header ("db;dur=12.4;desc=\"7 queries\"") shows the count and
+  total database time in the browser's network panel;
+- the same statement text run QUERY_REPEAT_THRESHOLD or more times is logged
+  as an N+1 suspect (typically a lazy load such as patient.documents inside a
+  template loop);
+- the totals are added to per-endpoint figures, see QueryInstrumentation.snapshot().
+
+Statements over SLOW_QUERY_THRESHOLD_MS also go to the slow query log (slowqueries.py).
+
+Views can declare a budget with @query_budget(n). Going over it logs a warning,
+and under TESTING raises QueryBudgetExceeded, which fails the test that made
+the request. Tests can also count directly with count_queries().
+
+The header and the budget cover the queries made before the response is
+returned; rows fetched while a streamed response is sent only reach the log
+and the per-endpoint figures.
+"""
+
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .slowqueries import slow_queries
+from .metrics import db_queries, db_seconds
+
+class QueryBudgetExceeded(AssertionError):
+    """A view with @query_budget issued more queries than it declared."""
+
+class QueryStats:
+    """Counts and timings of the statements run while it is active."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = Counter() # statement text -> executions
+
+    def record(self, statement, seconds):
+        self.count += 1
+        self.seconds += seconds
+        self.statements[statement] += 1
+
+    def repeated(self, threshold):
+        """(statement, executions) run at least threshold times, most frequent first."""
+        return [(statement, n) for statement, n in self.statements.most_common() if n >= threshold]
+
+def _active_stats():
+    # Statements outside a request (CLI, job workers) are only counted inside count_queries()
+    if not has_app_context():
+        return []
+    active = list(g.get('counted_queries', ()))
+    if has_request_context() and g.get('query_stats') is not None:
+        active.append(g.query_stats)
+    return active
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    for stats in _active_stats():
+        stats.record(statement, elapsed)
+    slow_queries.observe(conn, statement, parameters, executemany, elapsed)
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(context):
+    if context.connection is not None and context.connection.info.get('query_started'):
+        context.connection.info['query_started'].pop()
+
+@contextmanager
+def count_queries():
+    """Counts the statements run inside the block, requests included: `with count_queries() as stats:`"""
+    stats = QueryStats()
+    g.counted_queries = g.get('counted_queries', ()) + (stats,)
+    try:
+        yield stats
+    finally:
+        g.counted_queries = tuple(active for active in g.counted_queries if active is not stats)
+
+def query_budget(max_queries):
+    """Declares how many queries a view may issue (see the module docstring)."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            g.query_budget = max_queries
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class QueryInstrumentation:
+    """Attaches per-request query stats and keeps per-endpoint totals for this process."""
+
+    def __init__(self):
+        self._endpoints = {} # endpoint -> {'requests', 'queries', 'db_seconds', 'max_queries', 'n_plus_one'}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        # Settings are read per request, so apps with different configs can share this instance
+        app.extensions['query_stats'] = self
+        self.clear()
+        if self._start not in app.before_request_funcs.get(None, []):
+            app.before_request(self._start)
+            app.after_request(self._finish_response)
+            app.teardown_request(self._finish_request)
+
+    def clear(self):
+        with self._lock:
+            self._endpoints.clear()
+
+    def snapshot(self):
+        """Per-endpoint totals since start-up: {endpoint: {'requests', 'queries', 'db_seconds', 'max_queries', 'n_plus_one'}}"""
+        with self._lock:
+            return {endpoint: dict(totals) for endpoint, totals in self._endpoints.items()}
+
+    def _start(self):
+        g.pop('query_budget', None)
+        if current_app.config.get('QUERY_INSTRUMENTATION', True):
+            g.query_stats = QueryStats()
+        else:
+            g.pop('query_stats', None)
+
+    def _finish_response(self, response):
+        stats = g.get('query_stats')
+        if stats is None:
+            return response
+        if current_app.config.get('SERVER_TIMING_HEADER', True):
+            response.headers.add('Server-Timing', f'db;dur={stats.seconds * 1000:.1f};desc="{stats.count} queries"')
+        budget = g.get('query_budget')
+        if budget is not None and stats.count > budget:
+            message = f'{request.endpoint} issued {stats.count} queries, over its budget of {budget}'
+            if current_app.testing:
+                raise QueryBudgetExceeded(message)
+            current_app.logger.warning(message)
+        return response
+
+    def _finish_request(self, exc):
+        stats = g.pop('query_stats', None)
+        if stats is None or request.endpoint is None:
+            return
+        suspects = stats.repeated(current_app.config.get('QUERY_REPEAT_THRESHOLD', 5))
+        for statement, executions in suspects:
+            current_app.logger.warning(f'Possible N+1 in {request.endpoint}: {executions} x {" ".join(statement.split())[:200]}')
+        with self._lock:
+            totals = self._endpoints.setdefault(request.endpoint, {'requests': 0, 'queries': 0, 'db_seconds': 0.0,
+                                                                   'max_queries': 0, 'n_plus_one': 0})
+            totals['requests'] += 1
+            totals['queries'] += stats.count
+            totals['db_seconds'] += stats.seconds
+            totals['max_queries'] = max(totals['max_queries'], stats.count)
+            totals['n_plus_one'] += bool(suspects)
+        db_queries.inc(stats.count, endpoint=request.endpoint)
+        db_seconds.inc(stats.seconds, endpoint=request.endpoint)
+
+query_stats = QueryInstrumentation()
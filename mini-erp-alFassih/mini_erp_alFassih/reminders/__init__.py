@@ -0,0 +1,23 @@
+"""
+Session reminders, sent by `flask jobs worker` processes.
+
+The periodic reminders.scan task queues a reminders.send job for each session
+starting within REMINDER_LEAD_HOURS; web workers never take part.
+"""
+
+from datetime import timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from ..jobs import jobs
+from .service import scan_upcoming
+
+reminders_cli = AppGroup('reminders', help='Schedule session reminders.')
+
+@reminders_cli.command('scan')
+def scan_command():
+    """Queues reminders for sessions starting within the lead time, without waiting for the periodic scan."""
+    added = scan_upcoming(jobs.queue, lead=timedelta(hours=current_app.config.get('REMINDER_LEAD_HOURS', 24)))
+    click.echo(f'Queued {added} new reminders.')
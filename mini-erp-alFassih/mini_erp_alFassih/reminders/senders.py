@@ -0,0 +1,58 @@
+"""
+Reminder delivery backends, chosen with the REMINDER_SENDER setting.
+
+A sender takes a reminder dict (session_id, start_time, patient_name,
+therapist_name, recipient) and raises on failure so the job is retried.
+"""
+
+import importlib
+import json
+import os
+import smtplib
+from email.message import EmailMessage
+
+class FileSender:
+    """Appends each reminder as a JSON line to a local outbox file; the default stand-in for real delivery."""
+
+    def __init__(self, app):
+        self.path = app.config.get('REMINDER_OUTBOX_PATH') or os.path.join(app.instance_path, 'reminders_outbox.jsonl')
+
+    def send(self, reminder):
+        with open(self.path, 'a', encoding='utf-8') as outbox:
+            outbox.write(json.dumps(reminder, default=str) + '\n')
+
+class SmtpSender:
+    """Emails the reminder to the patient's address through REMINDER_SMTP_HOST."""
+
+    def __init__(self, app):
+        self.host = app.config.get('REMINDER_SMTP_HOST', 'localhost')
+        self.port = app.config.get('REMINDER_SMTP_PORT', 25)
+        self.sender = app.config.get('REMINDER_FROM_ADDRESS', 'reminders@localhost')
+
+    def send(self, reminder):
+        if not reminder['recipient']:
+            raise ValueError(f"Patient of session {reminder['session_id']} has no email address in their contact info.")
+        message = EmailMessage()
+        message['From'] = self.sender
+        message['To'] = reminder['recipient']
+        message['Subject'] = f"Reminder: session on {reminder['start_time']:%A %d %B at %H:%M}"
+        message.set_content(
+            f"Dear {reminder['patient_name']},\n\n"
+            f"This is a reminder of your session with {reminder['therapist_name']} "
+            f"on {reminder['start_time']:%A %d %B %Y at %H:%M}.\n"
+        )
+        with smtplib.SMTP(self.host, self.port, timeout=30) as smtp:
+            smtp.send_message(message)
+
+SENDERS = {
+    'file': FileSender,
+    'smtp': SmtpSender,
+}
+
+def load_sender(app):
+    """Builds the configured sender: a name from SENDERS or a 'package.module:ClassName' path."""
+    name = app.config.get('REMINDER_SENDER', 'file')
+    if name in SENDERS:
+        return SENDERS[name](app)
+    module_name, _, class_name = name.partition(':')
+    return getattr(importlib.import_module(module_name), class_name)(app)
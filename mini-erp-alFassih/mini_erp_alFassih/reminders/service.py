@@ -0,0 +1,99 @@
+"""
+Finding sessions that need a reminder and sending each queued reminder.
+
+scan_upcoming walks 'Scheduled' sessions starting within the lead time in
+(start_time, id) order, a batch at a time, using ix_session_status_start_time,
+and enqueues one reminders.send job per session. The idempotency key includes
+the start time, so repeated scans add nothing while a rescheduled session gets
+a fresh reminder.
+
+send_reminder reloads the session when its job runs. A session that was
+cancelled or moved since it was queued is dropped rather than reminded.
+"""
+
+import re
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from .. import db
+from ..jobs import jobs
+from ..models import Patient, Therapist, Session
+from .senders import load_sender
+
+SEND_TASK = 'reminders.send'
+
+EMAIL_PATTERN = re.compile(r'[\w.+-]+@[\w-]+(\.[\w-]+)+')
+
+def reminder_key(session_id, start_time):
+    return f'session-reminder:{session_id}:{start_time.isoformat()}'
+
+def scan_upcoming(queue, now=None, lead=timedelta(hours=24), batch_size=500):
+    """Enqueues reminders for sessions starting in [now, now + lead); returns how many were new."""
+    now = now or datetime.utcnow()
+    added = 0
+    last = None
+    while True:
+        query = db.select(Session.id, Session.start_time).where(
+            Session.status == 'Scheduled', Session.start_time >= now, Session.start_time < now + lead)
+        if last is not None:
+            query = query.where(db.or_(
+                Session.start_time > last.start_time,
+                db.and_(Session.start_time == last.start_time, Session.id > last.id)
+            ))
+        rows = db.session.execute(query.order_by(Session.start_time, Session.id).limit(batch_size)).all()
+        if not rows:
+            return added
+        # One executemany per batch; keys already queued are skipped by the queue
+        added += queue.enqueue(SEND_TASK, [
+            (reminder_key(row.id, row.start_time), {'session_id': row.id, 'start_time': row.start_time.isoformat()})
+            for row in rows
+        ])
+        last = rows[-1]
+
+def _recipient(contact_info):
+    match = EMAIL_PATTERN.search(contact_info or '')
+    return match.group(0) if match else None
+
+def _sender():
+    # Built once per app; senders read their settings at construction
+    if 'reminder_sender' not in current_app.extensions:
+        current_app.extensions['reminder_sender'] = load_sender(current_app)
+    return current_app.extensions['reminder_sender']
+
+def send_reminder(payload, sender=None, now=None):
+    """Sends the reminder for payload['session_id'] unless it no longer applies.
+    Raises when delivery fails, so the job is retried.
+    """
+    now = now or datetime.utcnow()
+    row = db.session.execute(
+        db.select(Session.id, Session.start_time, Session.status,
+                  Patient.first_name.label('patient_first_name'), Patient.last_name.label('patient_last_name'),
+                  Patient.contact_info,
+                  Therapist.first_name.label('therapist_first_name'), Therapist.last_name.label('therapist_last_name'))
+        .join(Patient, Session.patient_id == Patient.id)
+        .join(Therapist, Session.therapist_id == Therapist.id)
+        .where(Session.id == payload['session_id'])
+    ).first()
+    if row is None or row.status != 'Scheduled' or row.start_time < now:
+        return {'sent': False, 'reason': 'Session is no longer upcoming.'}
+    if row.start_time.isoformat() != payload['start_time']:
+        return {'sent': False, 'reason': 'Session was rescheduled; its new time has its own reminder.'}
+
+    (sender or _sender()).send({
+        'session_id': row.id,
+        'start_time': row.start_time,
+        'patient_name': f'{row.patient_first_name} {row.patient_last_name}',
+        'therapist_name': f'{row.therapist_first_name} {row.therapist_last_name}',
+        'recipient': _recipient(row.contact_info),
+    })
+    return {'sent': True}
+
+@jobs.task(SEND_TASK, timeout=120)
+def send_reminder_task(payload):
+    return send_reminder(payload)
+
+@jobs.task('reminders.scan', every='REMINDER_SCAN_INTERVAL')
+def scan_upcoming_task(payload):
+    added = scan_upcoming(jobs.queue, lead=timedelta(hours=current_app.config.get('REMINDER_LEAD_HOURS', 24)))
+    return {'queued': added}
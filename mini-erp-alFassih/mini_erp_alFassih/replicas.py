@@ -0,0 +1,144 @@
+"""
+Read-replica routing for read-only views.
+
+Every query normally goes to the primary database. With REPLICA_DATABASE_URLS
+set, views decorated with @read_replica (lists, analytics, reports, calendar
+feeds) run their SELECTs on one of the replicas instead, so reporting
+load no longer competes with schedule writes on the primary:
+
+- Only GET/HEAD requests are routed; flushes and INSERT/UPDATE/DELETE
+  statements always use the primary, even inside a routed view.
+- Each replica's lag is checked at most every REPLICA_CHECK_INTERVAL seconds;
+  one that is unreachable or more than REPLICA_MAX_LAG seconds behind is left
+  out until the next check. With no usable replica the view reads the primary.
+- After a user's POST (or any other unsafe request) their reads stay on the
+  primary for REPLICA_MAX_LAG seconds, so they see their own writes.
+
+Lag is measured on PostgreSQL streaming replicas; replicas on other backends
+are assumed to be current. The reception schedule and the admin dashboard are
+not routed: their caches are refreshed on this process's change events and
+must reload rows from the primary.
+"""
+
+import random
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy.session import Session as BaseSession
+from sqlalchemy import create_engine, text
+
+from .database import configure_sqlite
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+PRIMARY_UNTIL_KEY = '_db_primary_until' # Flask session key holding the end of the read-your-writes window
+
+_POSTGRESQL_LAG = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0"
+    " ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+def replica_lag(connection):
+    """Seconds the replica behind connection is behind its primary; None if unknown."""
+    if connection.dialect.name == 'postgresql':
+        lag = connection.execute(_POSTGRESQL_LAG).scalar()
+        return None if lag is None else float(lag)
+    return 0.0
+
+class ReplicaRouter:
+    """Per-process pool of replica engines and their last known health."""
+
+    def __init__(self, max_lag=10, check_interval=5):
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.engines = []
+        self._health = {} # engine index -> (checked at, usable)
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.max_lag = app.config.get('REPLICA_MAX_LAG', self.max_lag)
+        self.check_interval = app.config.get('REPLICA_CHECK_INTERVAL', self.check_interval)
+        self.dispose()
+        options = app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {}
+        for url in app.config.get('REPLICA_DATABASE_URLS') or ():
+            engine = create_engine(url, **options)
+            configure_sqlite(engine, app.config.get('SQLITE_PRAGMAS') or {})
+            self.engines.append(engine)
+        app.extensions['replicas'] = self
+        if _remember_writes not in app.after_request_funcs.get(None, []):
+            app.before_request(_reset_routing)
+            app.after_request(_remember_writes)
+
+    def dispose(self):
+        for engine in self.engines:
+            engine.dispose()
+        self.engines = []
+        with self._lock:
+            self._health.clear()
+
+    def _usable(self, index):
+        now = time.monotonic()
+        with self._lock:
+            checked = self._health.get(index)
+        if checked is not None and now - checked[0] < self.check_interval:
+            return checked[1]
+        engine = self.engines[index]
+        try:
+            with engine.connect() as connection:
+                lag = replica_lag(connection)
+        except Exception as exc: # Any failure to reach the replica just takes it out of rotation
+            current_app.logger.warning('Read replica %s unavailable: %s', engine.url.render_as_string(), exc)
+            usable = False
+        else:
+            usable = lag is not None and lag <= self.max_lag
+            if not usable:
+                current_app.logger.warning('Read replica %s skipped, lag %s s', engine.url.render_as_string(), lag)
+        with self._lock:
+            self._health[index] = (now, usable)
+        return usable
+
+    def choose(self):
+        """A usable replica engine picked at random, or None to read from the primary."""
+        candidates = [engine for index, engine in enumerate(self.engines) if self._usable(index)]
+        return random.choice(candidates) if candidates else None
+
+replica_router = ReplicaRouter()
+
+def _reset_routing():
+    # Requests normally get a fresh g; this also covers nested test requests sharing one app context
+    g.pop('read_replica', None)
+    g.pop('replica_engine', None)
+
+def _remember_writes(response):
+    if request.method not in SAFE_METHODS and replica_router.engines:
+        session[PRIMARY_UNTIL_KEY] = time.time() + replica_router.max_lag
+    return response
+
+def read_replica(view):
+    """Lets a view's reads go to a replica (see the module docstring); put it below the auth decorators."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method in ('GET', 'HEAD') and time.time() >= session.get(PRIMARY_UNTIL_KEY, 0):
+            g.read_replica = True
+        return view(*args, **kwargs)
+    return wrapper
+
+def _request_replica():
+    """The replica engine for the current request, chosen on its first routed query; None for the primary."""
+    if not has_request_context() or not g.get('read_replica'):
+        return None
+    if 'replica_engine' not in g:
+        router = current_app.extensions.get('replicas')
+        g.replica_engine = router.choose() if router is not None and router.engines else None
+    return g.replica_engine
+
+class RoutingSession(BaseSession):
+    """db.session class: sends the reads of routed views to a replica, everything else to the primary."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and not getattr(clause, 'is_dml', False):
+            engine = _request_replica()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
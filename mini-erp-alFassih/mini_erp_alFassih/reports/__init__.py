@@ -0,0 +1,13 @@
+"""
+Monthly activity report, downloaded as CSV or XLSX.
+
+Rows are streamed from the database and written out as they arrive, so a
+month of any size costs the same memory. A background job can pre-render the
+file; it is served from disk until the month's sessions or patients change.
+"""
+
+from flask import Blueprint
+
+reports_bp = Blueprint('reports', __name__)
+
+from . import export, routes
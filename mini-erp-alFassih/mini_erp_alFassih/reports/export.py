@@ -0,0 +1,241 @@
+"""
+Building the monthly activity report and writing it as CSV or XLSX.
+
+report_rows runs one GROUP BY query (a row per therapist and patient) with
+yield_per, so rows are fetched from a server-side cursor a batch at a time.
+The writers turn rows into chunks as they arrive: the XLSX workbook is a zip
+written to a non-seekable sink, which zipfile handles with data descriptors,
+so neither format is ever held in memory whole.
+
+Pre-rendered files live in REPORT_CACHE_DIR, named after the month, format and
+report_validator; a file whose validator no longer matches is simply not found.
+"""
+
+import csv
+import glob
+import hashlib
+import io
+import os
+import re
+import zipfile
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+from flask import current_app
+
+from .. import db
+from ..analytics import session_hours
+from ..jobs import jobs
+from ..models import Patient, Therapist, Session
+
+RENDER_TASK = 'reports.render'
+
+FORMATS = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+HEADER = ('Therapist', 'Patient ID', 'Patient', 'Sessions', 'Completed', 'Cancelled', 'No Show', 'Scheduled',
+          'Booked Hours', 'First Session', 'Last Session')
+
+def month_period(month):
+    """Returns the [start, end) datetimes of a 'YYYY-MM' month; raises ValueError for anything else."""
+    start = datetime.strptime(month, '%Y-%m')
+    end = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+    return start, end
+
+def report_validator(start, end):
+    """ETag of the report for [start, end): changes when a session in the month, one of its patients or one
+    of its therapists does. The count catches deleted sessions, which leave no newer timestamp behind.
+    """
+    count, session_changed, patient_changed, therapist_changed = db.session.execute(
+        db.select(db.func.count(Session.id), db.func.max(Session.updated_at), db.func.max(Patient.updated_at),
+                  db.func.max(Therapist.updated_at))
+        .join(Patient, Session.patient_id == Patient.id)
+        .join(Therapist, Session.therapist_id == Therapist.id)
+        .where(Session.start_time >= start, Session.start_time < end)
+    ).one()
+    key = f'activity:{start.isoformat()}:{count}:{session_changed}:{patient_changed}:{therapist_changed}'
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+def report_rows(start, end, batch_size=500):
+    """Yields one tuple per therapist and patient with sessions in [start, end), in HEADER order."""
+    def count_status(status):
+        return db.func.coalesce(db.func.sum(db.case((Session.status == status, 1), else_=0)), 0)
+
+    rows = db.session.execute(
+        db.select(Therapist.first_name.label('therapist_first'), Therapist.last_name.label('therapist_last'),
+                  Patient.id.label('patient_id'), Patient.first_name, Patient.last_name,
+                  db.func.count(Session.id).label('total'),
+                  count_status('Completed').label('completed'),
+                  count_status('Cancelled').label('cancelled'),
+                  count_status('No Show').label('no_show'),
+                  count_status('Scheduled').label('scheduled'),
+                  db.func.coalesce(db.func.sum(db.case((Session.status != 'Cancelled', session_hours()), else_=0)), 0)
+                      .label('booked_hours'),
+                  db.func.min(Session.start_time).label('first_session'),
+                  db.func.max(Session.start_time).label('last_session'))
+        .join(Therapist, Session.therapist_id == Therapist.id)
+        .join(Patient, Session.patient_id == Patient.id)
+        .where(Session.start_time >= start, Session.start_time < end)
+        .group_by(Therapist.id, Therapist.first_name, Therapist.last_name,
+                  Patient.id, Patient.first_name, Patient.last_name)
+        .order_by(Therapist.last_name, Therapist.first_name, Therapist.id,
+                  Patient.last_name, Patient.first_name, Patient.id)
+        .execution_options(yield_per=batch_size)
+    )
+    for row in rows:
+        yield (f'{row.therapist_first} {row.therapist_last}', row.patient_id, f'{row.first_name} {row.last_name}',
+               row.total, row.completed, row.cancelled, row.no_show, row.scheduled,
+               round(float(row.booked_hours), 2), _timestamp(row.first_session), _timestamp(row.last_session))
+
+def _timestamp(value):
+    # SQLite returns min()/max() of a DateTime column as text
+    if isinstance(value, str):
+        return value[:16]
+    return value.strftime('%Y-%m-%d %H:%M') if value is not None else ''
+
+def csv_chunks(rows, chunk_size=64 * 1024):
+    """Yields the CSV text in chunks of roughly chunk_size characters."""
+    buffer = io.StringIO()
+    buffer.write('\ufeff') # Lets Excel detect UTF-8, so Arabic names survive
+    writer = csv.writer(buffer)
+    writer.writerow(HEADER)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+class _ChunkSink:
+    """Write-only, non-seekable file object that collects what zipfile writes until it is taken."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml"'
+        ' ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml"'
+        ' ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml"'
+        ' Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>'),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+        ' xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Sessions" sheetId="1" r:id="rId1"/></sheets></workbook>'),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml"'
+        ' Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '</Relationships>'),
+}
+
+# Characters XML 1.0 does not allow, even escaped
+_INVALID_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+def _column(index):
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+def _xlsx_row(number, values):
+    cells = []
+    for index, value in enumerate(values):
+        ref = f'{_column(index)}{number}'
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            cells.append(f'<c r="{ref}"><v>{value}</v></c>')
+        elif value is not None and value != '':
+            # Inline strings need no shared-string table, which would have to be built before the sheet
+            text = escape(_INVALID_XML.sub('', str(value)))
+            cells.append(f'<c r="{ref}" t="inlineStr"><is><t>{text}</t></is></c>')
+    return f'<row r="{number}">{"".join(cells)}</row>'
+
+def xlsx_chunks(rows, rows_per_chunk=500):
+    """Yields a one-sheet XLSX workbook as bytes, a chunk per rows_per_chunk rows."""
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, text in XLSX_PARTS.items():
+            archive.writestr(name, text)
+        with archive.open('xl/worksheets/sheet1.xml', 'w') as sheet:
+            sheet.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                        b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+            sheet.write(_xlsx_row(1, HEADER).encode('utf-8'))
+            for number, row in enumerate(rows, start=2):
+                sheet.write(_xlsx_row(number, row).encode('utf-8'))
+                if number % rows_per_chunk == 0:
+                    yield sink.take()
+            sheet.write(b'</sheetData></worksheet>')
+    yield sink.take() # The rest of the sheet and the central directory, written on close
+
+def report_chunks(fmt, start, end):
+    batch_size = current_app.config.get('REPORT_BATCH_SIZE', 500)
+    rows = report_rows(start, end, batch_size=batch_size)
+    return csv_chunks(rows) if fmt == 'csv' else xlsx_chunks(rows, rows_per_chunk=batch_size)
+
+def download_name(month, fmt):
+    return f'activity-report-{month}.{fmt}'
+
+def _cache_dir():
+    return current_app.config.get('REPORT_CACHE_DIR') or os.path.join(current_app.instance_path, 'reports')
+
+def cached_report_path(month, fmt, etag):
+    """Path of a pre-rendered report for this validator, or None if there is none."""
+    path = os.path.join(_cache_dir(), f'activity-{month}-{etag}.{fmt}')
+    return path if os.path.exists(path) else None
+
+def render_report(month, fmt):
+    """Writes the report to the cache directory (replacing older versions of the month) and returns its path."""
+    start, end = month_period(month)
+    etag = report_validator(start, end)
+    path = cached_report_path(month, fmt, etag)
+    if path is not None:
+        return path, etag
+
+    directory = _cache_dir()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'activity-{month}-{etag}.{fmt}')
+    partial = f'{path}.{os.getpid()}.part'
+    with open(partial, 'wb') as output:
+        for chunk in report_chunks(fmt, start, end):
+            output.write(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+    os.replace(partial, path) # Readers see either no file or the whole file
+    for stale in glob.glob(os.path.join(directory, f'activity-{month}-*.{fmt}')):
+        if stale != path:
+            os.remove(stale)
+    return path, etag
+
+@jobs.task(RENDER_TASK, timeout=900)
+def render_report_task(payload):
+    path, etag = render_report(payload['month'], payload['format'])
+    return {'month': payload['month'], 'format': payload['format'], 'etag': etag,
+            'file': os.path.basename(path), 'bytes': os.path.getsize(path)}
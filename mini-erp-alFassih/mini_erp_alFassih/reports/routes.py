@@ -0,0 +1,54 @@
+from flask import request, jsonify, abort, url_for, send_file, stream_with_context, current_app
+from flask_login import login_required, current_user
+
+from . import reports_bp
+from .export import (FORMATS, RENDER_TASK, month_period, report_validator, report_chunks, cached_report_path,
+                     download_name)
+from ..jobs import jobs
+from ..decorators import admin_required
+from ..replicas import read_replica
+from ..metrics import cache_lookup
+
+def _report_period(fmt):
+    if fmt not in FORMATS:
+        abort(404)
+    month = request.args.get('month', '')
+    try:
+        start, end = month_period(month)
+    except ValueError:
+        abort(400, description="month must be given as YYYY-MM")
+    return month, start, end
+
+@reports_bp.route('/activity.<fmt>')
+@login_required
+@admin_required
+@read_replica
+def activity_report(fmt):
+    """Per-therapist, per-patient session summary for ?month=YYYY-MM, as CSV or XLSX."""
+    month, start, end = _report_period(fmt)
+    etag = report_validator(start, end)
+    path = cached_report_path(month, fmt, etag)
+    if cache_lookup('report_file', path is not None):
+        response = send_file(path, mimetype=FORMATS[fmt], as_attachment=True,
+                             download_name=download_name(month, fmt), etag=etag)
+    else:
+        response = current_app.response_class(stream_with_context(report_chunks(fmt, start, end)),
+                                              mimetype=FORMATS[fmt])
+        response.headers['Content-Disposition'] = f'attachment; filename={download_name(month, fmt)}'
+        response.set_etag(etag)
+    response.cache_control.no_cache = True
+    response.cache_control.private = True
+    return response.make_conditional(request)
+
+@reports_bp.route('/activity.<fmt>/render', methods=['POST'])
+@login_required
+@admin_required
+def render_activity_report(fmt):
+    """Pre-renders the report in the background; poll status_url, then download from download_url."""
+    month, start, end = _report_period(fmt)
+    etag = report_validator(start, end)
+    # Keyed by validator: asking again before the data changes returns the same job
+    job_id = jobs.enqueue(RENDER_TASK, {'month': month, 'format': fmt}, key=f'report:{month}:{fmt}:{etag}',
+                          owner_id=current_user.id)
+    return jsonify(job_id=job_id, status_url=url_for('jobs.job_status', job_id=job_id),
+                   download_url=url_for('reports.activity_report', fmt=fmt, month=month)), 202
@@ -0,0 +1,235 @@
+"""
+Hourly, daily and monthly rollups for reporting.
+
+SessionRollup counts sessions and booked minutes per therapist, status and
+session type; ActivityRollup counts new patients and uploaded documents. The
+periodic rollups.refresh job advances a high-water mark over
+Session.updated_at, Patient.created_at and Document.uploaded_at, recomputes the
+hour buckets those rows fall in from the raw tables, then re-sums the affected
+days and months from the hour rows. Deletes and moved sessions leave no trace
+for the high-water mark, so the flush hook below records their old hour in
+RollupStaleHour for the next run.
+
+Reports read a few hundred rollup rows (session_series, activity_series)
+instead of scanning the session table.
+"""
+
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session as OrmSession
+
+from . import db
+from .analytics import dialect_name, session_hours
+from .jobs import jobs
+from .models import Patient, Document, Session, SessionRollup, ActivityRollup, RollupState, RollupStaleHour
+
+GRAINS = ('hour', 'day', 'month')
+STATE_NAME = 'rollups'
+
+SESSION_DIMENSIONS = ('therapist_id', 'status', 'session_type')
+SESSION_MEASURES = ('session_count', 'booked_minutes')
+ACTIVITY_MEASURES = ('new_patients', 'documents_uploaded')
+
+def truncate(value, grain):
+    """Start of the grain-sized bucket containing value."""
+    value = value.replace(minute=0, second=0, microsecond=0)
+    if grain in ('day', 'month'):
+        value = value.replace(hour=0)
+    if grain == 'month':
+        value = value.replace(day=1)
+    return value
+
+def _next_bucket(bucket, grain):
+    if grain == 'hour':
+        return bucket + timedelta(hours=1)
+    if grain == 'day':
+        return bucket + timedelta(days=1)
+    return (bucket + timedelta(days=32)).replace(day=1)
+
+def _hour(column):
+    """SQL expression truncating column to the hour."""
+    if dialect_name() == 'postgresql':
+        return db.func.date_trunc('hour', column)
+    return db.func.strftime('%Y-%m-%d %H:00:00', column)
+
+def _as_datetime(value):
+    return datetime.strptime(value, '%Y-%m-%d %H:%M:%S') if isinstance(value, str) else value
+
+def _ranges(buckets, grain, max_gap=1):
+    """Merges sorted buckets into [start, end) ranges, joining buckets at most max_gap buckets apart."""
+    ranges = []
+    for bucket in sorted(buckets):
+        end = _next_bucket(bucket, grain)
+        if ranges:
+            gap_end = ranges[-1][1]
+            for _ in range(max_gap):
+                gap_end = _next_bucket(gap_end, grain)
+            if bucket <= gap_end:
+                ranges[-1][1] = end
+                continue
+        ranges.append([bucket, end])
+    return ranges
+
+def mark_stale_hours(connection, times):
+    """Records the hours of rows the high-water mark cannot see (deleted rows, old times of moved sessions)."""
+    buckets = {truncate(value, 'hour') for value in times if value is not None}
+    if buckets:
+        connection.execute(RollupStaleHour.__table__.insert(), [{'bucket': bucket} for bucket in buckets])
+
+def _stale_times(session):
+    times = []
+    for obj in session.deleted:
+        if isinstance(obj, Session):
+            times.append(obj.start_time)
+        elif isinstance(obj, Patient):
+            times.append(obj.created_at)
+        elif isinstance(obj, Document):
+            times.append(obj.uploaded_at)
+    for obj in session.dirty:
+        if isinstance(obj, Session):
+            times.extend(inspect(obj).attrs.start_time.history.deleted)
+    return times
+
+@event.listens_for(OrmSession, 'after_flush')
+def _record_stale_hours(session, flush_context):
+    times = _stale_times(session)
+    if times:
+        mark_stale_hours(session.connection(), times)
+
+def _changed_hours(high_water, upper):
+    """Hours containing source rows changed in (high_water, upper], plus recorded stale hours."""
+    def window(column):
+        criteria = [column <= upper]
+        if high_water is not None:
+            criteria.append(column > high_water)
+        return criteria
+
+    hours = set()
+    for query in (
+        db.select(_hour(Session.start_time)).where(*window(Session.updated_at)),
+        db.select(_hour(Patient.created_at)).where(*window(Patient.created_at)),
+        db.select(_hour(Document.uploaded_at)).where(*window(Document.uploaded_at)),
+    ):
+        hours.update(_as_datetime(value) for value in db.session.execute(query.distinct()).scalars())
+    stale = db.session.execute(db.select(RollupStaleHour.id, RollupStaleHour.bucket)).all()
+    hours.update(row.bucket for row in stale)
+    return {hour for hour in hours if hour is not None}, max((row.id for row in stale), default=None)
+
+def _rebuild_hours(start, end):
+    """Replaces the hour rollups in [start, end) with aggregates of the raw rows."""
+    bucket = _hour(Session.start_time).label('bucket')
+    # Grouped by the same expression objects: PostgreSQL only matches GROUP BY terms with identical parameters
+    session_type = db.func.coalesce(Session.session_type, '').label('session_type')
+    session_rows = db.session.execute(
+        db.select(bucket, Session.therapist_id, Session.status, session_type,
+                  db.func.count(Session.id).label('session_count'),
+                  db.func.coalesce(db.func.sum(session_hours() * 60), 0).label('booked_minutes'))
+        .where(Session.start_time >= start, Session.start_time < end)
+        .group_by(bucket, Session.therapist_id, Session.status, session_type)
+    ).all()
+
+    activity = defaultdict(lambda: dict.fromkeys(ACTIVITY_MEASURES, 0))
+    for column, measure in ((Patient.created_at, 'new_patients'), (Document.uploaded_at, 'documents_uploaded')):
+        hour = _hour(column).label('bucket')
+        for row in db.session.execute(db.select(hour, db.func.count()).where(column >= start, column < end).group_by(hour)):
+            activity[_as_datetime(row[0])][measure] = row[1]
+
+    _replace(SessionRollup, 'hour', start, end, [
+        {'bucket': _as_datetime(row.bucket), 'therapist_id': row.therapist_id, 'status': row.status,
+         'session_type': row.session_type, 'session_count': row.session_count,
+         'booked_minutes': int(round(row.booked_minutes))}
+        for row in session_rows
+    ])
+    _replace(ActivityRollup, 'hour', start, end, [dict(counts, bucket=bucket) for bucket, counts in activity.items()])
+
+def _reaggregate(source_grain, target_grain, start, end):
+    """Replaces target_grain rollups in [start, end) with sums of the source_grain rows they contain."""
+    for model, dimensions, measures in ((SessionRollup, SESSION_DIMENSIONS, SESSION_MEASURES),
+                                        (ActivityRollup, (), ACTIVITY_MEASURES)):
+        sums = defaultdict(lambda: dict.fromkeys(measures, 0))
+        rows = db.session.execute(
+            db.select(model.bucket, *[getattr(model, name) for name in dimensions + measures])
+            .where(model.grain == source_grain, model.bucket >= start, model.bucket < end)
+        ).all()
+        for row in rows:
+            key = (truncate(row.bucket, target_grain),) + tuple(getattr(row, name) for name in dimensions)
+            for name in measures:
+                sums[key][name] += getattr(row, name)
+        _replace(model, target_grain, start, end, [
+            dict(zip(('bucket',) + dimensions, key), **values) for key, values in sums.items()
+        ])
+
+def _replace(model, grain, start, end, rows):
+    db.session.execute(db.delete(model).where(model.grain == grain, model.bucket >= start, model.bucket < end))
+    if rows:
+        db.session.execute(db.insert(model), [dict(row, grain=grain) for row in rows])
+
+def refresh_rollups(now=None, lag=60, rebuild=False):
+    """Brings the rollups up to date; the caller commits.
+    Rows changed in the last lag seconds are left for the next run, so transactions that were
+    still open when this run started are not skipped by the high-water mark.
+    """
+    upper = (now or datetime.utcnow()) - timedelta(seconds=lag)
+    state = db.session.get(RollupState, STATE_NAME)
+    if state is None:
+        state = RollupState(name=STATE_NAME)
+        db.session.add(state)
+    if rebuild:
+        db.session.execute(db.delete(SessionRollup))
+        db.session.execute(db.delete(ActivityRollup))
+
+    hours, last_stale_id = _changed_hours(None if rebuild else state.high_water, upper)
+    for start, end in _ranges(hours, 'hour', max_gap=24):
+        _rebuild_hours(start, end)
+    days = {truncate(hour, 'day') for hour in hours}
+    for start, end in _ranges(days, 'day'):
+        _reaggregate('hour', 'day', start, end)
+    for start, end in _ranges({truncate(day, 'month') for day in days}, 'month'):
+        _reaggregate('day', 'month', start, end)
+
+    if last_stale_id is not None:
+        db.session.execute(db.delete(RollupStaleHour).where(RollupStaleHour.id <= last_stale_id))
+    state.high_water = upper
+    return {'hours': len(hours), 'days': len(days), 'high_water': upper.isoformat()}
+
+def session_series(grain, start, end, therapist_id=None):
+    """Session counts and booked minutes per bucket and status, read from the rollups."""
+    query = (db.select(SessionRollup.bucket, SessionRollup.status,
+                       db.func.sum(SessionRollup.session_count).label('session_count'),
+                       db.func.sum(SessionRollup.booked_minutes).label('booked_minutes'))
+             .where(SessionRollup.grain == grain, SessionRollup.bucket >= start, SessionRollup.bucket < end)
+             .group_by(SessionRollup.bucket, SessionRollup.status)
+             .order_by(SessionRollup.bucket, SessionRollup.status))
+    if therapist_id is not None:
+        query = query.where(SessionRollup.therapist_id == therapist_id)
+    return db.session.execute(query).all()
+
+def activity_series(grain, start, end):
+    """New patients and uploaded documents per bucket, read from the rollups."""
+    return db.session.execute(
+        db.select(ActivityRollup.bucket, ActivityRollup.new_patients, ActivityRollup.documents_uploaded)
+        .where(ActivityRollup.grain == grain, ActivityRollup.bucket >= start, ActivityRollup.bucket < end)
+        .order_by(ActivityRollup.bucket)
+    ).all()
+
+@jobs.task('rollups.refresh', every='ROLLUP_INTERVAL', timeout=900)
+def refresh_rollups_task(payload):
+    result = refresh_rollups(lag=current_app.config.get('ROLLUP_LAG', 60))
+    db.session.commit()
+    return result
+
+rollups_cli = AppGroup('rollups', help='Maintain the reporting rollup tables.')
+
+@rollups_cli.command('refresh')
+@click.option('--rebuild', is_flag=True, help='Discard all rollups and rebuild them from the raw tables.')
+def refresh_command(rebuild):
+    """Aggregates rows changed since the last run (or everything with --rebuild)."""
+    result = refresh_rollups(lag=current_app.config.get('ROLLUP_LAG', 60), rebuild=rebuild)
+    db.session.commit()
+    click.echo(f"Refreshed {result['hours']} hour buckets across {result['days']} days "
+               f"(high-water mark {result['high_water']}).")
@@ -0,0 +1,159 @@
+"""
+Materialized daily schedule for the reception desk.
+
+Each requested day is built once with a single Session/Patient/Therapist join
+and kept in memory with its serialized JSON and an ETag. Committed session
+writes (see signals.py) only mark the affected session ids as stale; the next
+read reloads just those rows and re-serializes the day, so polling screens
+mostly get an in-memory lookup or a 304.
+
+The cache lives in each worker process. Writes made by other processes are
+picked up when a day is rebuilt after SCHEDULE_CACHE_TTL seconds, or straight
+away when a cross-process live events backend relays them (see live/publish.py).
+"""
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from . import db
+from .models import Patient, Therapist, Session
+from .signals import sessions_changed
+from .metrics import cache_lookup
+
+class DaySchedule:
+    """One cached day: compact entries keyed by session id plus its serialized form."""
+
+    def __init__(self, day, entries, built_at=None):
+        self.day = day
+        self.entries = entries
+        self.built_at = built_at or datetime.utcnow() # Time of the last full rebuild from the database
+        self._serialize()
+
+    def _serialize(self):
+        therapists = OrderedDict()
+        for entry in sorted(self.entries.values(), key=lambda e: (e['therapist_name'], e['start'], e['id'])):
+            therapist = therapists.setdefault(entry['therapist_id'], {
+                'therapist_id': entry['therapist_id'],
+                'therapist_name': entry['therapist_name'],
+                'sessions': [],
+            })
+            therapist['sessions'].append({key: entry[key] for key in
+                                          ('id', 'start', 'end', 'patient_id', 'patient_name', 'session_type', 'status')})
+        self.therapists = list(therapists.values())
+        self.json = json.dumps({'date': self.day.isoformat(), 'therapists': self.therapists},
+                               separators=(',', ':'), ensure_ascii=False)
+        # Content-derived, so every worker process hands out the same ETag for the same schedule
+        self.etag = hashlib.sha1(self.json.encode('utf-8')).hexdigest()
+        self.fragment = None # Rendered HTML, filled in by the view on first use
+
+def _day_bounds(day):
+    start = datetime.combine(day, datetime.min.time())
+    return start, start + timedelta(days=1)
+
+def _entry_rows(*criteria):
+    """Selects only the columns the schedule shows, with one join per related table."""
+    return db.session.execute(
+        db.select(Session.id, Session.start_time, Session.end_time, Session.session_type, Session.status,
+                  Session.patient_id, Patient.first_name.label('patient_first_name'),
+                  Patient.last_name.label('patient_last_name'),
+                  Session.therapist_id, Therapist.first_name.label('therapist_first_name'),
+                  Therapist.last_name.label('therapist_last_name'))
+        .join(Patient, Session.patient_id == Patient.id)
+        .join(Therapist, Session.therapist_id == Therapist.id)
+        .where(*criteria)
+    ).all()
+
+def _entry(row):
+    return {
+        'id': row.id,
+        'start': row.start_time.strftime('%H:%M'),
+        'end': row.end_time.strftime('%H:%M'),
+        'start_time': row.start_time,
+        'patient_id': row.patient_id,
+        'patient_name': f'{row.patient_first_name} {row.patient_last_name}',
+        'therapist_id': row.therapist_id,
+        'therapist_name': f'{row.therapist_first_name} {row.therapist_last_name}',
+        'session_type': row.session_type,
+        'status': row.status,
+    }
+
+class DailyScheduleCache:
+    """Per-process cache of DaySchedule objects, at most max_days of them (least recently used evicted)."""
+
+    def __init__(self, max_days=7, ttl=60):
+        self.max_days = max_days
+        self.ttl = ttl
+        self._days = OrderedDict()
+        self._stale_ids = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        self.max_days = app.config.get('SCHEDULE_CACHE_DAYS', self.max_days)
+        self.ttl = app.config.get('SCHEDULE_CACHE_TTL', self.ttl)
+        app.extensions['daily_schedule'] = self
+        self.clear()
+        sessions_changed.connect(self._on_sessions_changed, weak=False)
+
+    def _on_sessions_changed(self, sender, changes=(), renamed=None, **extra):
+        # Runs right after commit, when the session cannot query; the rows are reloaded on the next read
+        self.mark_stale([change['id'] for change in changes],
+                        names_changed=bool(renamed and (renamed.get('patients') or renamed.get('therapists'))))
+
+    def mark_stale(self, session_ids, names_changed=False):
+        """Flags sessions to reload on the next read; names_changed drops every cached day."""
+        with self._lock:
+            if names_changed:
+                self._days.clear() # Names are denormalized into every entry; rebuilding is simplest
+            self._stale_ids.update(session_ids)
+
+    def clear(self):
+        with self._lock:
+            self._days.clear()
+            self._stale_ids.clear()
+
+    def get(self, day):
+        """Returns the DaySchedule for day, building or patching it as needed."""
+        with self._lock:
+            if self._stale_ids and self._days:
+                self._patch(self._stale_ids)
+            self._stale_ids.clear()
+
+            schedule = self._days.get(day)
+            fresh = schedule is not None and datetime.utcnow() - schedule.built_at < timedelta(seconds=self.ttl)
+            if cache_lookup('schedule', fresh):
+                self.hits += 1
+                self._days.move_to_end(day)
+                return schedule
+
+            self.misses += 1
+            start, end = _day_bounds(day)
+            rows = _entry_rows(Session.start_time >= start, Session.start_time < end)
+            schedule = DaySchedule(day, {row.id: _entry(row) for row in rows})
+            self._days[day] = schedule
+            while len(self._days) > self.max_days:
+                self._days.popitem(last=False)
+            return schedule
+
+    def _patch(self, session_ids):
+        """Moves, updates or drops the given sessions in every cached day with one query."""
+        fresh = {row.id: _entry(row) for row in _entry_rows(Session.id.in_(session_ids))}
+        for day, schedule in list(self._days.items()):
+            start, end = _day_bounds(day)
+            changed = False
+            for session_id in session_ids:
+                entry = fresh.get(session_id)
+                belongs = entry is not None and start <= entry['start_time'] < end
+                if belongs:
+                    schedule.entries[session_id] = entry
+                    changed = True
+                elif schedule.entries.pop(session_id, None) is not None:
+                    changed = True
+            if changed:
+                self._days[day] = DaySchedule(day, schedule.entries, built_at=schedule.built_at)
+
+daily_schedule = DailyScheduleCache()
@@ -1,5 +1,7 @@
 from flask import Blueprint
+from flask.cli import AppGroup
 
 sessions_bp = Blueprint('sessions', __name__, template_folder='templates')
+sessions_cli = AppGroup('sessions', help='Bulk session maintenance.')
 
-from . import routes
+from . import routes, commands
@@ -0,0 +1,153 @@
+"""
+Set-based bulk operations on sessions (cancel, complete, reschedule).
+
+Each operation checks the selected sessions for conflicts, applies the change to
+the remaining ones with one UPDATE statement (an executemany keyed by id for
+reschedules) and reports what happened.
+The caller owns the transaction and commits once.
+Set-based writes skip the ORM flush hooks, so each operation also does what
+those hooks would: refresh patient summaries, queue change signals and, for
+moves, record the vacated rollup hours.
+"""
+
+from datetime import datetime
+
+from .. import db
+from ..models import Session
+from ..summaries import refresh_patient_summaries
+from ..signals import note_session_changes
+from ..rollups import mark_stale_hours
+
+# Bulk action name -> status written by that action
+STATUS_ACTIONS = {
+    'cancel': 'Cancelled',
+    'complete': 'Completed',
+}
+
+def _selected_rows(selection):
+    """Loads the columns needed for conflict checks; selection is a SELECT of Session.id."""
+    return db.session.execute(
+        db.select(Session.id, Session.patient_id, Session.therapist_id,
+                  Session.start_time, Session.end_time, Session.status)
+        .where(Session.id.in_(selection))
+        .order_by(Session.start_time, Session.id)
+    ).all()
+
+def _change_record(row, **changed):
+    record = {'id': row.id, 'kind': 'updated', 'patient_id': row.patient_id, 'therapist_id': row.therapist_id,
+              'start_time': row.start_time, 'status': row.status}
+    record.update(changed)
+    return record
+
+def _summary(action, rows, applied_ids, skipped, dry_run):
+    """With dry_run, 'updated' lists what would change; nothing was written."""
+    return {
+        'action': action,
+        'matched': len(rows),
+        'updated': len(applied_ids),
+        'updated_ids': applied_ids,
+        'skipped': skipped,
+        'dry_run': dry_run,
+    }
+
+def bulk_set_status(selection, action, dry_run=False, now=None):
+    """Applies a status action to every selected 'Scheduled' session.
+    Sessions in another status are skipped, as are future sessions when completing.
+    """
+    new_status = STATUS_ACTIONS[action]
+    now = now or datetime.utcnow()
+    rows = _selected_rows(selection)
+
+    applied, skipped = [], []
+    for row in rows:
+        if row.status != 'Scheduled':
+            skipped.append({'session_id': row.id, 'reason': f'Session is {row.status}, not Scheduled.'})
+        elif action == 'complete' and row.start_time > now:
+            skipped.append({'session_id': row.id, 'reason': 'Session has not started yet.'})
+        else:
+            applied.append(row)
+
+    if applied and not dry_run:
+        db.session.execute(
+            db.update(Session)
+            .where(Session.id.in_([row.id for row in applied]), Session.status == 'Scheduled')
+            .values(status=new_status, updated_at=datetime.utcnow()),
+            execution_options={'synchronize_session': 'fetch'}
+        )
+        # Set-based UPDATEs bypass the flush hooks, so refresh summaries and queue change signals here
+        refresh_patient_summaries(db.session.connection(), {row.patient_id for row in applied})
+        note_session_changes(db.session, [_change_record(row, status=new_status) for row in applied])
+    return _summary(action, rows, [row.id for row in applied], skipped, dry_run)
+
+def _overlaps(start_a, end_a, start_b, end_b):
+    return start_a < end_b and start_b < end_a
+
+def bulk_reschedule(selection, shift, dry_run=False):
+    """Moves every selected 'Scheduled' session by the timedelta shift.
+    A session is skipped when its new slot overlaps another scheduled session of the
+    same therapist or patient that is not being moved along with it.
+    """
+    rows = _selected_rows(selection)
+    movable = [row for row in rows if row.status == 'Scheduled']
+    skipped = [{'session_id': row.id, 'reason': f'Session is {row.status}, not Scheduled.'}
+               for row in rows if row.status != 'Scheduled']
+    applied = []
+
+    if movable:
+        moved_ids = {row.id for row in movable}
+        window_start = min(row.start_time for row in movable) + shift
+        window_end = max(row.end_time for row in movable) + shift
+        # One query fetches every scheduled session that could collide with any new slot
+        others = db.session.execute(
+            db.select(Session.id, Session.patient_id, Session.therapist_id, Session.start_time, Session.end_time)
+            .where(Session.status == 'Scheduled',
+                   Session.id.notin_(moved_ids),
+                   Session.start_time < window_end,
+                   Session.end_time > window_start,
+                   db.or_(Session.therapist_id.in_({row.therapist_id for row in movable}),
+                          Session.patient_id.in_({row.patient_id for row in movable})))
+        ).all()
+        by_therapist, by_patient = {}, {}
+        for other in others:
+            by_therapist.setdefault(other.therapist_id, []).append(other)
+            by_patient.setdefault(other.patient_id, []).append(other)
+
+        candidates = []
+        for row in movable:
+            new_start, new_end = row.start_time + shift, row.end_time + shift
+            clash = next((other for other in by_therapist.get(row.therapist_id, []) + by_patient.get(row.patient_id, [])
+                          if _overlaps(new_start, new_end, other.start_time, other.end_time)), None)
+            if clash is not None:
+                skipped.append({'session_id': row.id, 'reason': f'New time overlaps session {clash.id}.'})
+            else:
+                candidates.append({'id': row.id, 'start_time': new_start, 'end_time': new_end, 'row': row})
+
+        # A skipped session keeps its old slot, where another selected session may be moving to.
+        # Such a move is skipped too and keeps its own slot in turn, so check until no new skips appear
+        staying = [row for row in movable if row.id not in {move['id'] for move in candidates}]
+        while staying:
+            blocked = []
+            for move in candidates:
+                row = move['row']
+                clash = next((other for other in staying
+                              if (other.therapist_id == row.therapist_id or other.patient_id == row.patient_id)
+                              and _overlaps(move['start_time'], move['end_time'], other.start_time, other.end_time)), None)
+                if clash is not None:
+                    skipped.append({'session_id': row.id, 'reason': f'New time overlaps session {clash.id}.'})
+                    blocked.append(move)
+            candidates = [move for move in candidates if move not in blocked]
+            staying = [move['row'] for move in blocked]
+        applied = candidates
+
+    if applied and not dry_run:
+        # New times are computed here rather than with SQL date arithmetic, which differs per database;
+        # the ORM sends them as one executemany UPDATE keyed by primary key
+        updated_at = datetime.utcnow()
+        db.session.execute(db.update(Session), [
+            {'id': row['id'], 'start_time': row['start_time'], 'end_time': row['end_time'], 'updated_at': updated_at}
+            for row in applied
+        ])
+        refresh_patient_summaries(db.session.connection(), {row['row'].patient_id for row in applied})
+        mark_stale_hours(db.session.connection(), [row['row'].start_time for row in applied]) # The hours they left
+        note_session_changes(db.session, [_change_record(row['row'], start_time=row['start_time']) for row in applied])
+    return _summary('reschedule', rows, [row['id'] for row in applied], skipped, dry_run)
@@ -0,0 +1,31 @@
+import os
+
+import click
+
+from . import sessions_cli
+from .importer import import_sessions
+from .. import db
+from ..spreadsheets import open_table
+
+@sessions_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--dry-run', is_flag=True, help='Check the schedule for errors and double bookings without importing.')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows resolved and inserted per batch.')
+def import_command(path, dry_run, batch_size):
+    """Imports sessions from a CSV or XLSX schedule with a header row."""
+    with open(path, 'rb') as stream:
+        try:
+            _, rows = open_table(stream, os.path.basename(path))
+            result = import_sessions(rows, dry_run=dry_run, batch_size=batch_size)
+        except ValueError as e:
+            db.session.rollback()
+            raise click.ClickException(str(e))
+    db.session.commit()
+
+    for error in result['errors']:
+        click.echo(f"Row {error['row']}: " + '; '.join(f'{field}: {message}' for field, message in error['errors'].items()))
+    for conflict in result['conflicts']:
+        click.echo(f"Row {conflict['row']}: {conflict['reason']}")
+    verb = 'Would import' if dry_run else 'Imported'
+    click.echo(f"{verb} {result['imported']} of {result['rows']} rows; "
+               f"{len(result['conflicts'])} double bookings, {len(result['errors'])} invalid.")
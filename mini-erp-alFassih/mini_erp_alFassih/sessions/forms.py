@@ -1,5 +1,6 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, TextAreaField, SubmitField, SelectField
+from flask_wtf.file import FileField, FileRequired, FileAllowed
+from wtforms import StringField, TextAreaField, SubmitField, SelectField, IntegerField, DateField, BooleanField
 from wtforms.fields import DateTimeLocalField # Corrected import for WTForms 3.x
 from wtforms.validators import DataRequired, Optional, ValidationError
 from wtforms_sqlalchemy.fields import QuerySelectField
@@ -9,11 +10,21 @@ from .. import models # Use .. to import models from parent package (app level)
 def patient_query():
     return models.Patient.query
 
+def all_therapists_query(): # For SessionFilterForm, inactive therapists still have historical sessions
+    return models.Therapist.query.order_by(models.Therapist.last_name, models.Therapist.first_name)
+
 def therapist_query(): # For SessionForm
     # Select Therapist profiles whose associated User is active and has 'therapist' role
     return models.Therapist.query.join(models.User, models.Therapist.user_id == models.User.id)\
                                       .filter(models.User.is_active == True, models.User.role == 'therapist')
 
+SESSION_STATUS_CHOICES = [
+    ('Scheduled', 'Scheduled'),
+    ('Completed', 'Completed'),
+    ('Cancelled', 'Cancelled'),
+    ('No Show', 'No Show')
+]
+
 class SessionForm(FlaskForm):
     patient = QuerySelectField(
         'Patient',
@@ -32,12 +43,7 @@ class SessionForm(FlaskForm):
     start_time = DateTimeLocalField('Start Time', format='%Y-%m-%dT%H:%M', validators=[DataRequired()])
     end_time = DateTimeLocalField('End Time', format='%Y-%m-%dT%H:%M', validators=[DataRequired()])
     session_type = StringField('Session Type (e.g., Consultation, Follow-up)', validators=[Optional()])
-    status = SelectField('Status', choices=[
-        ('Scheduled', 'Scheduled'),
-        ('Completed', 'Completed'),
-        ('Cancelled', 'Cancelled'),
-        ('No Show', 'No Show')
-    ], validators=[DataRequired()])
+    status = SelectField('Status', choices=SESSION_STATUS_CHOICES, validators=[DataRequired()])
     notes = TextAreaField('Notes', validators=[Optional()])
     submit = SubmitField('Save Session')
 
@@ -45,3 +51,33 @@ class SessionForm(FlaskForm):
         if self.start_time.data and field.data: # Ensure both fields have data
             if field.data <= self.start_time.data:
                 raise ValidationError('End time must be after start time.')
+
+class SessionFilterForm(FlaskForm):
+    """GET filters for the sessions list; read from the query string, so no CSRF token."""
+    class Meta:
+        csrf = False
+
+    status = SelectField('Status', choices=[('', 'Any status')] + SESSION_STATUS_CHOICES, validators=[Optional()])
+    therapist = QuerySelectField(
+        'Therapist',
+        query_factory=all_therapists_query,
+        get_label=lambda t: f"{t.first_name} {t.last_name}",
+        allow_blank=True,
+        blank_text='Any therapist',
+        validators=[Optional()]
+    )
+    patient_id = IntegerField('Patient ID', validators=[Optional()])
+    date_from = DateField('From', validators=[Optional()])
+    date_to = DateField('To', validators=[Optional()])
+
+    def validate_date_to(self, field):
+        if self.date_from.data and field.data and field.data < self.date_from.data:
+            raise ValidationError('End date must not be before start date.')
+
+class SessionImportForm(FlaskForm):
+    file = FileField('Schedule (CSV or XLSX)', validators=[
+        FileRequired(),
+        FileAllowed(['csv', 'xlsx'], 'Allowed file types: CSV, XLSX')
+    ])
+    dry_run = BooleanField('Check only (import nothing)')
+    submit = SubmitField('Import Sessions')
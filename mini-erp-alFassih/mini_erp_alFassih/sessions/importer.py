@@ -0,0 +1,268 @@
+"""
+Bulk session import from a CSV or XLSX schedule (e.g. a transcribed paper agenda).
+
+Columns (headers as in spreadsheets.normalize_header):
+    patient_id, or patient_first_name + patient_last_name [+ patient_date_of_birth]
+    therapist_id, or therapist_first_name + therapist_last_name
+    start_time, and end_time or duration_minutes
+    session_type, status (default Scheduled), notes
+
+1. Every row is parsed and checked like SessionForm would (required fields,
+   known status, end after start).
+2. Patients and therapists are resolved through dictionaries: all therapists
+   are loaded once; patients are looked up a batch at a time by id or by the
+   indexed Patient.match_key (matching.py), each distinct name only once.
+3. Scheduled rows are checked for double bookings per therapist and per
+   patient: against existing scheduled sessions (one window query, then a
+   bisect per row) and against each other in one sweep over the rows sorted
+   by start time.
+4. Accepted rows are inserted with one executemany per batch.
+
+Rejected rows are reported with their line numbers. The caller owns the
+transaction and commits once; with dry_run nothing is written.
+"""
+
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import datetime, timedelta
+from itertools import islice
+
+from .forms import SESSION_STATUS_CHOICES
+from .. import db
+from ..matching import patient_match_key, match_key_startswith
+from ..models import Patient, Therapist, Session
+from ..signals import note_row_counts, note_session_changes
+from ..spreadsheets import EXCEL_EPOCH
+from ..summaries import refresh_patient_summaries
+
+STATUSES = {value.casefold(): value for value, _ in SESSION_STATUS_CHOICES}
+
+# Besides ISO 8601 (which covers the form's %Y-%m-%dT%H:%M)
+DATETIME_FORMATS = ('%d/%m/%Y %H:%M', '%d/%m/%Y %H:%M:%S')
+
+def _text(value):
+    if value is None:
+        return ''
+    return str(int(value)) if isinstance(value, float) and value.is_integer() else str(value).strip()
+
+def _parse_datetime(value):
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, (int, float)): # An Excel date-time cell: days since the epoch, time as the fraction
+        return datetime.combine(EXCEL_EPOCH, datetime.min.time()) + timedelta(days=value)
+    try:
+        return datetime.fromisoformat(value).replace(tzinfo=None, second=0, microsecond=0)
+    except ValueError:
+        pass
+    for pattern in DATETIME_FORMATS:
+        try:
+            return datetime.strptime(value, pattern)
+        except ValueError:
+            pass
+    raise ValueError(value)
+
+def _parse_date(value):
+    if isinstance(value, (int, float)): # An Excel date cell
+        return EXCEL_EPOCH + timedelta(days=int(value))
+    return datetime.strptime(_text(value), '%Y-%m-%d').date()
+
+def _person_ref(record, prefix, with_birth_date):
+    """('id', n), ('key', match key) or ('name', match key without birth date) for the patient or
+    therapist columns; None when they are missing. Raises ValueError for unreadable values.
+    """
+    if _text(record.get(f'{prefix}_id')):
+        return ('id', int(_text(record[f'{prefix}_id'])))
+    first, last = _text(record.get(f'{prefix}_first_name')), _text(record.get(f'{prefix}_last_name'))
+    if not (first and last):
+        return None
+    if with_birth_date and _text(record.get(f'{prefix}_date_of_birth')):
+        return ('key', patient_match_key(first, last, _parse_date(record[f'{prefix}_date_of_birth'])))
+    return ('name', patient_match_key(first, last, None))
+
+def _parse(line, record):
+    """Returns (candidate, errors) for one row."""
+    candidate, errors = {'line': line}, {}
+    for prefix, with_birth_date in (('patient', True), ('therapist', False)):
+        try:
+            ref = _person_ref(record, prefix, with_birth_date)
+        except (TypeError, ValueError, OverflowError):
+            errors[prefix] = f'Not a valid {prefix} id or date of birth.'
+            continue
+        if ref is None:
+            errors[prefix] = f'Give {prefix}_id or {prefix}_first_name and {prefix}_last_name.'
+        else:
+            candidate[f'{prefix}_ref'] = ref
+
+    for name in ('start_time', 'end_time'):
+        if _text(record.get(name)):
+            try:
+                candidate[name] = _parse_datetime(record[name])
+            except (TypeError, ValueError, OverflowError):
+                errors[name] = 'Not a valid datetime value.'
+    if 'start_time' not in candidate and 'start_time' not in errors:
+        errors['start_time'] = 'This field is required.'
+    if 'start_time' in candidate and 'end_time' not in candidate and 'end_time' not in errors:
+        duration = _text(record.get('duration_minutes'))
+        try:
+            candidate['end_time'] = candidate['start_time'] + timedelta(minutes=float(duration))
+        except (TypeError, ValueError, OverflowError):
+            errors['end_time'] = 'Not a valid duration.' if duration else 'Give end_time or duration_minutes.'
+    if 'start_time' in candidate and 'end_time' in candidate and candidate['end_time'] <= candidate['start_time']:
+        errors['end_time'] = 'End time must be after start time.'
+
+    candidate['status'] = STATUSES.get((_text(record.get('status')) or 'Scheduled').casefold())
+    if candidate['status'] is None:
+        errors['status'] = 'Not a valid choice.'
+    candidate['session_type'] = _text(record.get('session_type')) or None
+    candidate['notes'] = _text(record.get('notes')) or None
+    max_length = Session.__table__.c.session_type.type.length
+    if candidate['session_type'] and len(candidate['session_type']) > max_length:
+        errors['session_type'] = f'Field cannot be longer than {max_length} characters.'
+    return candidate, errors
+
+class _Directory:
+    """Resolves patient and therapist references to ids, querying each distinct reference once."""
+
+    def __init__(self):
+        self.therapists = {} # ref -> (id, error)
+        for therapist in db.session.execute(db.select(Therapist.id, Therapist.first_name, Therapist.last_name)):
+            self.therapists[('id', therapist.id)] = (therapist.id, None)
+            ref = ('name', patient_match_key(therapist.first_name, therapist.last_name, None))
+            self.therapists[ref] = (None, 'Several therapists have this name; use therapist_id.') \
+                if ref in self.therapists else (therapist.id, None)
+        self.patients = {}
+
+    def therapist(self, ref):
+        return self.therapists.get(ref, (None, 'No such therapist.'))
+
+    def load_patients(self, refs):
+        refs = {ref for ref in refs if ref not in self.patients}
+        ids = [value for kind, value in refs if kind == 'id']
+        keys = [value for kind, value in refs if kind == 'key']
+        prefixes = [value for kind, value in refs if kind == 'name']
+        found = defaultdict(list)
+        if ids:
+            for (patient_id,) in db.session.execute(db.select(Patient.id).where(Patient.id.in_(ids))):
+                found[('id', patient_id)].append(patient_id)
+        if keys:
+            for row in db.session.execute(db.select(Patient.id, Patient.match_key).where(Patient.match_key.in_(keys))):
+                found[('key', row.match_key)].append(row.id)
+        for start in range(0, len(prefixes), 100):
+            chunk = prefixes[start:start + 100]
+            # Keys are 'last|first|birth date'; a key prefix finds the name with any birth date on the index
+            ranges = [match_key_startswith(prefix) for prefix in chunk]
+            for row in db.session.execute(db.select(Patient.id, Patient.match_key).where(db.or_(*ranges))):
+                found[('name', row.match_key.rsplit('|', 1)[0] + '|')].append(row.id)
+        for ref in refs:
+            matches = found.get(ref, [])
+            if len(matches) == 1:
+                self.patients[ref] = (matches[0], None)
+            elif matches:
+                self.patients[ref] = (None, 'Several patients have this name; add patient_date_of_birth or use patient_id.')
+            else:
+                self.patients[ref] = (None, 'No such patient.')
+
+    def patient(self, ref):
+        return self.patients[ref]
+
+def _describe(other):
+    return f"row {other['line']}" if 'line' in other else f"session {other['id']}"
+
+def _find_overlaps(candidates, existing, owner):
+    """Sets candidate['conflict'] for Scheduled candidates that overlap an existing session of the same owner
+    (therapist_id or patient_id) or an earlier-starting accepted candidate.
+    """
+    booked = defaultdict(list)
+    for row in existing:
+        booked[getattr(row, owner)].append({'id': row.id, 'start_time': row.start_time, 'end_time': row.end_time})
+    pending = defaultdict(list)
+    for candidate in candidates:
+        if candidate['status'] == 'Scheduled' and 'conflict' not in candidate:
+            pending[candidate[owner]].append(candidate)
+
+    label = 'Therapist' if owner == 'therapist_id' else 'Patient'
+    for owner_id, rows in pending.items():
+        # Existing sessions: starts sorted, with the running maximum end (and whose it is) for a bisect per row
+        sessions = sorted(booked.get(owner_id, []), key=lambda session: session['start_time'])
+        starts = [session['start_time'] for session in sessions]
+        latest, running = [], None
+        for session in sessions:
+            if running is None or session['end_time'] > running['end_time']:
+                running = session
+            latest.append(running)
+
+        # Rows: one sweep in start order, remembering the accepted row that ends last
+        last_accepted = None
+        for row in sorted(rows, key=lambda row: (row['start_time'], row['line'])):
+            index = bisect_left(starts, row['end_time'])
+            if index and latest[index - 1]['end_time'] > row['start_time']:
+                row['conflict'] = f'{label} already has {_describe(latest[index - 1])} at this time.'
+            elif last_accepted is not None and last_accepted['end_time'] > row['start_time']:
+                row['conflict'] = f'{label} is already booked by {_describe(last_accepted)}.'
+            elif last_accepted is None or row['end_time'] > last_accepted['end_time']:
+                last_accepted = row
+
+def import_sessions(rows, dry_run=False, batch_size=1000):
+    """Imports (line, record) rows as returned by spreadsheets.open_table and reports the outcome."""
+    result = {'rows': 0, 'imported': 0, 'errors': [], 'conflicts': [], 'dry_run': dry_run}
+    directory = _Directory()
+    candidates = []
+
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        result['rows'] += len(batch)
+        parsed = [_parse(line, record) for line, record in batch]
+        directory.load_patients(candidate['patient_ref'] for candidate, _ in parsed if 'patient_ref' in candidate)
+        for candidate, errors in parsed:
+            for prefix, resolve in (('patient', directory.patient), ('therapist', directory.therapist)):
+                if f'{prefix}_ref' in candidate:
+                    candidate[f'{prefix}_id'], error = resolve(candidate.pop(f'{prefix}_ref'))
+                    if error:
+                        errors[prefix] = error
+            if errors:
+                result['errors'].append({'row': candidate['line'], 'errors': errors})
+            else:
+                candidates.append(candidate)
+
+    scheduled = [candidate for candidate in candidates if candidate['status'] == 'Scheduled']
+    if scheduled:
+        # One query fetches every scheduled session the new rows could collide with
+        existing = db.session.execute(
+            db.select(Session.id, Session.patient_id, Session.therapist_id, Session.start_time, Session.end_time)
+            .where(Session.status == 'Scheduled',
+                   Session.start_time < max(row['end_time'] for row in scheduled),
+                   Session.end_time > min(row['start_time'] for row in scheduled),
+                   db.or_(Session.therapist_id.in_({row['therapist_id'] for row in scheduled}),
+                          Session.patient_id.in_({row['patient_id'] for row in scheduled})))
+        ).all()
+        _find_overlaps(candidates, existing, 'therapist_id')
+        _find_overlaps(candidates, existing, 'patient_id')
+
+    accepted = []
+    for candidate in candidates:
+        if 'conflict' in candidate:
+            result['conflicts'].append({'row': candidate['line'], 'reason': candidate['conflict']})
+        else:
+            accepted.append(candidate)
+    result['conflicts'].sort(key=lambda conflict: conflict['row'])
+    result['imported'] = len(accepted)
+    if dry_run or not accepted:
+        return result
+
+    columns = ('patient_id', 'therapist_id', 'start_time', 'end_time', 'session_type', 'status', 'notes')
+    insert = Session.__table__.insert().returning(Session.__table__.c.id, sort_by_parameter_order=True)
+    changes = []
+    for start in range(0, len(accepted), batch_size):
+        chunk = accepted[start:start + batch_size]
+        ids = db.session.execute(insert, [{name: row[name] for name in columns} for row in chunk]).scalars().all()
+        changes.extend({'id': session_id, 'kind': 'created', 'patient_id': row['patient_id'],
+                        'therapist_id': row['therapist_id'], 'start_time': row['start_time'], 'status': row['status']}
+                       for session_id, row in zip(ids, chunk))
+    # Set-based inserts bypass the flush hooks, so refresh summaries and queue change signals here
+    refresh_patient_summaries(db.session.connection(), {row['patient_id'] for row in accepted})
+    note_session_changes(db.session, changes)
+    note_row_counts(db.session, {'sessions': len(accepted)})
+    return result
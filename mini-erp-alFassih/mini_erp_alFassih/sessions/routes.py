@@ -1,20 +1,101 @@
-from flask import render_template, request, redirect, url_for, jsonify, flash
+from flask import render_template, request, redirect, url_for, jsonify, flash, current_app, abort, stream_with_context
 from flask_login import login_required
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from . import sessions_bp
-from .forms import SessionForm
+from .forms import SessionForm, SessionFilterForm, SessionImportForm
+from .bulk import STATUS_ACTIONS, bulk_set_status, bulk_reschedule
+from .importer import import_sessions
 from ..models import Session, Patient, Therapist # Use .. for parent package models
 from .. import db # Use .. for parent package db
+from ..schedule import daily_schedule
+from ..calendar_feed import feed_window, feed_validator, therapist_calendars
+from ..spreadsheets import open_table
+from ..replicas import read_replica
+from ..querystats import query_budget
+
+def _apply_session_filters(query, status=None, therapist_id=None, patient_id=None, date_from=None, date_to=None):
+    """Narrows a Session query; each filter lines up with an index on session.
+    date_from/date_to are dates and the range includes both days.
+    """
+    if status:
+        query = query.filter(Session.status == status)
+    if therapist_id:
+        query = query.filter(Session.therapist_id == therapist_id)
+    if patient_id:
+        query = query.filter(Session.patient_id == patient_id)
+    if date_from:
+        query = query.filter(Session.start_time >= datetime.combine(date_from, datetime.min.time()))
+    if date_to:
+        query = query.filter(Session.start_time < datetime.combine(date_to + timedelta(days=1), datetime.min.time()))
+    return query
+
+def _encode_cursor(session):
+    return f"{session.start_time.isoformat()}_{session.id}"
+
+def _decode_cursor(cursor):
+    """Parses a '<start_time>_<id>' keyset cursor; returns None if it is malformed."""
+    try:
+        start_time, session_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(start_time), int(session_id)
+    except (AttributeError, ValueError):
+        return None
 
 @sessions_bp.route('/') # Corresponds to /sessions/
 @login_required
+@read_replica
+@query_budget(5)
 def list_sessions():
-    sessions = Session.query.options(
+    form = SessionFilterForm(request.args)
+    filters = {}
+    if form.validate():
+        filters = dict(
+            status=form.status.data or None,
+            therapist_id=form.therapist.data.id if form.therapist.data else None,
+            patient_id=form.patient_id.data,
+            date_from=form.date_from.data,
+            date_to=form.date_to.data,
+        )
+
+    per_page = current_app.config.get('SESSIONS_PER_PAGE', 50)
+    query = _apply_session_filters(Session.query, **filters).options(
         db.joinedload(Session.assigned_patient),
         db.joinedload(Session.assigned_therapist)
-    ).order_by(Session.start_time.desc()).all()
-    return render_template('sessions/sessions_list.html', sessions=sessions, title='All Sessions', year=datetime.now().year)
+    )
+
+    # Keyset pagination on (start_time, id), newest first: the cost of a page does not depend on its depth
+    before = _decode_cursor(request.args.get('before'))
+    after = _decode_cursor(request.args.get('after'))
+    if after:
+        start_time, session_id = after
+        rows = query.filter(db.or_(
+            Session.start_time > start_time,
+            db.and_(Session.start_time == start_time, Session.id > session_id)
+        )).order_by(Session.start_time.asc(), Session.id.asc()).limit(per_page + 1).all()
+        has_newer, has_older = len(rows) > per_page, True
+        sessions = list(reversed(rows[:per_page]))
+    else:
+        if before:
+            start_time, session_id = before
+            query = query.filter(db.or_(
+                Session.start_time < start_time,
+                db.and_(Session.start_time == start_time, Session.id < session_id)
+            ))
+        rows = query.order_by(Session.start_time.desc(), Session.id.desc()).limit(per_page + 1).all()
+        has_newer, has_older = before is not None, len(rows) > per_page
+        sessions = rows[:per_page]
+
+    # Filter values are carried over into the paging links
+    filter_args = {key: value for key, value in request.args.items() if key not in ('before', 'after') and value}
+    newer_url = older_url = None
+    if sessions and has_newer:
+        newer_url = url_for('sessions.list_sessions', after=_encode_cursor(sessions[0]), **filter_args)
+    if sessions and has_older:
+        older_url = url_for('sessions.list_sessions', before=_encode_cursor(sessions[-1]), **filter_args)
+
+    return render_template('sessions/sessions_list.html', sessions=sessions, form=form,
+                           newer_url=newer_url, older_url=older_url,
+                           title='All Sessions', year=datetime.now().year)
 
 @sessions_bp.route('/new', methods=['GET', 'POST']) # Corresponds to /sessions/new
 @login_required
@@ -43,6 +124,28 @@ def create_session():
         return redirect(url_for('sessions.list_sessions'))
     return render_template('sessions/session_form.html', form=form, title='Schedule New Session', year=datetime.now().year)
 
+@sessions_bp.route('/import', methods=['GET', 'POST']) # Corresponds to /sessions/import
+@login_required
+def import_sessions_view():
+    form = SessionImportForm()
+    result = None
+    if form.validate_on_submit():
+        upload = form.file.data
+        try:
+            _, rows = open_table(upload.stream, upload.filename)
+            result = import_sessions(rows, dry_run=form.dry_run.data,
+                                     batch_size=current_app.config.get('SESSION_IMPORT_BATCH_SIZE', 1000))
+        except ValueError as e:
+            db.session.rollback()
+            flash(f'The file could not be imported: {e}', 'danger')
+        else:
+            db.session.commit()
+            if not result['dry_run']:
+                flash(f"Imported {result['imported']} sessions.", 'success')
+    return render_template('sessions/session_import.html', form=form, result=result,
+                           max_listed=current_app.config.get('IMPORT_MAX_LISTED', 200),
+                           title='Import Sessions', year=datetime.now().year)
+
 @sessions_bp.route('/<int:session_id>') # Corresponds to /sessions/<id>
 @login_required
 def view_session(session_id):
@@ -79,3 +182,115 @@ def cancel_session(session_id):
     session.status = 'Cancelled'
     db.session.commit()
     return jsonify(success=True, message='Session cancelled successfully.', new_status='Cancelled', session_id=session_id), 200
+
+def _parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+
+@sessions_bp.route('/bulk/<action>', methods=['POST']) # Corresponds to /sessions/bulk/cancel|complete|reschedule
+@login_required
+def bulk_sessions(action):
+    """Applies one action to many sessions in a single transaction.
+    The JSON (or form) body selects sessions either by 'session_ids' or by 'therapist_id'
+    plus an inclusive 'date_from'/'date_to' range; reschedule also takes 'shift_minutes'.
+    'dry_run' reports the outcome without writing anything.
+    """
+    if action not in STATUS_ACTIONS and action != 'reschedule':
+        return jsonify(success=False, message=f'Unknown bulk action: {action}.'), 404
+
+    payload = request.get_json(silent=True)
+    if payload is None: # Plain form posts send repeated session_ids fields
+        payload = request.form.to_dict()
+        payload['session_ids'] = request.form.getlist('session_ids')
+    dry_run = str(payload.get('dry_run', '')).lower() in ('1', 'true', 'yes', 'on')
+
+    try:
+        session_ids = [int(session_id) for session_id in payload.get('session_ids') or []]
+        if session_ids:
+            selection = db.select(Session.id).where(Session.id.in_(session_ids))
+        else:
+            therapist_id = int(payload.get('therapist_id') or 0)
+            date_from, date_to = _parse_date(payload.get('date_from')), _parse_date(payload.get('date_to'))
+            # A filter selection must be bounded so a bad request cannot touch the whole table
+            if not (therapist_id and date_from and date_to):
+                return jsonify(success=False, message='Select sessions by session_ids, or by therapist_id with date_from and date_to.'), 400
+            selection = _apply_session_filters(db.select(Session.id), therapist_id=therapist_id,
+                                               date_from=date_from, date_to=date_to)
+        if action == 'reschedule':
+            shift_minutes = int(payload.get('shift_minutes') or 0)
+            if not shift_minutes:
+                return jsonify(success=False, message='shift_minutes must be a non-zero number of minutes.'), 400
+    except (TypeError, ValueError):
+        return jsonify(success=False, message='Invalid session ids, therapist, dates or shift.'), 400
+
+    try:
+        if action == 'reschedule':
+            result = bulk_reschedule(selection, timedelta(minutes=shift_minutes), dry_run=dry_run)
+        else:
+            result = bulk_set_status(selection, action, dry_run=dry_run)
+        if dry_run:
+            db.session.rollback()
+        else:
+            db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f'Bulk session {action} failed: {e}')
+        return jsonify(success=False, message=f'Error applying bulk {action}: {e}'), 500
+
+    verb = 'would be updated' if dry_run else 'updated'
+    message = f"{result['updated']} of {result['matched']} sessions {verb}; {len(result['skipped'])} skipped."
+    return jsonify(success=True, message=message, **result), 200
+
+# Reception desk schedule, served from the in-memory daily schedule (see schedule.py)
+def _schedule_day(day):
+    if day == 'today':
+        return datetime.now().date() # Session times are local wall-clock times
+    try:
+        return datetime.strptime(day, '%Y-%m-%d').date()
+    except ValueError:
+        abort(404)
+
+def _conditional_response(body, etag, mimetype, last_modified=None):
+    """Wraps a cached body so clients revalidate every poll and get a 304 while it is unchanged."""
+    response = current_app.response_class(body, mimetype=mimetype)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    response.cache_control.private = True
+    return response.make_conditional(request)
+
+@sessions_bp.route('/schedule') # Corresponds to /sessions/schedule
+@sessions_bp.route('/schedule/<day>')
+@login_required
+@query_budget(4)
+def reception_schedule(day='today'):
+    schedule = daily_schedule.get(_schedule_day(day))
+    return render_template('sessions/reception_schedule.html', schedule=schedule,
+                           previous_day=schedule.day - timedelta(days=1), next_day=schedule.day + timedelta(days=1),
+                           poll_seconds=current_app.config.get('SCHEDULE_POLL_SECONDS', 15),
+                           title='Reception Schedule', year=datetime.now().year)
+
+@sessions_bp.route('/schedule/<day>.json')
+@login_required
+def reception_schedule_json(day):
+    schedule = daily_schedule.get(_schedule_day(day))
+    return _conditional_response(schedule.json, schedule.etag, 'application/json')
+
+@sessions_bp.route('/schedule/<day>/fragment')
+@login_required
+def reception_schedule_fragment(day):
+    schedule = daily_schedule.get(_schedule_day(day))
+    if schedule.fragment is None: # Rendered once per schedule version, then reused by every poll
+        schedule.fragment = render_template('sessions/_schedule_fragment.html', schedule=schedule)
+    return _conditional_response(schedule.fragment, schedule.etag, 'text/html')
+
+@sessions_bp.route('/calendar/<token>.ics') # No login: calendar apps authenticate with the secret token
+@read_replica
+def therapist_calendar(token):
+    therapist = Therapist.query.filter_by(calendar_token=token).first_or_404()
+    window = feed_window(datetime.now().date(), current_app.config.get('CALENDAR_PAST_DAYS', 30),
+                         current_app.config.get('CALENDAR_FUTURE_DAYS', 180))
+    etag, last_modified = feed_validator(therapist.id, window)
+    body = therapist_calendars.cached_body(therapist.id, etag)
+    if body is None:
+        body = stream_with_context(therapist_calendars.stream(therapist, window, etag))
+    return _conditional_response(body, etag, 'text/calendar', last_modified)
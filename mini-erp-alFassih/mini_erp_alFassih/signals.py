@@ -0,0 +1,99 @@
+"""
+Application signals fired after data changes are committed.
+
+Flush hooks record which sessions (and which patient/therapist names) changed in
+the current transaction; once it commits, `sessions_changed` is sent with those
+records so caches and live views can patch themselves, and `counters_changed`
+is sent with the net number of rows created or deleted per table. Rolled-back
+work is never announced. Set-based writes that bypass the flush call `note_session_changes`
+and `note_row_counts`.
+"""
+
+from blinker import Namespace
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session as OrmSession
+
+from .models import Patient, Therapist, Document, Session
+
+_signals = Namespace()
+
+# Sent with changes=[{'id', 'kind', 'patient_id', 'therapist_id', 'start_time', 'status'}, ...]
+# and renamed={'patients': set(ids), 'therapists': set(ids)}
+sessions_changed = _signals.signal('sessions-changed')
+
+# Sent with deltas={'patients': n, 'documents': n, ...}: rows created minus rows deleted, non-zero entries only
+counters_changed = _signals.signal('counters-changed')
+
+# Models whose row counts appear on the admin dashboard
+COUNTED_MODELS = {
+    Patient: 'patients',
+    Therapist: 'therapists',
+    Document: 'documents',
+    Session: 'sessions',
+}
+
+def _pending(session):
+    return session.info.setdefault('pending_session_changes',
+                                   {'changes': {}, 'patients': set(), 'therapists': set(), 'counts': {}})
+
+def _record(obj, kind):
+    return {
+        'id': obj.id,
+        'kind': kind,
+        'patient_id': obj.patient_id,
+        'therapist_id': obj.therapist_id,
+        'start_time': obj.start_time,
+        'status': obj.status,
+    }
+
+def note_session_changes(session, records):
+    """Queues change records (same keys as the signal payload) for the current transaction."""
+    changes = _pending(session)['changes']
+    for record in records:
+        # A session created and then edited in one transaction is still announced as created
+        if record['id'] in changes and changes[record['id']]['kind'] == 'created' and record['kind'] == 'updated':
+            record = dict(record, kind='created')
+        changes[record['id']] = record
+
+def note_row_counts(session, deltas):
+    """Adds rows created (positive) or deleted (negative) per COUNTED_MODELS name to the current transaction."""
+    counts = _pending(session)['counts']
+    for name, delta in deltas.items():
+        counts[name] = counts.get(name, 0) + delta
+
+@event.listens_for(OrmSession, 'after_flush')
+def _collect_session_changes(session, flush_context):
+    records = []
+    for kind, objects in (('created', session.new), ('updated', session.dirty), ('deleted', session.deleted)):
+        for obj in objects:
+            if kind != 'updated' and type(obj) in COUNTED_MODELS:
+                note_row_counts(session, {COUNTED_MODELS[type(obj)]: 1 if kind == 'created' else -1})
+            if isinstance(obj, Session) and (kind != 'updated' or session.is_modified(obj)):
+                records.append(_record(obj, kind))
+            elif kind == 'updated' and isinstance(obj, (Patient, Therapist)):
+                state = inspect(obj)
+                if state.attrs.first_name.history.has_changes() or state.attrs.last_name.history.has_changes():
+                    _pending(session)['patients' if isinstance(obj, Patient) else 'therapists'].add(obj.id)
+    if records:
+        note_session_changes(session, records)
+
+@event.listens_for(OrmSession, 'after_commit')
+def _send_session_changes(session):
+    pending = session.info.pop('pending_session_changes', None)
+    if not pending:
+        return
+    sender = current_app._get_current_object() if has_app_context() else None
+    if pending['changes'] or pending['patients'] or pending['therapists']:
+        sessions_changed.send(
+            sender,
+            changes=list(pending['changes'].values()),
+            renamed={'patients': pending['patients'], 'therapists': pending['therapists']},
+        )
+    deltas = {name: delta for name, delta in pending['counts'].items() if delta}
+    if deltas:
+        counters_changed.send(sender, deltas=deltas)
+
+@event.listens_for(OrmSession, 'after_rollback')
+def _discard_session_changes(session):
+    session.info.pop('pending_session_changes', None)
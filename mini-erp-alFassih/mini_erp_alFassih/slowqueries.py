@@ -0,0 +1,208 @@
+"""
+Slow query log.
+
+Any statement taking SLOW_QUERY_THRESHOLD_MS or longer (timed by the cursor
+events in querystats.py) is queued together with the endpoint that issued it
+and the shape of its bound parameters: their types and string lengths, never
+the values, which hold patient data. A background thread then asks the same
+database how it runs the statement and appends one JSON line per slow query to
+SLOW_QUERY_LOG_PATH, rotated like the application log:
+
+- SQLite: EXPLAIN QUERY PLAN ("SCAN session" is a full table scan);
+- PostgreSQL: EXPLAIN, or EXPLAIN (ANALYZE, BUFFERS) for SELECTs when
+  SLOW_QUERY_EXPLAIN_ANALYZE is set; that runs the query a second time.
+
+The request never waits for the plan. A statement is explained at most once
+per SLOW_QUERY_EXPLAIN_INTERVAL seconds, and records arriving while the queue
+is full are dropped and counted. `flask slow-queries summary` groups the log by
+statement to show which ones to index first.
+
+Under TESTING no thread is started; call slow_queries.drain() to write the queue.
+"""
+
+import json
+import logging
+import os
+import queue
+import statistics
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+import click
+from flask import current_app, has_app_context, has_request_context, request
+from flask.cli import AppGroup
+
+LOGGER_NAME = 'mini_erp_alFassih.slow_queries'
+EXPLAINABLE = ('SELECT', 'WITH', 'UPDATE', 'DELETE', 'INSERT')
+
+def parameter_shape(parameters):
+    """Types of the bound parameters, e.g. "(int, str[7], datetime)"; values are left out."""
+    def shape(value):
+        if value is None:
+            return 'null'
+        if isinstance(value, (str, bytes)):
+            return f'{type(value).__name__}[{len(value)}]'
+        return type(value).__name__
+    if isinstance(parameters, dict):
+        return '{' + ', '.join(f'{key}: {shape(value)}' for key, value in parameters.items()) + '}'
+    return '(' + ', '.join(shape(value) for value in parameters or ()) + ')'
+
+def explain(engine, statement, parameters, analyze=False):
+    """The database's plan for statement as a list of lines, or None if there is no EXPLAIN for it."""
+    verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ''
+    if verb not in EXPLAINABLE:
+        return None
+    if engine.dialect.name == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    elif engine.dialect.name == 'postgresql':
+        prefix = 'EXPLAIN (ANALYZE, BUFFERS) ' if analyze and verb == 'SELECT' else 'EXPLAIN '
+    else:
+        return None
+    with engine.connect().execution_options(slow_query_log=False) as connection:
+        rows = connection.exec_driver_sql(prefix + statement, parameters or ()).fetchall()
+        connection.rollback() # Nothing an ANALYZE touched is kept
+    if engine.dialect.name == 'sqlite': # (id, parent, notused, detail), indented by depth
+        depth = {0: -1}
+        lines = []
+        for row in rows:
+            depth[row[0]] = depth.get(row[1], -1) + 1
+            lines.append('  ' * depth[row[0]] + row[3])
+        return lines
+    return [row[0] for row in rows]
+
+class SlowQueryLog:
+    """Queue of slow statements, explained and written out by one background thread per process."""
+
+    def __init__(self, queue_size=1000):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self._explained = {} # statement -> monotonic time its plan was last captured
+        self._thread = None
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(LOGGER_NAME)
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+
+    def init_app(self, app):
+        path = app.config.get('SLOW_QUERY_LOG_PATH') or os.path.join(app.instance_path, 'slow_queries.log')
+        app.config['SLOW_QUERY_LOG_PATH'] = path
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+            handler.close()
+        if app.config.get('SLOW_QUERY_THRESHOLD_MS'):
+            handler = RotatingFileHandler(path, maxBytes=app.config.get('SLOW_QUERY_LOG_MAX_BYTES', 10485760),
+                                          backupCount=app.config.get('SLOW_QUERY_LOG_BACKUPS', 5), delay=True)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self.logger.addHandler(handler)
+        app.extensions['slow_queries'] = self
+
+    def observe(self, connection, statement, parameters, executemany, seconds):
+        """Called for every statement; queues the ones at or over the app's threshold."""
+        if not has_app_context():
+            return
+        config = current_app.config
+        threshold = config.get('SLOW_QUERY_THRESHOLD_MS')
+        if not threshold or seconds * 1000 < threshold or not connection.get_execution_options().get('slow_query_log', True):
+            return
+        if has_request_context():
+            endpoint, method = request.endpoint or request.path, request.method
+        else:
+            endpoint, method = 'background', None
+        if executemany: # One row's parameters stand for all of them
+            count, parameters = len(parameters), (parameters[0] if parameters else ())
+        record = {
+            'time': datetime.utcnow().isoformat(timespec='milliseconds'),
+            'endpoint': endpoint,
+            'method': method,
+            'duration_ms': round(seconds * 1000, 1),
+            'dialect': connection.dialect.name,
+            'statement': statement,
+            'parameters': parameter_shape(parameters),
+            'executemany': count if executemany else None,
+        }
+        item = (record, connection.engine, parameters, config.get('SLOW_QUERY_EXPLAIN_ANALYZE', False),
+                config.get('SLOW_QUERY_EXPLAIN_INTERVAL', 300))
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if not current_app.testing:
+            self._ensure_thread()
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='slow-query-log', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._write(self.queue.get())
+
+    def drain(self):
+        """Writes every queued record now; returns them."""
+        written = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                return written
+            written.append(self._write(item))
+
+    def _write(self, item):
+        record, engine, parameters, analyze, interval = item
+        now = time.monotonic()
+        last = self._explained.get(record['statement'])
+        if last is None or now - last >= interval:
+            if len(self._explained) >= 1000: # Statements with expanded IN lists are all distinct
+                self._explained.clear()
+            self._explained[record['statement']] = now
+            try:
+                record['plan'] = explain(engine, record['statement'], parameters, analyze)
+            except Exception as exc: # The plan is a bonus; the record is written without it
+                record['plan_error'] = str(exc).splitlines()[0]
+        self.logger.info(json.dumps(record))
+        return record
+
+slow_queries = SlowQueryLog()
+
+slow_queries_cli = AppGroup('slow-queries', help='Inspect the slow query log.')
+
+def _ms(value):
+    return f'{value:.0f} ms'
+
+def _full_scans(plan):
+    return [line.strip() for line in plan or () if line.strip().startswith(('SCAN ', 'Seq Scan'))]
+
+@slow_queries_cli.command('summary')
+@click.option('--top', default=20, show_default=True, help='Statements to list, slowest total time first.')
+def slow_queries_summary_command(top):
+    """Groups the slow query log by statement, with the endpoints and full table scans behind each."""
+    path = current_app.config['SLOW_QUERY_LOG_PATH']
+    paths = [f'{path}.{n}' for n in range(current_app.config.get('SLOW_QUERY_LOG_BACKUPS', 5), 0, -1)] + [path]
+    groups = defaultdict(lambda: {'durations': [], 'endpoints': set(), 'plan': None})
+    for log_path in paths:
+        if not os.path.exists(log_path):
+            continue
+        with open(log_path, encoding='utf-8') as log_file:
+            for line in log_file:
+                record = json.loads(line)
+                group = groups[' '.join(record['statement'].split())]
+                group['durations'].append(record['duration_ms'])
+                group['endpoints'].add(record['endpoint'])
+                group['plan'] = record.get('plan') or group['plan']
+    if not groups:
+        click.echo(f'No slow queries logged in {path}.')
+        return
+    ranked = sorted(groups.items(), key=lambda item: sum(item[1]['durations']), reverse=True)
+    for statement, group in ranked[:top]:
+        durations = group['durations']
+        click.echo(f"{len(durations)} x, median {_ms(statistics.median(durations))}, "
+                   f"max {_ms(max(durations))} - {', '.join(sorted(group['endpoints']))}")
+        click.echo(f'  {statement[:300]}')
+        for scan in _full_scans(group['plan']):
+            click.echo(f'  full scan: {scan}')
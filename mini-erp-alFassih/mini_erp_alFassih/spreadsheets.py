@@ -0,0 +1,141 @@
+"""
+Reading uploaded CSV and XLSX files a row at a time.
+
+open_table yields (row_number, {column: value}) without loading the file: CSV
+through the csv module, XLSX by iterparsing the first worksheet out of the zip
+and clearing each row once it is yielded. Only the shared-string table of an
+XLSX file is kept in memory. Column headers are normalized with
+normalize_header, so 'Date of Birth' and 'date_of_birth' are the same column.
+
+XLSX numbers arrive as int/float; a date typed into Excel is a serial day
+number, which excel_date converts.
+"""
+
+import csv
+import io
+import posixpath
+import re
+import zipfile
+from datetime import date, timedelta
+from xml.etree import ElementTree
+
+MAIN = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+RELATIONSHIPS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+OFFICE_RELATIONSHIPS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+
+EXCEL_EPOCH = date(1899, 12, 30) # Day 0 of Excel's 1900 date system, allowing for its 1900 leap-year bug
+
+class SpreadsheetError(ValueError):
+    """The upload cannot be read as a table."""
+
+def normalize_header(value):
+    return re.sub(r'\W+', '_', str(value or '').strip().casefold()).strip('_')
+
+def excel_date(serial):
+    return EXCEL_EPOCH + timedelta(days=int(serial))
+
+def _csv_rows(stream):
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    reader = csv.reader(text)
+    try:
+        for row in reader:
+            yield reader.line_num, row
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise SpreadsheetError(f'Line {reader.line_num + 1} could not be read: {e}') from e
+    finally:
+        text.detach() # The caller owns the binary stream; the wrapper would close it
+
+def _column_index(reference):
+    index = 0
+    for char in reference:
+        if not char.isalpha():
+            break
+        index = index * 26 + ord(char.upper()) - 64
+    return index - 1
+
+def _first_sheet_path(archive):
+    workbook = ElementTree.fromstring(archive.read('xl/workbook.xml'))
+    sheet = workbook.find(f'{MAIN}sheets/{MAIN}sheet')
+    if sheet is None:
+        raise SpreadsheetError('The workbook has no worksheets.')
+    relationship_id = sheet.get(f'{OFFICE_RELATIONSHIPS}id')
+    relationships = ElementTree.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+    for relationship in relationships.iter(f'{RELATIONSHIPS}Relationship'):
+        if relationship.get('Id') == relationship_id:
+            target = relationship.get('Target')
+            return target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('xl', target))
+    raise SpreadsheetError('The first worksheet could not be found in the workbook.')
+
+def _shared_strings(archive):
+    if 'xl/sharedStrings.xml' not in archive.namelist():
+        return []
+    strings = []
+    with archive.open('xl/sharedStrings.xml') as part:
+        for _, element in ElementTree.iterparse(part):
+            if element.tag == f'{MAIN}si':
+                # Plain text is a single <t>; rich text splits it into <r> runs. Phonetic hints (<rPh>) are skipped
+                strings.append(''.join(child.findtext(f'{MAIN}t', '') if child.tag == f'{MAIN}r' else child.text or ''
+                                       for child in element if child.tag in (f'{MAIN}t', f'{MAIN}r')))
+                element.clear()
+    return strings
+
+def _cell_value(cell, shared):
+    cell_type = cell.get('t')
+    if cell_type == 'inlineStr':
+        return ''.join(text.text or '' for text in cell.iter(f'{MAIN}t'))
+    raw = cell.findtext(f'{MAIN}v')
+    if raw is None:
+        return None
+    if cell_type == 's':
+        return shared[int(raw)]
+    if cell_type in ('str', 'e', 'b'):
+        return raw
+    number = float(raw)
+    return int(number) if number.is_integer() else number
+
+def _xlsx_rows(stream):
+    try:
+        archive = zipfile.ZipFile(stream)
+    except zipfile.BadZipFile as e:
+        raise SpreadsheetError('The file is not a valid XLSX workbook.') from e
+    with archive:
+        try:
+            shared = _shared_strings(archive)
+            with archive.open(_first_sheet_path(archive)) as sheet:
+                line = 0
+                for _, element in ElementTree.iterparse(sheet):
+                    if element.tag != f'{MAIN}row':
+                        continue
+                    line = int(element.get('r', line + 1))
+                    values = {}
+                    for position, cell in enumerate(element.iter(f'{MAIN}c')):
+                        reference = cell.get('r')
+                        values[_column_index(reference) if reference else position] = _cell_value(cell, shared)
+                    element.clear() # Keeps memory flat: processed rows are dropped from the tree
+                    yield line, [values.get(index) for index in range(max(values, default=-1) + 1)]
+        except (KeyError, ElementTree.ParseError) as e:
+            raise SpreadsheetError(f'The workbook could not be read: {e}') from e
+
+def _records(headers, rows):
+    for line, values in rows:
+        record = {header: value for header, value in zip(headers, values) if header}
+        if any(value not in (None, '') for value in record.values()):
+            yield line, record
+
+def open_table(stream, filename):
+    """Returns (headers, rows): the normalized headers from the first row, and an iterator of
+    (row_number, {header: value}) for every non-blank data row. Columns without a header are ignored.
+    """
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if extension == 'csv':
+        rows = _csv_rows(stream)
+    elif extension == 'xlsx':
+        rows = _xlsx_rows(stream)
+    else:
+        raise SpreadsheetError('Only .csv and .xlsx files can be imported.')
+    try:
+        _, first = next(rows)
+    except StopIteration:
+        raise SpreadsheetError('The file is empty.')
+    headers = [normalize_header(value) for value in first]
+    return headers, _records(headers, rows)
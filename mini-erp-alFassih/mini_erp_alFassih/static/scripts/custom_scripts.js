@@ -236,4 +236,179 @@ $(function () { // Ensure DOM is ready and jQuery is available
             });
         }
     });
+
+    // AJAX "Load More" for the patient detail session history
+    $('.btn-load-more-sessions').on('click', function(e) {
+        e.preventDefault(); // The href is a plain paging fallback when JS is unavailable
+        var $button = $(this);
+        var $target = $($button.data('target'));
+
+        $.ajax({
+            url: $button.data('url'),
+            type: 'GET',
+            success: function(rowsHtml, status, xhr) {
+                $target.append(rowsHtml);
+                // The server sends the next page URL only while older sessions remain
+                var nextUrl = xhr.getResponseHeader('X-Next-Page');
+                if (nextUrl) {
+                    $button.data('url', nextUrl);
+                } else {
+                    $button.closest('p').remove();
+                }
+            },
+            error: function(xhr, status, error) {
+                console.error("Error loading sessions:", status, error, xhr.responseText);
+                if (toastr) {
+                    toastr.error('Error loading more sessions. Please try again.');
+                } else {
+                    alert('Error loading more sessions. Please try again.');
+                }
+            }
+        });
+    });
+
+    // Bulk session actions on the sessions list: one POST for all selected rows
+    $('#bulk-select-all').on('change', function() {
+        $('.bulk-session-checkbox').prop('checked', $(this).prop('checked'));
+    });
+
+    $('.btn-bulk-sessions').on('click', function(e) {
+        e.preventDefault();
+        var action = $('#bulk-action').val();
+        var sessionIds = $('.bulk-session-checkbox:checked').map(function() { return $(this).val(); }).get();
+        if (!sessionIds.length) {
+            if (toastr) { toastr.warning('Select at least one session first.'); } else { alert('Select at least one session first.'); }
+            return;
+        }
+        var payload = {session_ids: sessionIds};
+        if (action === 'reschedule') {
+            payload.shift_minutes = $('#bulk-shift-minutes').val();
+        }
+        if (!confirm('Apply "' + $('#bulk-action option:selected').text() + '" to ' + sessionIds.length + ' session(s)?')) {
+            return;
+        }
+
+        $.ajax({
+            url: $(this).data('url-template').replace('__action__', action),
+            type: 'POST',
+            contentType: 'application/json',
+            data: JSON.stringify(payload),
+            // CSRF token is handled by ajaxSetup
+            success: function(response) {
+                var message = response.message || 'Bulk action completed.';
+                if (toastr) {
+                    (response.skipped && response.skipped.length ? toastr.warning : toastr.success)(message);
+                } else {
+                    alert(message);
+                }
+                setTimeout(function() { location.reload(); }, 1500); // Show the updated rows
+            },
+            error: function(xhr, status, error) {
+                console.error("Error applying bulk action:", status, error, xhr.responseText);
+                var errorMessage = 'Error applying bulk action. Please try again or check the console.';
+                if (xhr.responseJSON && xhr.responseJSON.message) {
+                    errorMessage = xhr.responseJSON.message;
+                }
+                if (toastr) {
+                    toastr.error(errorMessage);
+                } else {
+                    alert(errorMessage);
+                }
+            }
+        });
+    });
+
+    // Reception schedule polling: conditional GETs, so an unchanged schedule costs a 304
+    var $receptionSchedule = $('#reception-schedule');
+    if ($receptionSchedule.length) {
+        var scheduleEtag = $receptionSchedule.find('.reception-schedule').data('etag');
+        var pollSchedule = function() {
+            $.ajax({
+                url: $receptionSchedule.data('url'),
+                type: 'GET',
+                cache: false,
+                headers: scheduleEtag ? {'If-None-Match': '"' + scheduleEtag + '"'} : {},
+                success: function(html, status, xhr) {
+                    if (xhr.status === 200) {
+                        $receptionSchedule.html(html);
+                        scheduleEtag = $receptionSchedule.find('.reception-schedule').data('etag');
+                    }
+                },
+                error: function(xhr, status, error) {
+                    console.error("Error refreshing schedule:", status, error);
+                }
+            });
+        };
+        // Server-Sent Events announce changes as they are committed; polling is only the fallback
+        var scheduleLive = openLiveStream($receptionSchedule.data('live-url'), {
+            'session.created session.updated session.cancelled session.deleted schedule.renamed resync': debounce(pollSchedule, 500)
+        });
+        setInterval(function() {
+            if (!scheduleLive || scheduleLive.readyState !== EventSource.OPEN) {
+                pollSchedule();
+            }
+        }, ($receptionSchedule.data('poll-seconds') || 15) * 1000);
+    }
+
+    // Sessions list: patch status badges in place; new or moved sessions only raise a reload notice
+    var $sessionsTable = $('#sessions-table');
+    if ($sessionsTable.length) {
+        var showSessionsNotice = function() {
+            $('#sessions-live-notice').show();
+        };
+        var updateSessionRow = function(e) {
+            var session = JSON.parse(e.data);
+            var $row = $sessionsTable.find('tr[data-session-id="' + session.id + '"]');
+            if (!$row.length) {
+                return;
+            }
+            // A changed start time can move the session off this page
+            if ($row.data('start-time') !== session.start_time) {
+                showSessionsNotice();
+            }
+            $row.find('.session-status-badge')
+                .attr('class', 'badge badge-' + session.status.toLowerCase() + ' session-status-badge')
+                .text(session.status);
+        };
+        openLiveStream($sessionsTable.data('live-url'), {
+            'session.updated session.cancelled': updateSessionRow,
+            'session.created session.deleted resync': showSessionsNotice
+        });
+    }
+
+    // Admin dashboard: re-read the (server-side cached) counters when they change
+    var $adminDashboard = $('#admin-dashboard');
+    if ($adminDashboard.length) {
+        var refreshStats = debounce(function() {
+            $.getJSON($adminDashboard.data('stats-url'), function(stats) {
+                $.each(stats, function(name, value) {
+                    $adminDashboard.find('[data-stat="' + name + '"]').text(value);
+                });
+            });
+        }, 1000);
+        openLiveStream($adminDashboard.data('live-url'), {'counters resync': refreshStats});
+    }
 });
+
+// Opens a Server-Sent Events stream and binds handlers keyed by space-separated event names.
+// Returns null where EventSource is unavailable; callers keep their polling fallback.
+function openLiveStream(url, handlers) {
+    if (!url || !window.EventSource) {
+        return null;
+    }
+    var source = new EventSource(url);
+    $.each(handlers, function(events, handler) {
+        $.each(events.split(' '), function(i, eventName) {
+            source.addEventListener(eventName, handler);
+        });
+    });
+    return source;
+}
+
+function debounce(fn, wait) {
+    var timer = null;
+    return function() {
+        clearTimeout(timer);
+        timer = setTimeout(fn, wait);
+    };
+}
@@ -0,0 +1,107 @@
+"""
+Denormalized patient activity summary.
+
+Patient.last_session_at, next_session_at, session_count and document_count are
+recomputed for the affected patients whenever Session or Document rows are
+flushed, so lists can sort and filter on indexed columns instead of running
+per-patient subqueries. next_session_at also goes stale without any write, once
+that session's start time passes; the periodic summaries.refresh_lapsed job
+moves it on to the patient's next session every PATIENT_SUMMARY_INTERVAL.
+"""
+
+from datetime import datetime
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session as OrmSession
+
+from . import db
+from .jobs import jobs
+from .models import Patient, Document, Session
+
+SUMMARY_COLUMNS = ('last_session_at', 'next_session_at', 'session_count', 'document_count')
+
+def _summary_values(now):
+    """Correlated subqueries computing each summary column for the patient row being updated."""
+    patient = Patient.__table__
+    session = Session.__table__
+    document = Document.__table__
+    return {
+        'last_session_at': db.select(db.func.max(session.c.start_time))
+            .where(session.c.patient_id == patient.c.id, session.c.status == 'Completed')
+            .scalar_subquery(),
+        'next_session_at': db.select(db.func.min(session.c.start_time))
+            .where(session.c.patient_id == patient.c.id, session.c.status == 'Scheduled',
+                   session.c.start_time >= now)
+            .scalar_subquery(),
+        'session_count': db.select(db.func.count(session.c.id))
+            .where(session.c.patient_id == patient.c.id)
+            .scalar_subquery(),
+        'document_count': db.select(db.func.count(document.c.id))
+            .where(document.c.patient_id == patient.c.id)
+            .scalar_subquery(),
+        # Keep the onupdate hook from touching updated_at: this is bookkeeping, not a profile edit
+        'updated_at': patient.c.updated_at,
+    }
+
+def refresh_patient_summaries(connection, patient_ids=None, now=None):
+    """Recomputes the summary columns with one UPDATE.
+    patient_ids limits the update to those patients; None rebuilds every row.
+    """
+    patient = Patient.__table__
+    stmt = patient.update().values(**_summary_values(now or datetime.utcnow()))
+    if patient_ids is not None:
+        if not patient_ids:
+            return 0
+        stmt = stmt.where(patient.c.id.in_(sorted(patient_ids)))
+    return connection.execute(stmt).rowcount
+
+def refresh_lapsed_summaries(connection, now=None):
+    """Recomputes the summaries whose next_session_at has passed, with one UPDATE."""
+    now = now or datetime.utcnow()
+    patient = Patient.__table__
+    return connection.execute(
+        patient.update().values(**_summary_values(now)).where(patient.c.next_session_at < now)
+    ).rowcount
+
+@jobs.task('summaries.refresh_lapsed', every='PATIENT_SUMMARY_INTERVAL')
+def refresh_lapsed_summaries_task(payload):
+    updated = refresh_lapsed_summaries(db.session.connection())
+    db.session.commit()
+    return {'patients': updated}
+
+def _touched_patient_ids(session):
+    """Collects the patients whose sessions or documents changed in the flush that just ran.
+    Called from after_flush, where new/dirty/deleted and attribute history still describe
+    the flush but generated primary keys are already populated.
+    """
+    patient_ids = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if not isinstance(obj, (Session, Document)):
+            continue
+        if obj.patient_id is not None:
+            patient_ids.add(obj.patient_id)
+        # A session or document moved to another patient changes the old patient's summary too
+        patient_ids.update(pid for pid in inspect(obj).attrs.patient_id.history.deleted if pid is not None)
+    return patient_ids
+
+@event.listens_for(OrmSession, 'after_flush')
+def _update_patient_summaries(session, flush_context):
+    patient_ids = _touched_patient_ids(session)
+    if not patient_ids:
+        return
+    refresh_patient_summaries(session.connection(), patient_ids)
+    # Loaded Patient objects now hold stale summary values; reload them on next access
+    for patient_id in patient_ids:
+        patient = session.identity_map.get(session.identity_key(Patient, patient_id))
+        if patient is not None:
+            session.expire(patient, SUMMARY_COLUMNS)
+
+@click.command('rebuild-patient-summaries')
+@with_appcontext
+def rebuild_patient_summaries_command():
+    """Recomputes the denormalized summary columns for every patient."""
+    updated = refresh_patient_summaries(db.session.connection())
+    db.session.commit()
+    click.echo(f'Rebuilt activity summaries for {updated} patients.')
@@ -1,6 +1,8 @@
 import unittest
 import os
 import sys
+import tempfile
+from sqlalchemy import create_engine
 
 # Adjust path to import create_app from the correct location
 # Assuming tests/ is at the same level as the main project folder mini-erp-alFassih/
@@ -11,7 +13,8 @@ project_root_for_test = os.path.abspath(os.path.join(os.path.dirname(__file__),
 sys.path.insert(0, project_root_for_test)
 
 from mini_erp_alFassih.mini_erp_alFassih import create_app
-from mini_erp_alFassih.mini_erp_alFassih.config import ProductionConfig, DevelopmentConfig, Config
+from mini_erp_alFassih.mini_erp_alFassih.config import ProductionConfig, DevelopmentConfig, PostgresConfig, Config, config_by_name
+from mini_erp_alFassih.mini_erp_alFassih.database import configure_sqlite
 
 class TestConfig(unittest.TestCase):
     def test_development_config(self):
@@ -82,7 +85,24 @@ class TestConfig(unittest.TestCase):
         expected_upload_path = os.path.join(app.instance_path, 'uploads')
         self.assertEqual(app.config['UPLOAD_FOLDER'], expected_upload_path)
 
+    def test_sqlite_pragmas_apply_to_new_connections(self):
+        with tempfile.TemporaryDirectory() as directory:
+            engine = create_engine(f"sqlite:///{os.path.join(directory, 'pragmas.db')}")
+            configure_sqlite(engine, DevelopmentConfig.SQLITE_PRAGMAS)
+            with engine.connect() as connection:
+                self.assertEqual(connection.exec_driver_sql('PRAGMA journal_mode').scalar(), 'wal')
+                self.assertEqual(connection.exec_driver_sql('PRAGMA foreign_keys').scalar(), 1)
+                self.assertEqual(connection.exec_driver_sql('PRAGMA busy_timeout').scalar(), 5000)
+            engine.dispose()
+        self.assertGreater(ProductionConfig.SQLITE_PRAGMAS['busy_timeout'], Config.SQLITE_PRAGMAS['busy_timeout'])
+
+    def test_postgres_config_pools_connections(self):
+        options = PostgresConfig.SQLALCHEMY_ENGINE_OPTIONS
+        self.assertTrue(options['pool_pre_ping'])
+        self.assertGreater(options['pool_size'], 1)
+        self.assertIn('statement_timeout=', options['connect_args']['options'])
+        self.assertIs(config_by_name['postgres'], PostgresConfig)
+
 
 if __name__ == '__main__':
     unittest.main()
-```
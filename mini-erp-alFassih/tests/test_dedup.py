@@ -0,0 +1,99 @@
+import unittest
+import sys
+import os
+from datetime import date, datetime
+from flask import url_for
+
+# Add the project root to sys.path to allow direct import of mini_erp_alFassih
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from mini_erp_alFassih.mini_erp_alFassih import app, db, models
+from mini_erp_alFassih.mini_erp_alFassih.patients.dedup import find_duplicates, merge_patients, match_score
+
+class TestPatientDeduplication(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.request_context = app.test_request_context()
+        self.request_context.push()
+        self.client = app.test_client()
+        db.create_all()
+
+        user = models.User(email='dedup_admin@example.com', role='admin')
+        user.set_password('testpass')
+        self.mariam = models.Patient(first_name='Mariam', last_name='Haddad', date_of_birth=date(2016, 3, 8),
+                                     contact_info='0550 12 34 56')
+        self.maryam = models.Patient(first_name='Maryam', last_name='Haddad', date_of_birth=date(2016, 3, 8),
+                                     anamnesis='Stutters since age 4.')
+        self.swapped = models.Patient(first_name='Haddad', last_name='Mariam')
+        self.sibling = models.Patient(first_name='Youssef', last_name='Haddad', date_of_birth=date(2016, 3, 8))
+        self.stranger = models.Patient(first_name='Mariam', last_name='Haddad', date_of_birth=date(2009, 11, 20))
+        self.therapist = models.Therapist(first_name='Amal', last_name='Said')
+        db.session.add_all([user, self.mariam, self.maryam, self.swapped, self.sibling, self.stranger, self.therapist])
+        db.session.commit()
+        self.client.post(url_for('auth.login'), data=dict(email='dedup_admin@example.com', password='testpass'))
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.request_context.pop()
+
+    def _pairs(self, **kwargs):
+        return {tuple(pair['patient_ids']) for pair in find_duplicates(**kwargs)['pairs']}
+
+    def test_similar_names_with_compatible_birth_dates_are_paired(self):
+        pairs = self._pairs()
+        self.assertIn((self.mariam.id, self.maryam.id), pairs) # Spelling variant, same birth date
+        self.assertIn((self.mariam.id, self.swapped.id), pairs) # Names swapped, birth date missing
+        self.assertNotIn((self.mariam.id, self.sibling.id), pairs) # Same family and birth date, different child
+        self.assertNotIn((self.mariam.id, self.stranger.id), pairs) # Same name, different birth date
+
+    def test_scores_favor_exact_matches(self):
+        exact = match_score(('mariam', 'haddad', date(2016, 3, 8)), ('mariam', 'haddad', date(2016, 3, 8)))
+        typo = match_score(('mariam', 'haddad', date(2016, 3, 8)), ('maryam', 'haddad', date(2016, 8, 3)))
+        self.assertEqual(exact, 1.0)
+        self.assertLess(typo, exact)
+
+    def test_oversized_blocks_are_skipped(self):
+        result = find_duplicates(max_block=1)
+        self.assertEqual(result['pairs'], [])
+        self.assertGreater(result['skipped_blocks'], 0)
+
+    def test_merge_moves_history_and_deletes_duplicate(self):
+        session = models.Session(patient_id=self.maryam.id, therapist_id=self.therapist.id,
+                                 start_time=datetime(2027, 2, 1, 9), end_time=datetime(2027, 2, 1, 10))
+        document = models.Document(patient_id=self.maryam.id, title='Bilan', filename='bilan.pdf')
+        db.session.add_all([session, document])
+        db.session.commit()
+        keep_id, duplicate_id = self.mariam.id, self.maryam.id
+
+        result = merge_patients(keep_id, duplicate_id)
+        db.session.commit()
+
+        self.assertEqual((result['sessions'], result['documents']), (1, 1))
+        self.assertIsNone(db.session.get(models.Patient, duplicate_id))
+        self.assertEqual(db.session.get(models.Session, session.id).patient_id, keep_id)
+        self.assertEqual(db.session.get(models.Document, document.id).patient_id, keep_id)
+        kept = db.session.get(models.Patient, keep_id)
+        self.assertEqual((kept.session_count, kept.document_count), (1, 1))
+        self.assertEqual(kept.contact_info, '0550 12 34 56')
+        self.assertEqual(kept.anamnesis, 'Stutters since age 4.')
+
+    def test_merge_into_itself_is_rejected(self):
+        with self.assertRaises(ValueError):
+            merge_patients(self.mariam.id, self.mariam.id)
+
+    def test_duplicates_page_lists_pairs_and_merges(self):
+        response = self.client.get(url_for('patients.duplicate_patients'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Maryam', response.data)
+
+        response = self.client.post(url_for('patients.merge_patients_view'),
+                                    data={'keep_id': self.mariam.id, 'duplicate_id': self.maryam.id})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(models.Patient.query.count(), 4)
+
+if __name__ == '__main__':
+    unittest.main()
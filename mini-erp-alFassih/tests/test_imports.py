@@ -0,0 +1,232 @@
+import unittest
+import sys
+import os
+import io
+import zipfile
+from datetime import date, datetime
+from flask import url_for
+
+# Add the project root to sys.path to allow direct import of mini_erp_alFassih
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from mini_erp_alFassih.mini_erp_alFassih import app, db, models
+from mini_erp_alFassih.mini_erp_alFassih.matching import normalize_name
+from mini_erp_alFassih.mini_erp_alFassih.spreadsheets import open_table, SpreadsheetError
+
+def xlsx_file(rows):
+    """A minimal workbook using a shared-string table, as Excel writes it."""
+    strings = sorted({value for row in rows for value in row if isinstance(value, str)})
+    def cell(column, number, value):
+        ref = f'{chr(65 + column)}{number}'
+        if isinstance(value, str):
+            return f'<c r="{ref}" t="s"><v>{strings.index(value)}</v></c>'
+        return f'<c r="{ref}"><v>{value}</v></c>'
+    sheet_rows = ''.join(f'<row r="{number}">' + ''.join(cell(column, number, value) for column, value in enumerate(row)
+                                                         if value is not None) + '</row>'
+                         for number, row in enumerate(rows, start=1))
+    main = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+    relationships = 'http://schemas.openxmlformats.org/package/2006/relationships'
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr('xl/workbook.xml', f'<workbook xmlns="{main}" xmlns:r="http://schemas.openxmlformats.org/'
+                         'officeDocument/2006/relationships"><sheets><sheet name="Patients" sheetId="1" r:id="rId7"/>'
+                         '</sheets></workbook>')
+        archive.writestr('xl/_rels/workbook.xml.rels', f'<Relationships xmlns="{relationships}">'
+                         '<Relationship Id="rId7" Target="worksheets/data.xml"/></Relationships>')
+        archive.writestr('xl/sharedStrings.xml', f'<sst xmlns="{main}">'
+                         + ''.join(f'<si><t>{value}</t></si>' for value in strings) + '</sst>')
+        archive.writestr('xl/worksheets/data.xml', f'<worksheet xmlns="{main}"><sheetData>{sheet_rows}</sheetData></worksheet>')
+    buffer.seek(0)
+    return buffer
+
+class TestSpreadsheetReader(unittest.TestCase):
+    def test_csv_headers_are_normalized_and_blank_rows_skipped(self):
+        stream = io.BytesIO('﻿First Name,Last Name\r\nسارة,Khalil\r\n,\r\nOmar,Nasser\r\n'.encode('utf-8'))
+        headers, rows = open_table(stream, 'patients.csv')
+        self.assertEqual(headers, ['first_name', 'last_name'])
+        self.assertEqual(list(rows), [(2, {'first_name': 'سارة', 'last_name': 'Khalil'}),
+                                      (4, {'first_name': 'Omar', 'last_name': 'Nasser'})])
+
+    def test_xlsx_rows_resolve_shared_strings_and_gaps(self):
+        stream = xlsx_file([('first_name', 'last_name', 'date_of_birth'), ('Lina', None, 42005)])
+        headers, rows = open_table(stream, 'patients.xlsx')
+        self.assertEqual(list(rows), [(2, {'first_name': 'Lina', 'last_name': None, 'date_of_birth': 42005})])
+
+    def test_unreadable_files_are_rejected(self):
+        with self.assertRaises(SpreadsheetError):
+            open_table(io.BytesIO(b'not a zip'), 'patients.xlsx')
+        with self.assertRaises(SpreadsheetError):
+            open_table(io.BytesIO(b''), 'patients.csv')
+        with self.assertRaises(SpreadsheetError):
+            open_table(io.BytesIO(b'a,b'), 'patients.pdf')
+
+class TestPatientImport(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        app.config['PATIENT_IMPORT_BATCH_SIZE'] = 2 # Duplicate checks must work across batches
+        self.request_context = app.test_request_context()
+        self.request_context.push()
+        self.client = app.test_client()
+        db.create_all()
+
+        user = models.User(email='import_staff@example.com', role='staff')
+        user.set_password('testpass')
+        self.existing = models.Patient(first_name='Fatima', last_name='Al-Zahra', date_of_birth=date(2016, 5, 1))
+        db.session.add_all([user, self.existing])
+        db.session.commit()
+        self.client.post(url_for('auth.login'), data=dict(email='import_staff@example.com', password='testpass'))
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.request_context.pop()
+        app.config['PATIENT_IMPORT_BATCH_SIZE'] = 1000
+
+    def _upload(self, data, filename='patients.csv', dry_run=False):
+        if isinstance(data, str):
+            data = io.BytesIO(data.encode('utf-8'))
+        form = {'file': (data, filename)}
+        if dry_run:
+            form['dry_run'] = 'y'
+        return self.client.post(url_for('patients.import_patients_view'), data=form,
+                                content_type='multipart/form-data')
+
+    def test_match_key_follows_name_edits(self):
+        self.assertEqual(self.existing.match_key, 'al zahra|fatima|2016-05-01')
+        self.existing.first_name = 'Fatimah'
+        db.session.commit()
+        self.assertEqual(self.existing.match_key, 'al zahra|fatimah|2016-05-01')
+        self.assertEqual(normalize_name('  مُحَمَّد '), normalize_name('محمد'))
+
+    def test_csv_import_reports_duplicates_and_invalid_rows(self):
+        response = self._upload(
+            'First Name,Last Name,Date of Birth,Contact Information,Notes\n'
+            'Omar,Nasser,2015-04-02,omar@example.com,ignored\n'
+            'omar,NASSER,2015-04-02,,\n' # Repeats row 2
+            'FATIMA,al zahra,2016-05-01,,\n' # Existing patient, different spelling
+            ',Missing,2015-01-01,,\n'
+            'Lina,Saad,02/03/2015,,\n'
+            'Yusuf,Haddad,,,\n')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Imported 2 patients', response.data)
+        self.assertIn(b'Row 2 of this file', response.data)
+        self.assertIn(f'Patient #{self.existing.id}'.encode(), response.data)
+        self.assertIn(b'first_name: This field is required.', response.data)
+        self.assertIn(b'date_of_birth: Not a valid date value.', response.data)
+        self.assertIn(b'Ignored columns: notes', response.data)
+        omar = models.Patient.query.filter_by(last_name='Nasser').one()
+        self.assertEqual((omar.date_of_birth, omar.contact_info), (date(2015, 4, 2), 'omar@example.com'))
+        self.assertEqual(omar.match_key, 'nasser|omar|2015-04-02')
+        self.assertEqual(models.Patient.query.count(), 3)
+
+    def test_xlsx_import_with_excel_dates(self):
+        self._upload(xlsx_file([('first_name', 'last_name', 'date_of_birth'), ('Lina', 'Saad', 42005)]), 'list.xlsx')
+        self.assertEqual(models.Patient.query.filter_by(last_name='Saad').one().date_of_birth, date(2015, 1, 1))
+
+    def test_dry_run_imports_nothing(self):
+        response = self._upload('first_name,last_name\nOmar,Nasser\n', dry_run=True)
+        self.assertIn(b'Would import:</strong> 1', response.data)
+        self.assertEqual(models.Patient.query.count(), 1)
+
+    def test_missing_required_column_is_rejected(self):
+        response = self._upload('first_name,date_of_birth\nOmar,2015-04-02\n')
+        self.assertIn(b'Missing required column(s): Last Name.', response.data)
+        self.assertEqual(models.Patient.query.count(), 1)
+
+    def test_cli_import(self):
+        path = os.path.join(app.instance_path, 'test_import_patients.csv')
+        os.makedirs(app.instance_path, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as output:
+            output.write('first_name,last_name\nOmar,Nasser\nLina,\n')
+        try:
+            result = app.test_cli_runner().invoke(args=['patients', 'import', path])
+        finally:
+            os.remove(path)
+        self.assertIn('Row 3: last_name: This field is required.', result.output)
+        self.assertIn('Imported 1 of 2 rows', result.output)
+
+class TestSessionImport(unittest.TestCase):
+    HEADER = 'patient_id,patient_first_name,patient_last_name,patient_date_of_birth,therapist_first_name,therapist_last_name,start_time,end_time,duration_minutes,status\n'
+
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        app.config['SESSION_IMPORT_BATCH_SIZE'] = 2
+        self.request_context = app.test_request_context()
+        self.request_context.push()
+        self.client = app.test_client()
+        db.create_all()
+
+        user = models.User(email='schedule_staff@example.com', role='staff')
+        user.set_password('testpass')
+        self.omar = models.Patient(first_name='Omar', last_name='Nasser')
+        self.sara = models.Patient(first_name='Sara', last_name='Khalil', date_of_birth=date(2015, 4, 2))
+        self.sara_too = models.Patient(first_name='Sara', last_name='Khalil', date_of_birth=date(2017, 9, 9))
+        self.amal = models.Therapist(first_name='Amal', last_name='Haddad')
+        self.karim = models.Therapist(first_name='Karim', last_name='Said')
+        db.session.add_all([user, self.omar, self.sara, self.sara_too, self.amal, self.karim])
+        db.session.commit()
+        self.existing = models.Session(patient_id=self.omar.id, therapist_id=self.karim.id,
+                                       start_time=datetime(2027, 1, 4, 9), end_time=datetime(2027, 1, 4, 10))
+        db.session.add(self.existing)
+        db.session.commit()
+        self.client.post(url_for('auth.login'), data=dict(email='schedule_staff@example.com', password='testpass'))
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.request_context.pop()
+        app.config['SESSION_IMPORT_BATCH_SIZE'] = 1000
+
+    def _import(self, body, dry_run=False):
+        form = {'file': (io.BytesIO((self.HEADER + body).encode('utf-8')), 'agenda.csv')}
+        if dry_run:
+            form['dry_run'] = 'y'
+        return self.client.post(url_for('sessions.import_sessions_view'), data=form, content_type='multipart/form-data')
+
+    def test_rows_are_resolved_and_inserted(self):
+        response = self._import(
+            ',omar,NASSER,,Amal,Haddad,2027-01-04 11:00,,45,\n'
+            f'{self.sara_too.id},,,,amal,haddad,04/01/2027 10:00,04/01/2027 10:30,,\n'
+            ',Sara,Khalil,2015-04-02,Karim,Said,2027-01-04T10:00,,30,Scheduled\n')
+        self.assertIn(b'Imported 3 sessions', response.data)
+        omar_session = models.Session.query.filter_by(patient_id=self.omar.id, therapist_id=self.amal.id).one()
+        self.assertEqual(omar_session.end_time, datetime(2027, 1, 4, 11, 45))
+        self.assertEqual(models.Session.query.filter_by(patient_id=self.sara.id).one().therapist_id, self.karim.id)
+        self.assertEqual(self.sara_too.session_count, 1) # Patient summaries are refreshed
+
+    def test_unresolvable_and_invalid_rows_are_reported(self):
+        response = self._import(
+            ',Sara,Khalil,,Amal,Haddad,2027-01-05 09:00,,30,\n' # Two patients share the name
+            ',Omar,Nasser,,Nobody,Here,2027-01-05 09:00,,30,\n'
+            ',Omar,Nasser,,Amal,Haddad,2027-01-05 09:00,2027-01-05 08:00,,\n'
+            ',Omar,Nasser,,Amal,Haddad,soon,,30,Maybe\n'
+            ',Omar,Nasser,,Amal,Haddad,2027-01-05 10:00,,1e20,\n') # Past the largest datetime
+        self.assertIn(b'patient: Several patients have this name', response.data)
+        self.assertIn(b'therapist: No such therapist.', response.data)
+        self.assertIn(b'end_time: End time must be after start time.', response.data)
+        self.assertIn(b'start_time: Not a valid datetime value.; status: Not a valid choice.', response.data)
+        self.assertIn(b'end_time: Not a valid duration.', response.data)
+        self.assertEqual(models.Session.query.count(), 1)
+
+    def test_double_bookings_are_rejected(self):
+        response = self._import(
+            ',Sara,Khalil,2015-04-02,Karim,Said,2027-01-04 09:30,,30,\n' # Karim has the existing session
+            ',Sara,Khalil,2015-04-02,Amal,Haddad,2027-01-04 11:00,,60,\n'
+            f'{self.sara_too.id},,,,Amal,Haddad,2027-01-04 11:30,,30,\n' # Amal is busy with row 3
+            ',Omar,Nasser,,Amal,Haddad,2027-01-04 09:30,,30,\n' # Omar is with Karim then
+            ',Omar,Nasser,,Amal,Haddad,2027-01-04 09:30,,30,Completed\n' # Only scheduled sessions are checked
+            ',Sara,Khalil,2015-04-02,Amal,Haddad,2027-01-04 12:00,,30,\n') # Starts as row 3 ends
+        self.assertIn(b'Imported 3 sessions', response.data)
+        self.assertIn(f'Therapist already has session {self.existing.id} at this time.'.encode(), response.data)
+        self.assertIn(b'Therapist is already booked by row 3.', response.data)
+        self.assertIn(f'Patient already has session {self.existing.id} at this time.'.encode(), response.data)
+
+    def test_dry_run_imports_nothing(self):
+        response = self._import(',Omar,Nasser,,Amal,Haddad,2027-01-05 09:00,,30,\n', dry_run=True)
+        self.assertIn(b'Would import:</strong> 1', response.data)
+        self.assertEqual(models.Session.query.count(), 1)
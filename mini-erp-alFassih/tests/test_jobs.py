@@ -0,0 +1,244 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from flask import url_for
+
+# Add the project root to sys.path to allow direct import of mini_erp_alFassih
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from mini_erp_alFassih.mini_erp_alFassih import app, db, models
+from mini_erp_alFassih.mini_erp_alFassih.jobqueue import JobQueue
+from mini_erp_alFassih.mini_erp_alFassih.jobs import jobs
+from mini_erp_alFassih.mini_erp_alFassih.jobs.manager import JobManager
+from mini_erp_alFassih.mini_erp_alFassih.jobs.worker import Worker
+from mini_erp_alFassih.mini_erp_alFassih.reminders.service import SEND_TASK, scan_upcoming, send_reminder
+
+class RecordingSender:
+    def __init__(self, fail=False):
+        self.sent = []
+        self.fail = fail
+
+    def send(self, reminder):
+        if self.fail:
+            raise RuntimeError('SMTP unavailable')
+        self.sent.append(reminder)
+
+class TestJobQueue(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.queue = JobQueue(os.path.join(self.tmpdir, 'jobs.sqlite3'), max_attempts=2, retry_delay=10)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_idempotency_key_deduplicates(self):
+        self.assertEqual(self.queue.enqueue('q', [('a', {'n': 1}), ('b', {'n': 2})]), 2)
+        self.assertEqual(self.queue.enqueue('q', [('a', {'n': 1})]), 0)
+        self.assertEqual(self.queue.counts('q'), {'queued': 2})
+
+    def test_claimed_jobs_are_not_claimed_twice_until_the_lease_expires(self):
+        self.queue.enqueue('q', [('a', {})])
+        now = datetime.utcnow()
+        self.assertEqual(len(self.queue.claim('q', limit=5, lease=60, now=now)), 1)
+        self.assertEqual(self.queue.claim('q', now=now), [])
+        reclaimed = self.queue.claim('q', now=now + timedelta(seconds=61))
+        self.assertEqual(reclaimed[0].attempts, 2)
+
+    def test_leases_can_differ_per_queue(self):
+        self.queue.enqueue('short', [('a', {})])
+        self.queue.enqueue('long', [('b', {})])
+        now = datetime.utcnow()
+        self.assertEqual(len(self.queue.claim(['short', 'long'], limit=2, lease={'short': 10, 'long': 600}, now=now)), 2)
+        reclaimed = self.queue.claim(['short', 'long'], limit=2, now=now + timedelta(seconds=11))
+        self.assertEqual([job.queue for job in reclaimed], ['short'])
+
+    def test_jobs_whose_last_lease_expires_are_failed(self):
+        # A job that kills its worker never reports a failure; the expired lease counts as one
+        self.queue.enqueue('q', [('a', {})])
+        now = datetime.utcnow()
+        self.queue.claim('q', now=now)
+        self.queue.claim('q', now=now + timedelta(seconds=61)) # Second and last attempt
+        self.assertEqual(self.queue.claim('q', now=now + timedelta(seconds=122)), [])
+        self.assertEqual(self.queue.counts('q'), {'failed': 1})
+        self.assertIn('Lease expired', self.queue.get(1).last_error)
+
+    def test_failures_back_off_then_give_up(self):
+        self.queue.enqueue('q', [('a', {})])
+        now = datetime.utcnow()
+        job = self.queue.claim('q', now=now)[0]
+        self.assertEqual(self.queue.fail(job, 'boom', now=now), 'queued')
+        self.assertEqual(self.queue.claim('q', now=now + timedelta(seconds=5)), []) # Still backing off
+        job = self.queue.claim('q', now=now + timedelta(seconds=11))[0]
+        self.assertEqual(self.queue.fail(job, 'boom again'), 'failed')
+        self.assertEqual(self.queue.counts('q'), {'failed': 1})
+
+    def test_a_failed_key_can_be_queued_again(self):
+        job_id = self.queue.enqueue_one('q', {'n': 1}, key='report', max_attempts=1)
+        self.queue.fail(self.queue.claim('q')[0], 'boom')
+        self.assertEqual(self.queue.enqueue_one('q', {'n': 2}, key='report'), job_id)
+        job = self.queue.get(job_id)
+        self.assertEqual((job.status, job.attempts, job.payload, job.last_error), ('queued', 0, {'n': 2}, None))
+        self.assertEqual(self.queue.enqueue_one('q', {'n': 3}, key='report'), job_id) # Still queued: unchanged
+        self.assertEqual(self.queue.get(job_id).payload, {'n': 2})
+
+    def test_purge_drops_only_old_finished_jobs(self):
+        now = datetime.utcnow()
+        old = now - timedelta(days=10)
+        self.queue.enqueue('q', [('done', {}), ('waiting', {})], now=old)
+        self.queue.complete(self.queue.claim('q', now=old)[0], now=old)
+        recent = self.queue.claim('q', now=now)[0]
+        self.queue.complete(recent, now=now)
+        self.queue.enqueue('q', [('old-queued', {})], now=old)
+        self.assertEqual(self.queue.purge(now - timedelta(days=7)), 1)
+        self.assertEqual(self.queue.counts('q'), {'done': 1, 'queued': 1})
+
+class TestJobWorker(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.request_context = app.test_request_context()
+        self.request_context.push()
+        db.create_all()
+        self.tmpdir = tempfile.mkdtemp()
+        self.manager = JobManager()
+        self.manager.queue = JobQueue(os.path.join(self.tmpdir, 'jobs.sqlite3'), retry_delay=60)
+
+        @self.manager.task('test.add')
+        def add(payload):
+            return {'sum': payload['a'] + payload['b']}
+
+        @self.manager.task('test.broken', max_attempts=3, every=60)
+        def broken(payload):
+            raise ValueError('always broken')
+
+        self.worker = Worker(app, self.manager, concurrency=1)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        shutil.rmtree(self.tmpdir)
+        self.request_context.pop()
+
+    def test_worker_runs_jobs_and_stores_results(self):
+        job_id = self.manager.enqueue('test.add', {'a': 2, 'b': 3}, key='add-once')
+        self.assertEqual(self.manager.enqueue('test.add', {'a': 2, 'b': 3}, key='add-once'), job_id)
+        self.assertTrue(self.worker.run_once())
+        self.assertFalse(self.worker.run_once())
+        job = self.manager.get(job_id)
+        self.assertEqual((job.status, job.result), ('done', {'sum': 5}))
+
+    def test_failing_job_is_rescheduled_with_its_error(self):
+        job_id = self.manager.enqueue('test.broken')
+        self.worker.run_once()
+        job = self.manager.get(job_id)
+        self.assertEqual((job.status, job.attempts, job.max_attempts), ('queued', 1, 3))
+        self.assertIn('always broken', job.last_error)
+
+    def test_unknown_task_is_rejected(self):
+        with self.assertRaises(KeyError):
+            self.manager.enqueue('test.missing')
+
+    def test_periodic_tasks_are_queued_once_per_interval(self):
+        now = 6000.0
+        self.worker.enqueue_periodic(now=now)
+        self.worker.enqueue_periodic(now=now + 30)
+        Worker(app, self.manager).enqueue_periodic(now=now + 30) # A second worker process
+        self.assertEqual(self.manager.queue.counts('test.broken'), {'queued': 1})
+        self.worker.enqueue_periodic(now=now + 60)
+        self.assertEqual(self.manager.queue.counts('test.broken'), {'queued': 2})
+
+    def test_status_api(self):
+        user = models.User(email='jobs_admin@example.com', role='admin')
+        user.set_password('testpass')
+        db.session.add(user)
+        db.session.commit()
+        client = app.test_client()
+        client.post(url_for('auth.login'), data=dict(email='jobs_admin@example.com', password='testpass'))
+        app_queue, jobs.queue = jobs.queue, self.manager.queue
+        try:
+            job_id = self.manager.enqueue('test.add', {'a': 1, 'b': 1})
+            response = client.get(url_for('jobs.job_status', job_id=job_id))
+            self.assertEqual(response.json['status'], 'queued')
+            self.assertEqual(response.json['task'], 'test.add')
+            self.assertEqual(client.get(url_for('jobs.job_status', job_id=job_id + 100)).status_code, 404)
+            self.assertEqual(client.get(url_for('jobs.job_stats')).json, {'test.add': {'queued': 1}})
+        finally:
+            jobs.queue = app_queue
+
+    def test_status_api_shows_users_only_their_own_jobs(self):
+        users = [models.User(email=f'jobs_staff_{n}@example.com', role='staff') for n in range(2)]
+        for user in users:
+            user.set_password('testpass')
+        db.session.add_all(users)
+        db.session.commit()
+        client = app.test_client()
+        client.post(url_for('auth.login'), data=dict(email='jobs_staff_0@example.com', password='testpass'))
+        app_queue, jobs.queue = jobs.queue, self.manager.queue
+        try:
+            own = self.manager.enqueue('test.add', {'a': 1, 'b': 1}, owner_id=users[0].id)
+            other = self.manager.enqueue('test.add', {'a': 2, 'b': 2}, owner_id=users[1].id)
+            self.assertEqual(client.get(url_for('jobs.job_status', job_id=own)).status_code, 200)
+            self.assertEqual(client.get(url_for('jobs.job_status', job_id=other)).status_code, 404)
+        finally:
+            jobs.queue = app_queue
+
+class TestSessionReminders(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.tmpdir = tempfile.mkdtemp()
+        self.queue = JobQueue(os.path.join(self.tmpdir, 'jobs.sqlite3'))
+
+        self.now = datetime.utcnow()
+        patient = models.Patient(first_name='Rem', last_name='Inder', contact_info='Phone 0600, rem@example.com')
+        therapist = models.Therapist(first_name='Dr.', last_name='Remind')
+        db.session.add_all([patient, therapist])
+        db.session.commit()
+        self.sessions = []
+        for hours, status in ((2, 'Scheduled'), (5, 'Scheduled'), (3, 'Cancelled'), (30, 'Scheduled')):
+            start = self.now + timedelta(hours=hours)
+            self.sessions.append(models.Session(patient_id=patient.id, therapist_id=therapist.id, start_time=start,
+                                                end_time=start + timedelta(hours=1), status=status))
+        db.session.add_all(self.sessions)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        shutil.rmtree(self.tmpdir)
+        self.app_context.pop()
+
+    def test_scan_queues_each_upcoming_session_once(self):
+        self.assertEqual(scan_upcoming(self.queue, now=self.now, batch_size=1), 2)
+        self.assertEqual(scan_upcoming(self.queue, now=self.now), 0)
+        # Moving a session queues a reminder for its new time
+        self.sessions[1].start_time += timedelta(hours=1)
+        db.session.commit()
+        self.assertEqual(scan_upcoming(self.queue, now=self.now), 1)
+
+    def test_send_reminder_skips_sessions_that_changed(self):
+        scan_upcoming(self.queue, now=self.now)
+        sender = RecordingSender()
+        payloads = [job.payload for job in self.queue.claim(SEND_TASK, limit=5)]
+        self.sessions[1].status = 'Cancelled'
+        db.session.commit()
+        results = [send_reminder(payload, sender=sender, now=self.now) for payload in payloads]
+        self.assertEqual([result['sent'] for result in results], [True, False])
+        self.assertEqual(sender.sent[0]['recipient'], 'rem@example.com')
+
+    def test_failed_sends_raise_for_retry(self):
+        scan_upcoming(self.queue, now=self.now)
+        payload = self.queue.claim(SEND_TASK)[0].payload
+        with self.assertRaises(RuntimeError):
+            send_reminder(payload, sender=RecordingSender(fail=True), now=self.now)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+import sys
+import os
+import json
+import logging
+import shutil
+import tempfile
+from flask import url_for
+
+# Add the project root to sys.path to allow direct import of mini_erp_alFassih
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from mini_erp_alFassih.mini_erp_alFassih import app, db, models
+from mini_erp_alFassih.mini_erp_alFassih.applog import configure_logging
+
+class TestStructuredLogging(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.log_dir = tempfile.mkdtemp()
+        app.config['LOG_FILE_PATH'] = os.path.join(self.log_dir, 'alfassih.log')
+        app.config['LOG_SINKS'] = ['file']
+        self.handler = configure_logging(app)
+        self.request_context = app.test_request_context()
+        self.request_context.push()
+        self.client = app.test_client()
+        db.create_all()
+
+        self.user = models.User(email='logging_user@example.com', role='staff')
+        self.user.set_password('testpass')
+        db.session.add(self.user)
+        db.session.commit()
+        self.client.post(url_for('auth.login'), data=dict(email='logging_user@example.com', password='testpass'))
+
+    def tearDown(self):
+        app.logger.removeHandler(self.handler)
+        app.extensions.pop('log_handler', None)
+        self.handler.close()
+        app.logger.setLevel(logging.NOTSET)
+        app.config['LOG_FILE_PATH'] = None
+        db.session.remove()
+        db.drop_all()
+        self.request_context.pop()
+        shutil.rmtree(self.log_dir)
+
+    def _records(self):
+        self.handler.listener.stop() # Waits until the queued records are written
+        self.handler.listener.start()
+        with open(app.config['LOG_FILE_PATH'], encoding='utf-8') as log_file:
+            return [json.loads(line) for line in log_file]
+
+    def test_requests_are_logged_with_context(self):
+        response = self.client.get(url_for('patients.list_patients'), headers={'X-Request-ID': 'trace-42'})
+        self.assertEqual(response.headers['X-Request-ID'], 'trace-42')
+        access = [r for r in self._records() if r.get('request_id') == 'trace-42']
+        self.assertEqual(len(access), 1)
+        self.assertEqual(access[0]['endpoint'], 'patients.list_patients')
+        self.assertEqual(access[0]['status'], 200)
+        self.assertEqual(access[0]['user_id'], str(self.user.id))
+        self.assertIn('duration_ms', access[0])
+
+    def test_malformed_request_ids_are_replaced(self):
+        response = self.client.get(url_for('patients.list_patients'), headers={'X-Request-ID': 'bad id <script>'})
+        self.assertRegex(response.headers['X-Request-ID'], r'^[0-9a-f]{32}$')
+
+    def test_exceptions_keep_their_traceback(self):
+        try:
+            raise ValueError('broken import row')
+        except ValueError:
+            app.logger.exception('Import failed for %s', 'patients.csv')
+        record = self._records()[-1]
+        self.assertEqual(record['message'], 'Import failed for patients.csv')
+        self.assertEqual(record['level'], 'ERROR')
+        self.assertIn('ValueError: broken import row', record['exception'])
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        self.handler.listener.stop()
+        for _ in range(self.handler.queue.maxsize + 5):
+            app.logger.info('burst')
+        self.assertEqual(self.handler.dropped, 5)
+        self.handler.listener.start()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+import threading
+from flask import url_for
+
+# Add the project root to sys.path to allow direct import of mini_erp_alFassih
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from mini_erp_alFassih.mini_erp_alFassih import app, db, models
+from mini_erp_alFassih.mini_erp_alFassih.metrics.registry import Registry
+
+class TestMetricsRegistry(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _worker(self):
+        registry = Registry()
+        registry.counter('requests_total', 'Requests.', ('status',))
+        registry.histogram('latency_seconds', 'Latency.', buckets=(0.1, 1.0))
+        registry.configure(self.directory)
+        return registry
+
+    def test_threads_and_processes_are_summed(self):
+        first, second = self._worker(), self._worker() # Two worker processes sharing METRICS_DIR
+        threads = [threading.Thread(target=lambda: [first.metrics['requests_total'].inc(status=200) for _ in range(1000)])
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        second.metrics['requests_total'].inc(5, status=200)
+        second.metrics['latency_seconds'].observe(0.5)
+        second.metrics['latency_seconds'].observe(3)
+        second.flush()
+
+        text = first.render()
+        self.assertIn('requests_total{status="200"} 4005', text)
+        self.assertIn('latency_seconds_bucket{le="0.1"} 0', text)
+        self.assertIn('latency_seconds_bucket{le="1.0"} 1', text)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 2', text)
+        self.assertIn('latency_seconds_sum 3.5', text)
+
+    def test_exited_processes_keep_counting(self):
+        stopped = self._worker()
+        stopped.metrics['requests_total'].inc(status=500)
+        stopped.flush()
+        del stopped
+        self.assertIn('requests_total{status="500"} 1', self._worker().render())
+
+class TestMetricsEndpoint(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.request_context = app.test_request_context()
+        self.request_context.push()
+        self.client = app.test_client()
+        db.create_all()
+
+        user = models.User(email='metrics_user@example.com', role='staff')
+        user.set_password('testpass')
+        db.session.add(user)
+        db.session.commit()
+        self.client.post(url_for('auth.login'), data=dict(email='metrics_user@example.com', password='testpass'))
+
+    def tearDown(self):
+        app.config['METRICS_TOKEN'] = None
+        db.session.remove()
+        db.drop_all()
+        self.request_context.pop()
+
+    def _sample(self, text, line_start):
+        return next(float(line.rsplit(' ', 1)[1]) for line in text.splitlines() if line.startswith(line_start))
+
+    def test_requests_queries_and_caches_are_exposed(self):
+        before = self.client.get(url_for('metrics.metrics')).get_data(as_text=True)
+        self.client.get(url_for('sessions.reception_schedule_json', day='2027-01-04'))
+        self.client.get(url_for('sessions.reception_schedule_json', day='2027-01-04'))
+        response = self.client.get(url_for('metrics.metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.mimetype.startswith('text/plain'))
+        text = response.get_data(as_text=True)
+
+        requests = 'alfassih_http_requests_total{endpoint="sessions.reception_schedule_json",method="GET",status="200"}'
+        self.assertEqual(self._sample(text, requests) - self._sample(before + f'\n{requests} 0', requests), 2)
+        self.assertIn('alfassih_http_request_duration_seconds_bucket{endpoint="sessions.reception_schedule_json",le="+Inf"}', text)
+        self.assertIn('alfassih_db_queries_total{endpoint="sessions.reception_schedule_json"}', text)
+        self.assertIn('alfassih_cache_requests_total{cache="schedule",result="hit"}', text)
+        self.assertIn('# TYPE alfassih_jobs gauge', text)
+
+    def test_token_is_required_when_configured(self):
+        app.config['METRICS_TOKEN'] = 's3cret'
+        self.assertEqual(self.client.get(url_for('metrics.metrics')).status_code, 401)
+        response = self.client.get(url_for('metrics.metrics'), headers={'Authorization': 'Bearer s3cret'})
+        self.assertEqual(response.status_code, 200)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,6 +8,7 @@ project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.insert(0, project_root)
 
 from mini_erp_alFassih.mini_erp_alFassih import app, db, models
+from mini_erp_alFassih.mini_erp_alFassih import summaries
 # models.Patient, models.Therapist, models.Session will be used
 
 class TestPatientModel(unittest.TestCase):
@@ -164,5 +165,83 @@ class TestSessionModel(unittest.TestCase):
         self.assertEqual(retrieved_session.assigned_therapist, self.therapist)
 
 
+class TestPatientActivitySummary(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.patient = models.Patient(first_name='Summary', last_name='Patient')
+        self.other_patient = models.Patient(first_name='Other', last_name='Patient')
+        self.therapist = models.Therapist(first_name='Dr.', last_name='Summary')
+        db.session.add_all([self.patient, self.other_patient, self.therapist])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def _add_session(self, patient, start_time, status):
+        session = models.Session(patient_id=patient.id, therapist_id=self.therapist.id, start_time=start_time,
+                                 end_time=start_time + timedelta(hours=1), status=status)
+        db.session.add(session)
+        db.session.commit()
+        return session
+
+    def test_summary_follows_session_and_document_writes(self):
+        now = datetime.utcnow()
+        past = self._add_session(self.patient, now - timedelta(days=10), 'Completed')
+        upcoming = self._add_session(self.patient, now + timedelta(days=2), 'Scheduled')
+        db.session.add(models.Document(patient=self.patient, title='Bilan', filename='bilan.pdf'))
+        db.session.commit()
+
+        self.assertEqual(self.patient.session_count, 2)
+        self.assertEqual(self.patient.document_count, 1)
+        self.assertEqual(self.patient.last_session_at, past.start_time)
+        self.assertEqual(self.patient.next_session_at, upcoming.start_time)
+
+        upcoming.status = 'Cancelled'
+        db.session.commit()
+        self.assertIsNone(self.patient.next_session_at)
+
+        # Moving a session to another patient updates both summaries
+        past.patient_id = self.other_patient.id
+        db.session.commit()
+        self.assertEqual(self.patient.session_count, 1)
+        self.assertIsNone(self.patient.last_session_at)
+        self.assertEqual(self.other_patient.session_count, 1)
+
+        db.session.delete(upcoming)
+        db.session.commit()
+        self.assertEqual(self.patient.session_count, 0)
+
+    def test_rebuild_recomputes_every_patient(self):
+        self._add_session(self.patient, datetime.utcnow() + timedelta(days=1), 'Scheduled')
+        db.session.execute(models.Patient.__table__.update().values(session_count=0, next_session_at=None))
+        db.session.commit()
+
+        summaries.refresh_patient_summaries(db.session.connection())
+        db.session.commit()
+        db.session.expire_all()
+        self.assertEqual(self.patient.session_count, 1)
+        self.assertIsNotNone(self.patient.next_session_at)
+
+    def test_lapsed_next_session_moves_on_without_a_write(self):
+        now = datetime.utcnow()
+        first = self._add_session(self.patient, now + timedelta(hours=1), 'Scheduled')
+        second = self._add_session(self.patient, now + timedelta(days=7), 'Scheduled')
+        self._add_session(self.other_patient, now + timedelta(days=1), 'Scheduled')
+        self.assertEqual(self.patient.next_session_at, first.start_time)
+
+        updated = summaries.refresh_lapsed_summaries(db.session.connection(), now=now + timedelta(hours=2))
+        db.session.commit()
+        db.session.expire_all()
+        self.assertEqual(updated, 1) # Only the patient whose next session has started
+        self.assertEqual(self.patient.next_session_at, second.start_time)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+from flask import url_for
+
+# Add the project root to sys.path to allow direct import of mini_erp_alFassih
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from mini_erp_alFassih.mini_erp_alFassih import app, db, models
+from mini_erp_alFassih.mini_erp_alFassih.profiling import collapse, flame_tree
+
+class TestRequestProfiler(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.profile_dir = tempfile.mkdtemp()
+        app.config['PROFILER_DIR'] = self.profile_dir
+        app.config['PROFILER_TOKEN'] = 'profile-me'
+        self.profiler = app.extensions['profiler']
+        self.request_context = app.test_request_context()
+        self.request_context.push()
+        self.client = app.test_client()
+        db.create_all()
+
+        admin = models.User(email='profiler_admin@example.com', role='admin')
+        admin.set_password('testpass')
+        db.session.add(admin)
+        db.session.commit()
+        self.client.post(url_for('auth.login'), data=dict(email='profiler_admin@example.com', password='testpass'))
+
+    def tearDown(self):
+        app.config['PROFILER_TOKEN'] = None
+        app.config['PROFILER_DIR'] = None
+        db.session.remove()
+        db.drop_all()
+        self.request_context.pop()
+        shutil.rmtree(self.profile_dir)
+
+    def test_only_requests_with_the_token_are_profiled(self):
+        self.client.get(url_for('patients.list_patients')).close()
+        self.client.get(url_for('patients.list_patients'), headers={'X-Profile': 'guess'}).close()
+        self.assertEqual(self.profiler.profile_ids(), [])
+
+        response = self.client.get(url_for('patients.list_patients'), headers={'X-Profile': 'profile-me'})
+        self.assertEqual(response.status_code, 200)
+        response.close() # Profiles are stored once the server closes the response
+        profile = self.profiler.load(self.profiler.profile_ids()[0])
+        self.assertEqual((profile['mode'], profile['path'], profile['status']), ('sample', '/patients/', 200))
+
+        listing = self.client.get(url_for('admin.list_profiles')).get_data(as_text=True)
+        self.assertIn('GET /patients/', listing)
+        self.assertEqual(self.client.get(url_for('admin.view_profile', profile_id=profile['id'])).status_code, 200)
+
+    def test_cprofile_mode_keeps_stats(self):
+        self.client.get(url_for('patients.list_patients'),
+                        headers={'X-Profile': 'profile-me', 'X-Profile-Mode': 'cprofile'}).close()
+        profile = self.profiler.load(self.profiler.profile_ids()[0])
+        self.assertEqual(profile['mode'], 'cprofile')
+        self.assertIn('list_patients', profile['summary'])
+        download = self.client.get(url_for('admin.profile_pstats', profile_id=profile['id']))
+        self.assertEqual(download.status_code, 200)
+        self.assertTrue(download.data)
+
+    def test_unknown_profiles_are_not_found(self):
+        self.assertEqual(self.client.get(url_for('admin.view_profile', profile_id='..%2Fconfig')).status_code, 404)
+        self.assertEqual(self.client.get(url_for('admin.view_profile', profile_id='20270104T090000-0123abcd')).status_code, 404)
+
+    def test_flame_tree_nests_collapsed_stacks(self):
+        tree = flame_tree({'app:handle;db:query': 3, 'app:handle;app:render': 1, 'app:handle': 996}, min_share=0.002)
+        handle = tree['children'][0]
+        self.assertEqual((handle['name'], handle['value'], handle['width']), ('app:handle', 1000, 100))
+        self.assertEqual([child['name'] for child in handle['children']], ['db:query']) # render is under 0.2%
+        self.assertIn('test_profiling:TestRequestProfiler.test_flame_tree_nests_collapsed_stacks',
+                      collapse(sys._getframe()))
+
+if __name__ == '__main__':
+    unittest.main()
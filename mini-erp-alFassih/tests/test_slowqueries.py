@@ -0,0 +1,78 @@
+import unittest
+import sys
+import os
+import json
+import shutil
+import tempfile
+from datetime import datetime
+from flask import url_for
+
+# Add the project root to sys.path to allow direct import of mini_erp_alFassih
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from mini_erp_alFassih.mini_erp_alFassih import app, db, models
+from mini_erp_alFassih.mini_erp_alFassih.slowqueries import slow_queries, parameter_shape
+
+class TestSlowQueryLog(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.log_dir = tempfile.mkdtemp()
+        app.config['SLOW_QUERY_LOG_PATH'] = os.path.join(self.log_dir, 'slow_queries.log')
+        app.config['SLOW_QUERY_THRESHOLD_MS'] = 0.001 # Every statement counts as slow
+        slow_queries.init_app(app)
+        self.request_context = app.test_request_context()
+        self.request_context.push()
+        self.client = app.test_client()
+        db.create_all()
+
+        user = models.User(email='slow_queries_user@example.com', role='staff')
+        user.set_password('testpass')
+        db.session.add_all([user, models.Patient(first_name='Leila', last_name='Mansour')])
+        db.session.commit()
+        self.client.post(url_for('auth.login'), data=dict(email='slow_queries_user@example.com', password='testpass'))
+        slow_queries.drain()
+
+    def tearDown(self):
+        slow_queries.drain()
+        db.session.remove()
+        db.drop_all()
+        self.request_context.pop()
+        app.config['SLOW_QUERY_THRESHOLD_MS'] = 200
+        app.config['SLOW_QUERY_LOG_PATH'] = None
+        slow_queries.init_app(app)
+        shutil.rmtree(self.log_dir)
+
+    def test_parameter_shapes_leave_out_values(self):
+        shape = parameter_shape(('Leila', 3, None, datetime(2027, 1, 4)))
+        self.assertEqual(shape, '(str[5], int, null, datetime)')
+        self.assertEqual(parameter_shape({'name': 'Leila'}), '{name: str[5]}')
+
+    def test_slow_statements_are_logged_with_endpoint_and_plan(self):
+        response = self.client.get(url_for('patients.list_patients', q='lei'))
+        self.assertEqual(response.status_code, 200)
+        records = slow_queries.drain()
+        patient_queries = [r for r in records if 'FROM patient' in r['statement']]
+        self.assertTrue(patient_queries)
+        record = patient_queries[0]
+        self.assertEqual(record['endpoint'], 'patients.list_patients')
+        self.assertTrue(record['plan'])
+        self.assertNotIn('lei', record['parameters'])
+
+        with open(app.config['SLOW_QUERY_LOG_PATH'], encoding='utf-8') as log_file:
+            logged = [json.loads(line) for line in log_file]
+        self.assertEqual(logged[-len(records):], records)
+
+    def test_summary_command_groups_statements(self):
+        self.client.get(url_for('patients.list_patients'))
+        self.client.get(url_for('patients.list_patients'))
+        slow_queries.drain()
+        result = app.test_cli_runner().invoke(args=['slow-queries', 'summary', '--top', '50'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('patients.list_patients', result.output)
+        self.assertIn('2 x', result.output)
+
+if __name__ == '__main__':
+    unittest.main()
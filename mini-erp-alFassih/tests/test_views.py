@@ -3,14 +3,25 @@ import sys
 import os
 import io # For dummy file uploads
 import shutil # For cleaning up upload folder
+import tempfile
+import zipfile
+import xml.etree.ElementTree as ElementTree
 from datetime import datetime, timedelta # For Session tests
-from flask import url_for # Added url_for
+from flask import url_for, g # Added url_for
 
 # Add the project root to sys.path to allow direct import of mini_erp_alFassih
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.insert(0, project_root)
 
 from mini_erp_alFassih.mini_erp_alFassih import app, db, models
+from mini_erp_alFassih.mini_erp_alFassih.rollups import refresh_rollups
+from mini_erp_alFassih.mini_erp_alFassih.jobqueue import JobQueue
+from mini_erp_alFassih.mini_erp_alFassih.jobs import jobs
+from mini_erp_alFassih.mini_erp_alFassih.jobs.worker import Worker
+from mini_erp_alFassih.mini_erp_alFassih.reports.export import RENDER_TASK
+from mini_erp_alFassih.mini_erp_alFassih.replicas import replica_router, PRIMARY_UNTIL_KEY
+from mini_erp_alFassih.mini_erp_alFassih.querystats import query_stats, count_queries, QueryBudgetExceeded
+from mini_erp_alFassih.mini_erp_alFassih.admin.routes import _stats_cache
 
 class TestPatientViews(unittest.TestCase):
     def setUp(self):
@@ -175,6 +186,249 @@ class TestPatientViews(unittest.TestCase):
         self.assertIn(b"404 - Page Not Found", response.data)
         self.assertIn(b"Sorry, the page you are looking for does not exist.", response.data)
 
+class TestPatientDetailSessionHistory(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        app.config['PATIENT_SESSIONS_PER_PAGE'] = 3
+        self.request_context = app.test_request_context() # Lets url_for build URLs outside a request
+        self.request_context.push()
+        self.client = app.test_client()
+        db.create_all()
+
+        self.user = models.User(email='history_user@example.com', role='therapist')
+        self.user.set_password('testpass')
+        self.patient = models.Patient(first_name='History', last_name='Patient')
+        self.therapist = models.Therapist(first_name='Dr. History', last_name='Therapist')
+        db.session.add_all([self.user, self.patient, self.therapist])
+        db.session.commit()
+
+        base_time = datetime(2024, 1, 1, 9, 0)
+        for day in range(7):
+            start_time = base_time + timedelta(days=day)
+            db.session.add(models.Session(patient_id=self.patient.id, therapist_id=self.therapist.id,
+                                          start_time=start_time, end_time=start_time + timedelta(hours=1),
+                                          session_type=f'Visit {day}',
+                                          status='Completed' if day < 5 else 'Scheduled'))
+        db.session.commit()
+
+        self.client.post(url_for('auth.login'), data=dict(email='history_user@example.com', password='testpass'))
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        app.config['PATIENT_SESSIONS_PER_PAGE'] = 20
+        self.request_context.pop()
+
+    def test_detail_shows_latest_page_and_counts(self):
+        response = self.client.get(url_for('patients.view_patient', patient_id=self.patient.id))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Visit 6', response.data)
+        self.assertIn(b'Visit 4', response.data)
+        self.assertNotIn(b'Visit 3', response.data)
+        self.assertIn(b'Total Sessions:</strong> 7', response.data)
+        self.assertIn(b'Completed: 5', response.data)
+        self.assertIn(b'Load More Sessions', response.data)
+
+    def test_load_more_returns_next_rows_and_next_page_header(self):
+        response = self.client.get(url_for('patients.patient_sessions', patient_id=self.patient.id, page=2))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Visit 3', response.data)
+        self.assertIn(b'Visit 1', response.data)
+        self.assertNotIn(b'Visit 4', response.data)
+        self.assertEqual(response.headers['X-Next-Page'],
+                         url_for('patients.patient_sessions', patient_id=self.patient.id, page=3))
+
+        last_page = self.client.get(url_for('patients.patient_sessions', patient_id=self.patient.id, page=3))
+        self.assertIn(b'Visit 0', last_page.data)
+        self.assertNotIn('X-Next-Page', last_page.headers)
+
+class TestPatientSearch(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.request_context = app.test_request_context()
+        self.request_context.push()
+        self.client = app.test_client()
+        db.create_all()
+
+        user = models.User(email='search_user@example.com', role='staff')
+        user.set_password('testpass')
+        db.session.add_all([user,
+                            models.Patient(first_name='Sára', last_name='Al-Khalil'),
+                            models.Patient(first_name='Khaled', last_name='Omari'),
+                            models.Patient(first_name='Nour', last_name='Saraf')])
+        db.session.commit()
+        self.client.post(url_for('auth.login'), data=dict(email='search_user@example.com', password='testpass'))
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.request_context.pop()
+
+    def _names(self, query):
+        response = self.client.get(url_for('patients.list_patients', q=query))
+        self.assertEqual(response.status_code, 200)
+        return {name for name in ('Khalil', 'Omari', 'Saraf') if name.encode() in response.data}
+
+    def test_every_word_must_start_a_name_word(self):
+        self.assertEqual(self._names('sara khal'), {'Khalil'}) # Accents and case are ignored
+        self.assertEqual(self._names('kha'), {'Khalil', 'Omari'})
+        self.assertEqual(self._names('ara'), set()) # Not the start of a word
+
+    def test_blank_search_lists_everyone(self):
+        self.assertEqual(self._names(' - '), {'Khalil', 'Omari', 'Saraf'})
+
+    def test_next_session_in_the_past_counts_as_none(self):
+        # Summaries as they stand before the refresh job has caught up with Omari's session
+        now = datetime.utcnow()
+        patients = models.Patient.__table__
+        db.session.execute(patients.update().where(patients.c.last_name == 'Omari').values(next_session_at=now - timedelta(hours=1)))
+        db.session.execute(patients.update().where(patients.c.last_name == 'Saraf').values(next_session_at=now + timedelta(days=1)))
+        db.session.commit()
+        upcoming = self.client.get(url_for('patients.list_patients', activity='upcoming')).data
+        inactive = self.client.get(url_for('patients.list_patients', activity='inactive')).data
+        self.assertEqual({name for name in ('Khalil', 'Omari', 'Saraf') if name.encode() in upcoming}, {'Saraf'})
+        self.assertEqual({name for name in ('Khalil', 'Omari', 'Saraf') if name.encode() in inactive}, {'Khalil', 'Omari'})
+
+class TestReadReplicaRouting(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.replica_dir = tempfile.mkdtemp()
+        app.config['REPLICA_DATABASE_URLS'] = [f"sqlite:///{os.path.join(self.replica_dir, 'replica.db')}"]
+        replica_router.init_app(app)
+        self.request_context = app.test_request_context()
+        self.request_context.push()
+        self.client = app.test_client()
+        db.create_all()
+
+        # The replica holds different rows, so each page shows which database it read
+        replica = replica_router.engines[0]
+        db.metadata.create_all(replica)
+        with replica.begin() as conn:
+            conn.execute(models.Patient.__table__.insert(), [{'id': 500, 'first_name': 'Replica', 'last_name': 'Row'}])
+
+        user = models.User(email='replica_user@example.com', role='staff')
+        user.set_password('testpass')
+        db.session.add_all([user, models.Patient(first_name='Primary', last_name='Row')])
+        db.session.commit()
+        self.client.post(url_for('auth.login'), data=dict(email='replica_user@example.com', password='testpass'))
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.request_context.pop()
+        app.config['REPLICA_DATABASE_URLS'] = []
+        replica_router.init_app(app)
+        shutil.rmtree(self.replica_dir)
+
+    def _end_primary_window(self):
+        with self.client.session_transaction() as client_session:
+            client_session.pop(PRIMARY_UNTIL_KEY, None)
+
+    def _reads_from(self):
+        response = self.client.get(url_for('patients.list_patients'))
+        self.assertEqual(response.status_code, 200)
+        return {name for name in ('Replica', 'Primary') if name.encode() in response.data}
+
+    def test_reads_stay_on_primary_right_after_a_post(self):
+        self.assertEqual(self._reads_from(), {'Primary'}) # The login POST opened the window
+
+    def test_routed_views_read_from_replica(self):
+        self._end_primary_window()
+        self.assertEqual(self._reads_from(), {'Replica'})
+        response = self.client.get(url_for('patients.view_patient', patient_id=1)) # Not routed
+        self.assertEqual(response.status_code, 200)
+
+    def test_dashboard_counters_are_cached_from_the_primary(self):
+        models.User.query.filter_by(email='replica_user@example.com').one().role = 'admin'
+        db.session.commit()
+        with replica_router.engines[0].begin() as conn: # A replica that has not caught up differs in its counts
+            conn.execute(models.Patient.__table__.insert(), [{'id': 501, 'first_name': 'Replica', 'last_name': 'Two'}])
+        self._end_primary_window()
+        _stats_cache['stats'] = None
+        response = self.client.get(url_for('admin.admin_dashboard_stats'))
+        self.assertEqual(response.json['total_patients'], 1)
+
+    def test_writes_go_to_primary_and_pin_later_reads(self):
+        self._end_primary_window()
+        response = self.client.post(url_for('patients.create_patient'), data=dict(first_name='Written', last_name='Row'))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(models.Patient.query.filter_by(first_name='Written').count(), 1)
+        self.assertEqual(self._reads_from(), {'Primary'})
+
+    def test_unreachable_replica_falls_back_to_primary(self):
+        app.config['REPLICA_DATABASE_URLS'] = ['sqlite:////nonexistent-directory/replica.db']
+        replica_router.init_app(app)
+        self._end_primary_window()
+        self.assertEqual(self._reads_from(), {'Primary'})
+
+class TestQueryInstrumentation(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.request_context = app.test_request_context()
+        self.request_context.push()
+        self.client = app.test_client()
+        db.create_all()
+        query_stats.clear()
+
+        user = models.User(email='queries_user@example.com', role='staff')
+        user.set_password('testpass')
+        patients = [models.Patient(first_name=f'Patient{n}', last_name='Queries') for n in range(6)]
+        db.session.add_all([user] + patients)
+        db.session.flush()
+        db.session.add_all([models.Document(patient_id=patient.id, title='Report', filename=f'report{patient.id}.pdf')
+                            for patient in patients])
+        db.session.commit()
+        self.client.post(url_for('auth.login'), data=dict(email='queries_user@example.com', password='testpass'))
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.request_context.pop()
+
+    def test_responses_report_query_count_and_time(self):
+        response = self.client.get(url_for('patients.list_patients')) # Within its @query_budget, or this raises
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response.headers['Server-Timing'], r'^db;dur=[0-9.]+;desc="[0-9]+ queries"$')
+        totals = query_stats.snapshot()['patients.list_patients']
+        self.assertEqual(totals['requests'], 1)
+        self.assertGreater(totals['queries'], 0)
+
+    def test_count_queries_spots_lazy_loads_in_a_loop(self):
+        db.session.expire_all()
+        with count_queries() as stats:
+            for patient in models.Patient.query.all():
+                patient.documents
+        self.assertEqual(stats.count, 7)
+        self.assertEqual([n for _, n in stats.repeated(5)], [6])
+
+    def test_repeated_statements_are_logged_as_n_plus_one(self):
+        with app.test_request_context(url_for('patients.list_patients')):
+            app.preprocess_request()
+            for patient in models.Patient.query.all():
+                db.session.expire(patient)
+                patient.documents
+            with self.assertLogs(app.logger, 'WARNING') as logs:
+                app.do_teardown_request()
+        self.assertIn('Possible N+1 in patients.list_patients', logs.output[0])
+        self.assertEqual(query_stats.snapshot()['patients.list_patients']['n_plus_one'], 1)
+
+    def test_exceeding_the_budget_fails_under_testing(self):
+        with app.test_request_context(url_for('patients.list_patients')):
+            app.preprocess_request()
+            g.query_budget = 1
+            models.Patient.query.count()
+            models.Document.query.count()
+            with self.assertRaises(QueryBudgetExceeded):
+                app.process_response(app.response_class(''))
+
 class TestAuthViews(unittest.TestCase):
     def setUp(self):
         app.config['TESTING'] = True
@@ -443,6 +697,662 @@ class TestSessionViews(unittest.TestCase):
         cancelled_session = db.session.get(models.Session, session.id)
         self.assertEqual(cancelled_session.status, 'Cancelled')
 
+class TestSessionListPagination(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        app.config['SESSIONS_PER_PAGE'] = 4
+        self.request_context = app.test_request_context()
+        self.request_context.push()
+        self.client = app.test_client()
+        db.create_all()
+
+        self.user = models.User(email='paging_user@example.com', role='therapist')
+        self.user.set_password('testpass')
+        self.patient = models.Patient(first_name='Paging', last_name='Patient')
+        self.therapist = models.Therapist(first_name='Dr. Paging', last_name='One')
+        self.other_therapist = models.Therapist(first_name='Dr. Paging', last_name='Two')
+        db.session.add_all([self.user, self.patient, self.therapist, self.other_therapist])
+        db.session.commit()
+
+        # Ten sessions on consecutive days, alternating therapists; two share a start time to exercise the id tiebreak
+        base_time = datetime(2024, 3, 1, 10, 0)
+        for index in range(10):
+            start_time = base_time + timedelta(days=min(index, 8))
+            therapist = self.therapist if index % 2 == 0 else self.other_therapist
+            db.session.add(models.Session(patient_id=self.patient.id, therapist_id=therapist.id,
+                                          start_time=start_time, end_time=start_time + timedelta(hours=1),
+                                          session_type=f'Slot {index}', status='Scheduled' if index > 5 else 'Completed'))
+        db.session.commit()
+        self.client.post(url_for('auth.login'), data=dict(email='paging_user@example.com', password='testpass'))
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        app.config['SESSIONS_PER_PAGE'] = 50
+        self.request_context.pop()
+
+    def _slots(self, response):
+        return [index for index in range(10) if f'Slot {index}<'.encode() in response.data]
+
+    def test_keyset_pages_walk_the_whole_list_once(self):
+        seen = []
+        url = url_for('sessions.list_sessions')
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(self._slots(response))
+            older = [line for line in response.data.decode().splitlines() if 'Older &rarr;' in line]
+            url = older[0].split('href="')[1].split('"')[0].replace('&amp;', '&') if older else None
+        self.assertEqual(sorted(seen), list(range(10)))
+        self.assertEqual(len(seen), 10)
+
+    def test_newer_link_returns_previous_page(self):
+        first_page = self.client.get(url_for('sessions.list_sessions'))
+        newest = models.Session.query.order_by(models.Session.start_time.desc(), models.Session.id.desc()).all()
+        cursor = f"{newest[3].start_time.isoformat()}_{newest[3].id}"
+        second_page = self.client.get(url_for('sessions.list_sessions', before=cursor))
+        self.assertIn(b'Newer', second_page.data)
+        newer_cursor = f"{newest[4].start_time.isoformat()}_{newest[4].id}"
+        back = self.client.get(url_for('sessions.list_sessions', after=newer_cursor))
+        self.assertEqual(self._slots(back), self._slots(first_page))
+
+    def test_filters_by_status_and_therapist(self):
+        response = self.client.get(url_for('sessions.list_sessions', status='Scheduled', therapist=self.therapist.id))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._slots(response), [6, 8])
+
+    def test_filters_by_date_range(self):
+        response = self.client.get(url_for('sessions.list_sessions', date_from='2024-03-02', date_to='2024-03-03'))
+        self.assertEqual(self._slots(response), [1, 2])
+
+class TestBulkSessionOperations(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.request_context = app.test_request_context()
+        self.request_context.push()
+        self.client = app.test_client()
+        db.create_all()
+
+        self.user = models.User(email='bulk_user@example.com', role='admin')
+        self.user.set_password('testpass')
+        self.patient = models.Patient(first_name='Bulk', last_name='Patient')
+        self.other_patient = models.Patient(first_name='Other', last_name='Patient')
+        self.therapist = models.Therapist(first_name='Dr. Bulk', last_name='Leave')
+        db.session.add_all([self.user, self.patient, self.other_patient, self.therapist])
+        db.session.commit()
+
+        self.day = datetime(2030, 5, 6, 9, 0) # Far enough ahead to stay in the future
+        self.sessions = [self._add_session(self.patient, self.day + timedelta(hours=hour)) for hour in range(3)]
+        self.client.post(url_for('auth.login'), data=dict(email='bulk_user@example.com', password='testpass'))
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.request_context.pop()
+
+    def _add_session(self, patient, start_time, status='Scheduled'):
+        session = models.Session(patient_id=patient.id, therapist_id=self.therapist.id, start_time=start_time,
+                                 end_time=start_time + timedelta(minutes=45), status=status)
+        db.session.add(session)
+        db.session.commit()
+        return session
+
+    def test_bulk_cancel_by_therapist_and_date_range(self):
+        response = self.client.post(url_for('sessions.bulk_sessions', action='cancel'), json={
+            'therapist_id': self.therapist.id, 'date_from': '2030-05-06', 'date_to': '2030-05-06'
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['updated'], 3)
+        db.session.expire_all()
+        self.assertEqual({session.status for session in models.Session.query.all()}, {'Cancelled'})
+        self.assertIsNone(db.session.get(models.Patient, self.patient.id).next_session_at)
+
+    def test_bulk_complete_skips_future_and_non_scheduled(self):
+        past = self._add_session(self.patient, datetime(2020, 1, 1, 9, 0))
+        cancelled = self._add_session(self.patient, datetime(2020, 1, 2, 9, 0), status='Cancelled')
+        response = self.client.post(url_for('sessions.bulk_sessions', action='complete'), json={
+            'session_ids': [past.id, cancelled.id, self.sessions[0].id]
+        })
+        self.assertEqual(response.json['updated_ids'], [past.id])
+        self.assertEqual(len(response.json['skipped']), 2)
+        self.assertEqual(db.session.get(models.Session, past.id).status, 'Completed')
+
+    def test_bulk_reschedule_moves_block_and_reports_conflicts(self):
+        # Next day 10:00 is taken for the same patient by a session that is not being moved
+        blocker = self._add_session(self.patient, self.day + timedelta(days=1, hours=1))
+        response = self.client.post(url_for('sessions.bulk_sessions', action='reschedule'), json={
+            'session_ids': [session.id for session in self.sessions], 'shift_minutes': 24 * 60
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['updated_ids'], [self.sessions[0].id, self.sessions[2].id])
+        self.assertIn(str(blocker.id), response.json['skipped'][0]['reason'])
+        db.session.expire_all()
+        self.assertEqual(db.session.get(models.Session, self.sessions[0].id).start_time, self.day + timedelta(days=1))
+        self.assertEqual(db.session.get(models.Session, self.sessions[1].id).start_time, self.day + timedelta(hours=1))
+
+    def test_bulk_reschedule_does_not_move_onto_a_skipped_session(self):
+        # 10:00 would move onto 11:00, which is not selected, so it stays; 09:00 then can't take 10:00 either
+        response = self.client.post(url_for('sessions.bulk_sessions', action='reschedule'), json={
+            'session_ids': [self.sessions[0].id, self.sessions[1].id], 'shift_minutes': 60
+        })
+        self.assertEqual(response.json['updated_ids'], [])
+        self.assertEqual([skip['session_id'] for skip in response.json['skipped']], [self.sessions[1].id, self.sessions[0].id])
+        self.assertIn(str(self.sessions[1].id), response.json['skipped'][1]['reason'])
+        db.session.expire_all()
+        self.assertEqual(db.session.get(models.Session, self.sessions[0].id).start_time, self.day)
+
+    def test_dry_run_writes_nothing(self):
+        response = self.client.post(url_for('sessions.bulk_sessions', action='cancel'), json={
+            'session_ids': [self.sessions[0].id], 'dry_run': True
+        })
+        self.assertEqual(response.json['updated'], 1)
+        self.assertTrue(response.json['dry_run'])
+        db.session.expire_all()
+        self.assertEqual(db.session.get(models.Session, self.sessions[0].id).status, 'Scheduled')
+
+    def test_unbounded_filter_selection_is_rejected(self):
+        response = self.client.post(url_for('sessions.bulk_sessions', action='cancel'), json={'therapist_id': self.therapist.id})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.json['success'])
+
+class TestReceptionSchedule(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.request_context = app.test_request_context()
+        self.request_context.push()
+        self.client = app.test_client()
+        db.create_all()
+        app.extensions['daily_schedule'].clear()
+
+        self.user = models.User(email='reception@example.com', role='staff')
+        self.user.set_password('testpass')
+        self.patient = models.Patient(first_name='Desk', last_name='Patient')
+        self.therapist = models.Therapist(first_name='Dr. Desk', last_name='Therapist')
+        db.session.add_all([self.user, self.patient, self.therapist])
+        db.session.commit()
+        self.start_time = datetime(2030, 1, 15, 9, 30)
+        self.session = models.Session(patient_id=self.patient.id, therapist_id=self.therapist.id, start_time=self.start_time,
+                                      end_time=self.start_time + timedelta(hours=1), status='Scheduled')
+        db.session.add(self.session)
+        db.session.commit()
+        self.client.post(url_for('auth.login'), data=dict(email='reception@example.com', password='testpass'))
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.request_context.pop()
+
+    def test_json_schedule_groups_by_therapist_and_supports_etag(self):
+        url = url_for('sessions.reception_schedule_json', day='2030-01-15')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['therapists'][0]['therapist_name'], 'Dr. Desk Therapist')
+        self.assertEqual(response.json['therapists'][0]['sessions'][0]['patient_name'], 'Desk Patient')
+
+        not_modified = self.client.get(url, headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_committed_session_writes_patch_the_cached_day(self):
+        url = url_for('sessions.reception_schedule_json', day='2030-01-15')
+        etag = self.client.get(url).headers['ETag']
+
+        self.session.status = 'Cancelled'
+        db.session.commit()
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['therapists'][0]['sessions'][0]['status'], 'Cancelled')
+
+        # Moving the session to the next day removes it from this day's schedule
+        self.session.start_time = self.start_time + timedelta(days=1)
+        self.session.end_time = self.start_time + timedelta(days=1, hours=1)
+        db.session.commit()
+        self.assertEqual(self.client.get(url).json['therapists'], [])
+        next_day = self.client.get(url_for('sessions.reception_schedule_json', day='2030-01-16'))
+        self.assertEqual(len(next_day.json['therapists'][0]['sessions']), 1)
+
+    def test_bulk_updates_reach_the_cache(self):
+        url = url_for('sessions.reception_schedule_json', day='2030-01-15')
+        self.client.get(url)
+        self.client.post(url_for('sessions.bulk_sessions', action='cancel'), json={'session_ids': [self.session.id]})
+        self.assertEqual(self.client.get(url).json['therapists'][0]['sessions'][0]['status'], 'Cancelled')
+
+    def test_fragment_and_page_render(self):
+        fragment = self.client.get(url_for('sessions.reception_schedule_fragment', day='2030-01-15'))
+        self.assertEqual(fragment.status_code, 200)
+        self.assertIn(b'Desk Patient', fragment.data)
+        page = self.client.get(url_for('sessions.reception_schedule', day='2030-01-15'))
+        self.assertIn(b'Reception Schedule', page.data)
+        self.assertEqual(self.client.get(url_for('sessions.reception_schedule', day='not-a-date')).status_code, 404)
+
+class TestLiveEvents(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.request_context = app.test_request_context()
+        self.request_context.push()
+        self.client = app.test_client()
+        db.create_all()
+        self.broker = app.extensions['live_broker']
+        self.subscription = self.broker.subscribe(['schedule', 'dashboard'])
+
+        self.admin = models.User(email='live_admin@example.com', role='admin')
+        self.admin.set_password('testpass')
+        self.staff = models.User(email='live_staff@example.com', role='staff')
+        self.staff.set_password('testpass')
+        self.patient = models.Patient(first_name='Live', last_name='Patient')
+        self.therapist = models.Therapist(first_name='Live', last_name='Therapist')
+        db.session.add_all([self.admin, self.staff, self.patient, self.therapist])
+        db.session.commit()
+        self._drain()
+
+    def tearDown(self):
+        self.broker.unsubscribe(self.subscription)
+        db.session.remove()
+        db.drop_all()
+        self.request_context.pop()
+
+    def _drain(self):
+        messages = []
+        while True:
+            message = self.subscription.get(timeout=0)
+            if message is None:
+                return messages
+            messages.append(message)
+
+    def _login(self, email):
+        self.client.post(url_for('auth.login'), data=dict(email=email, password='testpass'))
+
+    def _add_session(self):
+        start_time = datetime(2030, 2, 1, 10, 0)
+        session = models.Session(patient_id=self.patient.id, therapist_id=self.therapist.id, start_time=start_time,
+                                 end_time=start_time + timedelta(hours=1), status='Scheduled')
+        db.session.add(session)
+        db.session.commit()
+        return session
+
+    def test_committed_session_changes_are_published(self):
+        session = self._add_session()
+        messages = self._drain()
+        created = [m for m in messages if m['event'] == 'session.created']
+        self.assertEqual(created[0]['data']['id'], session.id)
+        self.assertEqual(created[0]['data']['start_time'], '2030-02-01T10:00:00')
+        counters = [m for m in messages if m['event'] == 'counters']
+        self.assertIn({'sessions': 1}, [m['data']['deltas'] for m in counters])
+
+        session.status = 'Cancelled'
+        db.session.commit()
+        self.assertIn('session.cancelled', [m['event'] for m in self._drain()])
+
+    def test_rolled_back_changes_are_not_published(self):
+        db.session.add(models.Patient(first_name='Never', last_name='Saved'))
+        db.session.flush()
+        db.session.rollback()
+        self.assertEqual(self._drain(), [])
+
+    def test_stream_checks_channel_access(self):
+        self._login('live_staff@example.com')
+        self.assertEqual(self.client.get(url_for('live.stream', channels='dashboard')).status_code, 403)
+        self.assertEqual(self.client.get(url_for('live.stream', channels='unknown')).status_code, 403)
+
+        app.config['LIVE_EVENTS_STREAM_SECONDS'] = 0 # End the stream right after its preamble
+        try:
+            response = self.client.get(url_for('live.stream', channels='schedule'))
+            self.assertEqual(response.mimetype, 'text/event-stream')
+            self.assertTrue(response.get_data(as_text=True).startswith('retry:'))
+        finally:
+            app.config['LIVE_EVENTS_STREAM_SECONDS'] = 300
+
+    def test_dashboard_stats_refresh_after_changes(self):
+        self._login('live_admin@example.com')
+        url = url_for('admin.admin_dashboard_stats')
+        self.assertEqual(self.client.get(url).json['total_patients'], 1)
+        db.session.add(models.Patient(first_name='Second', last_name='Patient'))
+        db.session.commit()
+        self.assertEqual(self.client.get(url).json['total_patients'], 2)
+
+    def test_remote_schedule_events_mark_the_cache_stale(self):
+        session = self._add_session()
+        schedule_cache = app.extensions['daily_schedule']
+        schedule_cache.get(session.start_time.date())
+        # Simulate another worker process committing a change this process never flushed
+        db.session.execute(db.update(models.Session).where(models.Session.id == session.id).values(status='Completed'))
+        db.session.commit()
+        self.broker._dispatch({'channel': 'schedule', 'event': 'session.updated', 'origin': 'other-process',
+                               'data': {'id': session.id}})
+        day = schedule_cache.get(session.start_time.date())
+        self.assertEqual(day.entries[session.id]['status'], 'Completed')
+
+class TestTherapistCalendarFeed(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.request_context = app.test_request_context()
+        self.request_context.push()
+        self.client = app.test_client()
+        db.create_all()
+        app.extensions['calendar_feeds'].clear()
+
+        self.patient = models.Patient(first_name='Feed', last_name='Patient')
+        self.therapist = models.Therapist(first_name='Feed', last_name='Therapist')
+        self.therapist.regenerate_calendar_token()
+        db.session.add_all([self.patient, self.therapist])
+        db.session.commit()
+        start_time = datetime.now().replace(hour=10, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        self.session = models.Session(patient_id=self.patient.id, therapist_id=self.therapist.id, start_time=start_time,
+                                      end_time=start_time + timedelta(hours=1), session_type='Speech', status='Scheduled')
+        db.session.add(self.session)
+        db.session.commit()
+        self.url = url_for('sessions.therapist_calendar', token=self.therapist.calendar_token)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.request_context.pop()
+
+    def test_unknown_token_is_not_found(self):
+        self.assertEqual(self.client.get(url_for('sessions.therapist_calendar', token='nope')).status_code, 404)
+
+    def test_feed_lists_sessions_and_revalidates(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/calendar')
+        body = response.get_data(as_text=True)
+        self.assertIn(f'UID:session-{self.session.id}@al-fasih', body)
+        self.assertIn('SUMMARY:Speech: Feed P.', body)
+        self.assertIsNotNone(response.last_modified)
+
+        not_modified = self.client.get(self.url, headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_session_changes_invalidate_the_feed(self):
+        user = models.User(email='calendar_staff@example.com', role='staff')
+        user.set_password('testpass')
+        db.session.add(user)
+        db.session.commit()
+        self.client.post(url_for('auth.login'), data=dict(email='calendar_staff@example.com', password='testpass'))
+        etag = self.client.get(self.url).headers['ETag']
+        # Bulk updates bypass the ORM unit of work, so they must bump updated_at themselves
+        self.client.post(url_for('sessions.bulk_sessions', action='cancel'), json={'session_ids': [self.session.id]})
+        response = self.client.get(self.url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('STATUS:CANCELLED', response.get_data(as_text=True))
+
+        db.session.delete(self.session)
+        db.session.commit()
+        self.assertNotIn('BEGIN:VEVENT', self.client.get(self.url).get_data(as_text=True))
+
+    def test_admin_can_issue_a_new_token(self):
+        admin = models.User(email='calendar_admin@example.com', role='admin')
+        admin.set_password('testpass')
+        db.session.add(admin)
+        db.session.commit()
+        self.client.post(url_for('auth.login'), data=dict(email='calendar_admin@example.com', password='testpass'))
+        old_token = self.therapist.calendar_token
+        self.client.post(url_for('admin.regenerate_calendar_token', therapist_id=self.therapist.id))
+        db.session.refresh(self.therapist)
+        self.assertNotEqual(self.therapist.calendar_token, old_token)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+class TestTherapistAnalytics(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.request_context = app.test_request_context()
+        self.request_context.push()
+        self.client = app.test_client()
+        db.create_all()
+        app.extensions['analytics'].clear()
+
+        admin = models.User(email='analytics_admin@example.com', role='admin')
+        admin.set_password('testpass')
+        patient = models.Patient(first_name='Stat', last_name='Patient')
+        self.busy = models.Therapist(first_name='Busy', last_name='Therapist')
+        self.idle = models.Therapist(first_name='Idle', last_name='Therapist')
+        db.session.add_all([admin, patient, self.busy, self.idle])
+        db.session.commit()
+        # March 2020: Monday 2nd and Tuesday 10th (two ISO weeks)
+        self.sessions = []
+        for day, hours, status in ((2, 1, 'Completed'), (2, 2, 'No Show'), (10, 1, 'Cancelled'), (10, 1, 'Completed')):
+            start = datetime(2020, 3, day, 9 + len(self.sessions))
+            self.sessions.append(models.Session(patient_id=patient.id, therapist_id=self.busy.id, start_time=start,
+                                                end_time=start + timedelta(hours=hours), status=status))
+        db.session.add_all(self.sessions)
+        db.session.commit()
+        self.client.post(url_for('auth.login'), data=dict(email='analytics_admin@example.com', password='testpass'))
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.request_context.pop()
+
+    def _report(self):
+        return self.client.get(url_for('admin.therapist_analytics', month='2020-03', format='json')).json
+
+    def test_utilization_and_rates_per_therapist(self):
+        report = self._report()
+        busy = next(row for row in report['therapists'] if row['therapist_id'] == self.busy.id)
+        self.assertEqual(busy['total'], 4)
+        self.assertEqual(busy['booked_hours'], 4.0) # Cancelled hour excluded
+        self.assertAlmostEqual(busy['available_hours'], 40 * 31 / 7, places=2)
+        self.assertEqual(busy['completion_rate'], 0.5)
+        self.assertEqual(busy['no_show_rate'], 0.25)
+        idle = next(row for row in report['therapists'] if row['therapist_id'] == self.idle.id)
+        self.assertEqual((idle['total'], idle['utilization']), (0, 0.0))
+
+    def test_weekly_trend(self):
+        weeks = self._report()['weeks']
+        self.assertEqual([week['week'] for week in weeks], ['2020-03-02', '2020-03-09'])
+        self.assertEqual([week['total'] for week in weeks], [2, 2])
+
+    def test_cached_report_is_recomputed_after_changes(self):
+        self.assertEqual(self._report()['totals']['completed'], 2)
+        self.sessions[1].status = 'Completed'
+        db.session.commit()
+        self.assertEqual(self._report()['totals']['completed'], 3)
+
+    def test_page_renders(self):
+        response = self.client.get(url_for('admin.therapist_analytics', month='2020-03', months=2))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Busy Therapist', response.data)
+
+class TestReportingRollups(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.request_context = app.test_request_context()
+        self.request_context.push()
+        self.client = app.test_client()
+        db.create_all()
+
+        admin = models.User(email='rollup_admin@example.com', role='admin')
+        admin.set_password('testpass')
+        self.patient = models.Patient(first_name='Roll', last_name='Up', created_at=datetime(2020, 3, 1, 8, 15))
+        self.therapist = models.Therapist(first_name='Rollup', last_name='Therapist')
+        db.session.add_all([admin, self.patient, self.therapist])
+        db.session.commit()
+        self.sessions = [self._add_session(datetime(2020, 3, 2, 9), 'Completed'),
+                         self._add_session(datetime(2020, 3, 2, 9, 30), 'Completed'),
+                         self._add_session(datetime(2020, 3, 10, 14), 'Cancelled')]
+        db.session.commit()
+        self._refresh()
+        self.client.post(url_for('auth.login'), data=dict(email='rollup_admin@example.com', password='testpass'))
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.request_context.pop()
+
+    def _add_session(self, start, status='Scheduled'):
+        session = models.Session(patient_id=self.patient.id, therapist_id=self.therapist.id, start_time=start,
+                                 end_time=start + timedelta(minutes=30), status=status, session_type='Speech')
+        db.session.add(session)
+        return session
+
+    def _refresh(self, **kwargs):
+        refresh_rollups(lag=0, **kwargs)
+        db.session.commit()
+
+    def _counts(self, grain, month='2020-03'):
+        """{(bucket, status): session_count} from the series endpoint."""
+        series = self.client.get(url_for('admin.analytics_series', grain=grain, month=month)).json
+        return {(row['bucket'], row['status']): row['session_count'] for row in series['sessions']}
+
+    def test_initial_build_at_every_grain(self):
+        self.assertEqual(self._counts('hour'), {('2020-03-02T09:00:00', 'Completed'): 2,
+                                                ('2020-03-10T14:00:00', 'Cancelled'): 1})
+        self.assertEqual(self._counts('day'), {('2020-03-02T00:00:00', 'Completed'): 2,
+                                               ('2020-03-10T00:00:00', 'Cancelled'): 1})
+        series = self.client.get(url_for('admin.analytics_series', grain='month', month='2020-03')).json
+        completed = next(row for row in series['sessions'] if row['status'] == 'Completed')
+        self.assertEqual((completed['session_count'], completed['booked_minutes']), (2, 60))
+        self.assertEqual(series['activity'][0]['new_patients'], 1)
+
+    def test_incremental_refresh_picks_up_new_and_edited_sessions(self):
+        self._add_session(datetime(2020, 3, 10, 15), 'Completed')
+        self.sessions[0].status = 'No Show'
+        db.session.commit()
+        self._refresh()
+        self.assertEqual(self._counts('month'), {('2020-03-01T00:00:00', 'Completed'): 2,
+                                                 ('2020-03-01T00:00:00', 'No Show'): 1,
+                                                 ('2020-03-01T00:00:00', 'Cancelled'): 1})
+
+    def test_moved_and_deleted_sessions_leave_their_old_buckets(self):
+        self.sessions[0].start_time = datetime(2020, 4, 6, 9)
+        self.sessions[0].end_time = datetime(2020, 4, 6, 9, 30)
+        db.session.delete(self.sessions[2])
+        db.session.commit()
+        self._refresh()
+        self.assertEqual(self._counts('day'), {('2020-03-02T00:00:00', 'Completed'): 1})
+        self.assertEqual(self._counts('day', month='2020-04'), {('2020-04-06T00:00:00', 'Completed'): 1})
+        self.assertEqual(models.RollupStaleHour.query.count(), 0)
+
+    def test_rebuild_matches_incremental_result(self):
+        self._add_session(datetime(2020, 3, 20, 10))
+        db.session.commit()
+        self._refresh()
+        incremental = self._counts('hour')
+        self._refresh(rebuild=True)
+        self.assertEqual(self._counts('hour'), incremental)
+
+    def test_unknown_grain_is_rejected(self):
+        response = self.client.get(url_for('admin.analytics_series', grain='week'))
+        self.assertEqual(response.status_code, 400)
+
+class TestActivityReportExport(unittest.TestCase):
+    SHEET = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.tmpdir = tempfile.mkdtemp()
+        app.config['REPORT_CACHE_DIR'] = os.path.join(self.tmpdir, 'reports')
+        app.config['REPORT_BATCH_SIZE'] = 2 # Several batches and XLSX chunks even for this small month
+        self.app_queue, jobs.queue = jobs.queue, JobQueue(os.path.join(self.tmpdir, 'jobs.sqlite3'))
+        self.request_context = app.test_request_context()
+        self.request_context.push()
+        self.client = app.test_client()
+        db.create_all()
+
+        admin = models.User(email='report_admin@example.com', role='admin')
+        admin.set_password('testpass')
+        self.patients = [models.Patient(first_name='سارة', last_name='Khalil'),
+                         models.Patient(first_name='Omar', last_name='Nasser'),
+                         models.Patient(first_name='Lina', last_name='Saad')]
+        self.therapist = models.Therapist(first_name='Report', last_name='Therapist')
+        db.session.add_all([admin, self.therapist] + self.patients)
+        db.session.commit()
+        for patient, day, status in ((0, 2, 'Completed'), (0, 9, 'No Show'), (1, 3, 'Cancelled'),
+                                     (2, 4, 'Completed'), (2, 30, 'Scheduled'), (2, 1, 'Completed')):
+            start = datetime(2020, 3 if day != 1 else 4, day, 10)
+            db.session.add(models.Session(patient_id=self.patients[patient].id, therapist_id=self.therapist.id,
+                                          start_time=start, end_time=start + timedelta(minutes=45), status=status))
+        db.session.commit()
+        self.client.post(url_for('auth.login'), data=dict(email='report_admin@example.com', password='testpass'))
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.request_context.pop()
+        jobs.queue = self.app_queue
+        app.config['REPORT_CACHE_DIR'] = None
+        app.config['REPORT_BATCH_SIZE'] = 500
+        shutil.rmtree(self.tmpdir)
+
+    def _get(self, fmt, **kwargs):
+        return self.client.get(url_for('reports.activity_report', fmt=fmt, month='2020-03'), **kwargs)
+
+    def test_csv_summarizes_each_patient_for_the_month(self):
+        response = self._get('csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('attachment; filename=activity-report-2020-03.csv', response.headers['Content-Disposition'])
+        lines = response.data.decode('utf-8-sig').splitlines()
+        self.assertEqual(lines[0].split(',')[:4], ['Therapist', 'Patient ID', 'Patient', 'Sessions'])
+        self.assertEqual(len(lines), 4) # Header and three patients; the April session is outside the month
+        self.assertEqual(lines[1].split(',')[2:9], ['سارة Khalil', '2', '1', '0', '1', '0', '1.5'])
+        self.assertEqual(lines[2].split(',')[2:9], ['Omar Nasser', '1', '0', '1', '0', '0', '0.0'])
+
+    def test_xlsx_is_a_readable_workbook(self):
+        response = self._get('xlsx')
+        self.assertEqual(response.status_code, 200)
+        with zipfile.ZipFile(io.BytesIO(response.data)) as workbook:
+            self.assertIsNone(workbook.testzip())
+            sheet = ElementTree.fromstring(workbook.read('xl/worksheets/sheet1.xml'))
+        rows = sheet.findall(f'{self.SHEET}sheetData/{self.SHEET}row')
+        self.assertEqual(len(rows), 4)
+        cells = [cell.findtext(f'{self.SHEET}is/{self.SHEET}t') or cell.findtext(f'{self.SHEET}v') for cell in rows[3]]
+        self.assertEqual(cells[2:5], ['Lina Saad', '2', '1'])
+
+    def test_unchanged_month_revalidates_with_304(self):
+        etag = self._get('csv').headers['ETag'].strip('"')
+        self.assertEqual(self._get('csv', headers={'If-None-Match': f'"{etag}"'}).status_code, 304)
+        session = models.Session.query.filter_by(status='Scheduled').first()
+        session.status = 'Cancelled'
+        db.session.commit()
+        self.assertEqual(self._get('csv', headers={'If-None-Match': f'"{etag}"'}).status_code, 200)
+
+    def test_renamed_therapist_changes_the_etag(self):
+        etag = self._get('csv').headers['ETag'].strip('"')
+        self.therapist.last_name = 'Renamed'
+        db.session.commit()
+        response = self._get('csv', headers={'If-None-Match': f'"{etag}"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Report Renamed', response.data.decode('utf-8-sig'))
+
+    def test_background_render_is_served_until_the_month_changes(self):
+        response = self.client.post(url_for('reports.render_activity_report', fmt='xlsx', month='2020-03'))
+        self.assertEqual(response.status_code, 202)
+        worker = Worker(app, jobs, task_names=[RENDER_TASK])
+        self.assertTrue(worker.run_once())
+        job = self.client.get(response.json['status_url']).json
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(os.listdir(app.config['REPORT_CACHE_DIR']), [job['result']['file']])
+        self.assertEqual(self._get('xlsx').headers['ETag'].strip('"'), job['result']['etag'])
+
+        # Asking again before anything changes reuses the finished job
+        again = self.client.post(url_for('reports.render_activity_report', fmt='xlsx', month='2020-03'))
+        self.assertEqual(again.json['job_id'], response.json['job_id'])
+
+        db.session.add(models.Session(patient_id=self.patients[1].id, therapist_id=self.therapist.id,
+                                      start_time=datetime(2020, 3, 20, 9), end_time=datetime(2020, 3, 20, 10)))
+        db.session.commit()
+        self.assertNotEqual(self._get('xlsx').headers['ETag'].strip('"'), job['result']['etag'])
+
+    def test_invalid_month_is_rejected(self):
+        response = self.client.get(url_for('reports.activity_report', fmt='csv', month='March'))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get('/reports/activity.pdf?month=2020-03').status_code, 404)
+
 class TestAdminDashboardView(unittest.TestCase):
     def setUp(self):
         app.config['TESTING'] = True